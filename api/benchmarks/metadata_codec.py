@@ -0,0 +1,93 @@
+"""
+Compares the ways instance metadata can be read from/written to a Proxmox description
+
+Run from the api directory:
+
+    python -m benchmarks.metadata_codec [instances]
+"""
+import sys
+import timeit
+import datetime
+import ipaddress
+
+import yaml
+
+from v1 import models
+
+class PurePythonDumper(yaml.SafeDumper):
+    pass
+
+# what the API registers on the SafeDumper at startup, so both paths write the same descriptions
+PurePythonDumper.add_representer(str, models.proxmox._represent_str)
+
+def make_metadata(i: int) -> models.proxmox.Metadata:
+    return models.proxmox.Metadata(
+        groups=["lxc", "ubuntu"],
+        host_vars={ "motd": "Welcome!\nPlease read the rules\n" },
+        owner=f"user{i}",
+        inactivity=models.proxmox.Inactivity(marked_active_at=datetime.date.today()),
+        wake_on_request=False,
+        network=models.proxmox.Network(
+            ports={ 20000 + i: 22, 21000 + i: 80 },
+            vhosts={
+                f"user{i}.netsoc.cloud": models.proxmox.VHostOptions(port=80, https=False),
+                f"blog.user{i}.com": models.proxmox.VHostOptions(port=8080, https=True)
+            },
+            nic_allocation=models.proxmox.NICAllocation(
+                addresses=[ipaddress.IPv4Interface(f"10.50.{i // 250}.{i % 250 + 2}/16")],
+                gateway4=ipaddress.IPv4Address("10.50.0.1"),
+                macaddress="02:00:00:00:00:01"
+            )
+        ),
+        root_user=models.proxmox.RootUser(
+            password_hash="$6$rounds=656000$salt$" + "x" * 86,
+            ssh_public_key="ssh-ed25519 " + "A" * 68 + f" user{i}@netsoc"
+        )
+    )
+
+def pure_python_serialize(metadata: models.proxmox.Metadata) -> str:
+    return yaml.dump(
+        yaml.safe_load(metadata.json()),
+        Dumper=PurePythonDumper,
+        default_flow_style=False,
+        explicit_start=None,
+        default_style='', width=8192
+    )
+
+def pure_python_parse(description: str) -> models.proxmox.Metadata:
+    return models.proxmox.Metadata.parse_obj(yaml.safe_load(description))
+
+def report(name: str, seconds: float, count: int):
+    print(f"{name:<40} {seconds * 1000:>10.1f} ms {seconds / count * 1000000:>10.1f} us/instance")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = 5
+
+    all_metadata = [make_metadata(i) for i in range(count)]
+    descriptions = [pure_python_serialize(metadata) for metadata in all_metadata]
+
+    assert [metadata.to_description() for metadata in all_metadata] == descriptions, "libyaml output differs"
+
+    print(f"{count} instances, libyaml {'available' if yaml.__with_libyaml__ else 'NOT available'}, best of {repeat}\n")
+
+    def best(fn):
+        return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+    report("serialize, pure python", best(lambda: [pure_python_serialize(m) for m in all_metadata]), count)
+    report("serialize, to_description", best(lambda: [m.to_description() for m in all_metadata]), count)
+
+    report("parse, pure python", best(lambda: [pure_python_parse(d) for d in descriptions]), count)
+
+    def parse_uncached():
+        models.proxmox.Description._cache.clear()
+        return [models.proxmox.Metadata.from_description(d) for d in descriptions]
+
+    report("parse, from_description uncached", best(parse_uncached), count)
+
+    for description in descriptions:
+        models.proxmox.Metadata.from_description(description)
+    report("parse, from_description cached", best(lambda: [models.proxmox.Metadata.from_description(d) for d in descriptions]), count)
+
+if __name__ == "__main__":
+    main()
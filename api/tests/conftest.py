@@ -0,0 +1,227 @@
+import os
+import sys
+import types
+
+from pathlib import Path
+
+api_dir = Path(__file__).parent.parent
+
+sys.path.insert(0, str(api_dir))
+os.environ.setdefault("CONFIG_FILE", str(api_dir.parent / "config.sample.yml"))
+
+# importing v1.providers connects to FreeIPA, Proxmox etc. straight away
+# tests import the provider modules they need on their own instead
+providers = types.ModuleType("v1.providers")
+providers.__path__ = [str(api_dir / "v1" / "providers")]
+sys.modules["v1.providers"] = providers
+
+import json
+import datetime
+import threading
+import urllib.parse
+
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubProxmoxError(Exception):
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.message = message
+
+class StubProxmoxServer:
+    """
+        Serves the Proxmox API on localhost from a dict of resources, path -> data, or a function called with
+        (method, params) returning the data or raising StubProxmoxError
+
+        Logs in root@pam with the password "secret" or takes the token root@pam!test=token, like Proxmox a ticket
+        is needed for every request and a CSRF token for anything but GETs. Clearing tickets makes every ticket
+        handed out so far stop working
+    """
+
+    Error = StubProxmoxError
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.requests = []
+        self.logins = 0
+        self.tickets = set()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > 0:
+                    params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode()))
+
+                status_code, body = server._respond(method, url.path[len("/api2/json/"):], params, self.headers)
+
+                raw = json.dumps(body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}/api2/json"
+
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _respond(self, method, path, params, headers):
+        self.requests.append((method, path, params, dict(headers)))
+
+        if path == "access/ticket":
+            if params.get("username") != "root@pam" or params.get("password") != "secret":
+                return 401, {"data": None}
+
+            self.logins += 1
+            ticket = f"ticket-{self.logins}"
+            self.tickets.add(ticket)
+
+            return 200, {"data": {"ticket": ticket, "CSRFPreventionToken": f"csrf-{ticket}"}}
+
+        authorization = headers.get("Authorization")
+        if authorization is not None:
+            if authorization != "PVEAPIToken=root@pam!test=token":
+                return 401, {"data": None}
+        else:
+            ticket = (headers.get("Cookie") or "")[len("PVEAuthCookie="):]
+
+            if ticket not in self.tickets:
+                return 401, {"data": None}
+
+            if method != "GET" and headers.get("CSRFPreventionToken") != f"csrf-{ticket}":
+                return 401, {"data": None}
+
+        if path not in self.resources:
+            return 500, {"data": None, "message": f"no such resource {path}"}
+
+        resource = self.resources[path]
+        if not callable(resource):
+            return 200, {"data": resource}
+
+        try:
+            return 200, {"data": resource(method, params)}
+        except StubProxmoxError as e:
+            return e.status_code, {"data": None, "message": e.message}
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def proxmox_server():
+    server = StubProxmoxServer({})
+    yield server
+    server.close()
+
+class StubContainer:
+    """
+        A container on the stub server with metadata in its description
+
+        Its config can be read and PUT, a PUT with a digest other than the current one fails like it does on Proxmox.
+        before_put is called before each PUT is looked at, i.e to have someone else change the config first
+    """
+
+    def __init__(self, server: StubProxmoxServer, vmid: int, node: str, fqdn: str, description: str):
+        self.resource = {
+            "vmid": vmid, "node": node, "type": "lxc", "name": fqdn, "status": "running", "template": 0,
+            "maxmem": 2 ** 30, "mem": 2 ** 29, "maxdisk": 2 ** 33, "disk": 2 ** 30, "cpu": 0.01, "maxcpu": 1, "uptime": 10
+        }
+        self.config = {
+            "hostname": fqdn, "description": description, "rootfs": "local:100/disk.raw,size=8G",
+            "cores": 1, "memory": 512, "swap": 0, "digest": "digest-0"
+        }
+        self.puts = []
+        self.before_put = None
+
+        server.resources[f"nodes/{node}/lxc/{vmid}/config"] = self._config
+        server.resources[f"nodes/{node}/lxc/{vmid}/status/current"] = self.resource
+
+    def change(self, description: str):
+        """Change the description like someone else writing the config would"""
+        self.config["description"] = description
+        self.config["digest"] = f"digest-{int(self.config['digest'].split('-')[1]) + 1}"
+
+    def _config(self, method, params):
+        if method == "GET":
+            return dict(self.config)
+
+        self.puts.append(params)
+
+        if self.before_put is not None:
+            self.before_put()
+
+        if params.get("digest", self.config["digest"]) != self.config["digest"]:
+            raise StubProxmoxError(500, "detected modified configuration - file changed by other user? Try again.")
+
+        self.change(params["description"])
+
+@pytest.fixture
+def stub_provider(proxmox_server, tmp_path, monkeypatch):
+    """
+        Makes Proxmox providers whose API client talks to the stub server, each stands in for an API worker process
+        and they share nothing but the jobs database
+    """
+    from v1.config import config
+    from v1.providers import proxmox
+
+    monkeypatch.setattr(config.proxmox.cluster.api, "password", "")
+    monkeypatch.setattr(config.proxmox.cluster.api, "username", "root@pam")
+    monkeypatch.setattr(config.proxmox.cluster.api, "token_name", "test")
+    monkeypatch.setattr(config.proxmox.cluster.api, "token_value", "token")
+    monkeypatch.setattr(config.jobs, "database_url", f"sqlite:///{tmp_path / 'jobs.db'}")
+
+    def make() -> proxmox.Proxmox:
+        prox = proxmox.Proxmox()
+        prox.prox._store["base_url"] = proxmox_server.base_url
+
+        return prox
+
+    return make
+
+@pytest.fixture
+def stub_container(proxmox_server):
+    """Makes StubContainers on the stub server, called with (vmid, node, fqdn, owner, ip)"""
+    from v1 import models
+
+    def make(vmid: int, node: str, fqdn: str, owner: str, ip: str) -> StubContainer:
+        description = models.proxmox.Metadata(
+            owner=owner,
+            inactivity=models.proxmox.Inactivity(marked_active_at=datetime.date.today()),
+            wake_on_request=False,
+            network=models.proxmox.Network(
+                nic_allocation=models.proxmox.NICAllocation(
+                    addresses=[f"{ip}/24"],
+                    gateway4="10.10.10.1",
+                    macaddress="02:00:00:00:00:01"
+                )
+            ),
+            root_user=models.proxmox.RootUser(password_hash="hash", ssh_public_key="key")
+        ).to_description()
+
+        return StubContainer(proxmox_server, vmid, node, fqdn, description)
+
+    return make
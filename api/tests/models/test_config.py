@@ -0,0 +1,21 @@
+import os
+
+from pathlib import Path
+
+import yaml
+
+from v1 import models
+
+def sample() -> dict:
+    return yaml.safe_load(Path(os.environ["CONFIG_FILE"]).read_text())
+
+def test_config_without_a_jobs_section():
+    values = sample()
+    del values["jobs"]
+
+    jobs = models.config.Config.parse_obj(values).jobs
+
+    # an absolute path, so every worker process (whatever its working directory) shares the same database
+    assert jobs.database_url.startswith("sqlite:////")
+    assert jobs.database_url.endswith("/jobs.db")
+    assert jobs.workers == 4
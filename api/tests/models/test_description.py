@@ -0,0 +1,69 @@
+import datetime
+
+import yaml
+
+from v1 import models
+
+def metadata() -> models.proxmox.Metadata:
+    return models.proxmox.Metadata(
+        groups=["web"],
+        owner="alice",
+        inactivity=models.proxmox.Inactivity(marked_active_at=datetime.date(2021, 1, 1)),
+        wake_on_request=False,
+        network=models.proxmox.Network(
+            vhosts={"alice.netsoc.cloud": models.proxmox.VHostOptions(port=80)},
+            ports={16384: 22},
+            nic_allocation=models.proxmox.NICAllocation(
+                addresses=["10.10.10.3/24"],
+                gateway4="10.10.10.1",
+                macaddress="02:00:00:00:00:01"
+            )
+        ),
+        root_user=models.proxmox.RootUser(password_hash="hash", ssh_public_key="ssh-ed25519 AAAA\nsecond line"),
+        reason="a reason\nover two lines"
+    )
+
+def test_round_trip():
+    original = metadata()
+    description = original.to_description()
+
+    assert models.proxmox.Metadata.from_description(description) == original
+
+def test_multiline_strings_are_blocks():
+    assert "reason: |" in metadata().to_description()
+
+def test_cached_value_is_what_parsing_gives():
+    original = metadata()
+
+    # assignments aren't validated, so a model can hold values parsing would never give
+    original.groups = {"web"}
+    description = original.to_description()
+    parsed = models.proxmox.Metadata.parse_obj(yaml.safe_load(description))
+
+    cached = models.proxmox.Description._cache[models.proxmox.Metadata._cache_key(description)]
+
+    assert cached == parsed
+    assert type(cached.groups) is type(parsed.groups)
+    assert cached.inactivity.marked_active_at == parsed.inactivity.marked_active_at
+
+def test_callers_get_their_own_copy():
+    description = metadata().to_description()
+
+    first = models.proxmox.Metadata.from_description(description)
+    first.network.ports[16385] = 80
+    first.groups.append("ssh")
+
+    second = models.proxmox.Metadata.from_description(description)
+    assert second.network.ports == {16384: 22}
+    assert second.groups == ["web"]
+
+def test_cache_is_per_model():
+    description = models.proxmox.TemplateMetadata(
+        title="Ubuntu",
+        subtitle="20.04",
+        description="Ubuntu",
+        logo_url="https://example.com/logo.png",
+        wake_on_request=True
+    ).to_description()
+
+    assert type(models.proxmox.TemplateMetadata.from_description(description)) is models.proxmox.TemplateMetadata
@@ -0,0 +1,68 @@
+import time
+
+from v1 import models
+from v1.providers import accounts
+
+def account(username, email, verified=True):
+    return models.account.Account(username=username, email=email, groups={}, home_dir=None, verified=verified)
+
+def test_cache_finds_an_account_either_way():
+    cache = accounts.AccountCache(16, 60, 10)
+    cache.put(account("alice", "Alice@Example.com"))
+
+    assert cache.get_by_username("alice").username == "alice"
+    assert cache.get_by_email("alice@example.com").username == "alice"
+
+def test_cache_follows_email_changes():
+    cache = accounts.AccountCache(16, 60, 10)
+    cache.put(account("alice", "alice@example.com"))
+    cache.put(account("alice", "alice@netsoc.co"))
+
+    assert cache.get_by_email("alice@example.com") is None
+    assert cache.get_by_email("alice@netsoc.co").username == "alice"
+
+def test_cache_missing_and_invalidate():
+    cache = accounts.AccountCache(16, 60, 10)
+    cache.put_missing("email", "Bob@Example.com")
+    cache.put(account("alice", "alice@example.com"))
+
+    assert cache.is_missing("email", "bob@example.com")
+
+    # an account showing up clears the miss for its username and email
+    cache.put(account("bob", "bob@example.com"))
+    assert not cache.is_missing("email", "bob@example.com")
+
+    cache.invalidate(email="alice@example.com")
+    assert cache.get_by_username("alice") is None
+    assert cache.get_by_email("alice@example.com") is None
+
+def test_replica_put_and_remove():
+    replica = accounts.DirectoryReplica()
+    assert replica.age() == float("inf")
+
+    replica.replace({ "alice": account("alice", "alice@example.com") }, time.monotonic())
+    replica.put(account("bob", "Bob@Example.com"))
+    replica.remove("alice")
+
+    assert sorted(replica.all()) == ["bob"]
+    assert replica.get_by_email("bob@example.com").username == "bob"
+    assert replica.get_by_email("alice@example.com") is None
+
+def test_sync_in_flight_keeps_our_writes():
+    replica = accounts.DirectoryReplica()
+    replica.replace({ "alice": account("alice", "alice@example.com"), "bob": account("bob", "bob@example.com", verified=False) }, time.monotonic())
+
+    # a sync starts reading, then we verify bob, delete alice and add carol before it finishes
+    taken_at = time.monotonic()
+    replica.put(account("bob", "bob@example.com"))
+    replica.remove("alice")
+    replica.put(account("carol", "carol@example.com"))
+
+    replica.replace({ "alice": account("alice", "alice@example.com"), "bob": account("bob", "bob@example.com", verified=False) }, taken_at)
+
+    assert sorted(replica.all()) == ["bob", "carol"]
+    assert replica.get_by_username("bob").verified
+
+    # the next sync is taken after our writes, so it wins
+    replica.replace({ "alice": account("alice", "alice@example.com") }, time.monotonic())
+    assert sorted(replica.all()) == ["alice"]
@@ -0,0 +1,183 @@
+import time
+
+import pytest
+
+from v1 import exceptions, models
+from v1.providers import accounts
+from v1.config import config
+
+class FakeFreeIPA:
+    """Just enough of python_freeipa's ClientMeta for the provider, every call is recorded"""
+
+    def __init__(self):
+        self.calls = []
+
+        self.groups = {
+            "admins": { "cn": ["admins"], "objectclass": ["posixgroup"], "gidnumber": ["1000"] },
+            "trust admins": { "cn": ["trust admins"], "objectclass": [] },
+            "ipausers": { "cn": ["ipausers"], "objectclass": [] }
+        }
+
+        # username -> (email, groups)
+        self.users = {
+            "admin": ("admin@example.com", ["admins", "trust admins"]),
+            "alice": ("alice@example.com", ["netsoc_account", "ipausers"])
+        }
+        self.staged = {
+            "bob": "bob@example.com"
+        }
+
+    def group_find(self, o_cn=None, o_sizelimit=None):
+        self.calls.append(("group_find", o_cn))
+
+        result = [group for name, group in self.groups.items() if o_cn in (None, name)]
+        return { "count": len(result), "result": result }
+
+    def group_add(self, a_cn, o_description=None, o_gidnumber=None):
+        self.calls.append(("group_add", a_cn))
+        self.groups[a_cn] = { "cn": [a_cn], "objectclass": ["posixgroup"], "gidnumber": [str(o_gidnumber)], "description": [o_description] }
+
+    def group_add_member(self, a_cn, o_user):
+        self.calls.append(("group_add_member", a_cn, o_user))
+        email, groups = self.users[o_user]
+        self.users[o_user] = (email, groups + [a_cn])
+
+    def user_find(self, o_uid=None, o_mail=None, o_sizelimit=None, o_all=None):
+        self.calls.append(("user_find", o_uid, o_mail))
+
+        result = [
+            { "uid": [username], "mail": [email], "uidnumber": ["2000"], "homedirectory": [f"/home/{username}"], "memberof_group": groups }
+            for username, (email, groups) in self.users.items()
+            if o_uid in (None, username) and o_mail in (None, email)
+        ]
+        return { "count": len(result), "result": result }
+
+    def stageuser_find(self, o_uid=None, o_mail=None, o_sizelimit=None):
+        self.calls.append(("stageuser_find", o_uid, o_mail))
+
+        result = [
+            { "uid": [username], "mail": [email] }
+            for username, email in self.staged.items()
+            if o_uid in (None, username) and o_mail in (None, email)
+        ]
+        return { "count": len(result), "result": result }
+
+    def stageuser_activate(self, username):
+        self.calls.append(("stageuser_activate", username))
+        self.users[username] = (self.staged.pop(username), [])
+
+@pytest.fixture
+def ipa(monkeypatch):
+    ipa = FakeFreeIPA()
+
+    # a client that was just used is handed out without pinging FreeIPA
+    monkeypatch.setattr(accounts.FreeIPA, "_client_instance", ipa)
+    monkeypatch.setattr(accounts.FreeIPA, "_session_timer", time.time() + 3600)
+
+    return ipa
+
+def test_missing_groups_are_added(ipa):
+    accounts.FreeIPA()
+
+    for group in models.group.groups:
+        assert ("group_add", group.group_name) in ipa.calls
+
+def test_unsupported_groups_are_skipped_without_more_lookups(ipa):
+    provider = accounts.FreeIPA()
+    ipa.calls.clear()
+
+    for _ in range(3):
+        admin = provider.read_account_by_username("admin")
+        provider._account_cache = accounts.AccountCache(16, 60, 10)
+
+    assert sorted(admin.groups) == ["admins"]
+    assert [call for call in ipa.calls if call[0] == "group_find"] == []
+
+    with pytest.raises(exceptions.resource.NotFound):
+        provider.read_group_by_name("trust admins")
+
+def test_groups_added_after_the_catalogue_loaded(ipa):
+    provider = accounts.FreeIPA()
+
+    ipa.groups["workshop"] = { "cn": ["workshop"], "objectclass": [] }
+    ipa.groups["new admins"] = { "cn": ["new admins"], "objectclass": [] }
+
+    assert provider.read_group_by_name("workshop").group_name == "workshop"
+
+    with pytest.raises(exceptions.resource.NotFound):
+        provider.read_group_by_name("new admins")
+
+    ipa.calls.clear()
+    with pytest.raises(exceptions.resource.NotFound):
+        provider.read_group_by_name("new admins")
+
+    assert ipa.calls == []
+
+def test_membership_expansion_uses_the_catalogue(ipa):
+    provider = accounts.FreeIPA()
+    ipa.calls.clear()
+
+    alice = provider.read_account_by_username("alice")
+
+    assert sorted(alice.groups) == ["ipausers", "netsoc_account"]
+    assert alice.groups["netsoc_account"].gid == models.group.NetsocAccount.gid
+    assert [call[0] for call in ipa.calls] == ["user_find"]
+
+@pytest.fixture
+def replicated(ipa, monkeypatch):
+    monkeypatch.setattr(config.accounts.freeipa.replica, "enabled", True)
+
+    provider = accounts.FreeIPA()
+    provider.sync_directory()
+    ipa.calls.clear()
+
+    return provider
+
+def test_sync_skips_accounts_that_fail_validation(ipa, monkeypatch):
+    monkeypatch.setattr(config.accounts.freeipa.replica, "enabled", True)
+    ipa.users["Not.Valid"] = ("not-valid@example.com", ["netsoc_account"])
+    ipa.staged["carol"] = "not an email"
+
+    provider = accounts.FreeIPA()
+    provider.sync_directory()
+
+    assert sorted(provider.read_accounts_all()) == ["admin", "alice", "bob"]
+
+def test_replica_serves_verified_accounts(replicated, ipa):
+    assert replicated.read_account_by_username("alice").email == "alice@example.com"
+    assert replicated.read_account_by_email("admin@example.com").username == "admin"
+    assert ipa.calls == []
+
+def test_unverified_replica_copies_are_read_again(replicated, ipa):
+    # bob verifies through another worker before our next sync
+    ipa.stageuser_activate("bob")
+    ipa.calls.clear()
+
+    bob = replicated.read_account_by_username("bob")
+
+    assert bob.verified
+    assert ("user_find", "bob", None) in ipa.calls
+
+def test_auth_reads_skip_a_replica_older_than_the_cache(replicated, ipa, monkeypatch):
+    ipa.users["alice"] = ("alice@example.com", ["ipausers"])
+    monkeypatch.setattr(replicated._replica, "age", lambda: config.accounts.freeipa.cache.ttl + 1)
+
+    assert sorted(replicated.read_account_by_username("alice").groups) == ["ipausers"]
+
+    # bulk listings still come from the replica until it is too old to use at all
+    assert "netsoc_account" in replicated.read_accounts_all()["alice"].groups
+
+def test_existence_checks_use_cached_staged_accounts(ipa):
+    provider = accounts.FreeIPA()
+
+    # the sign up form checks these as you type
+    assert provider.username_exists("bob")
+    ipa.calls.clear()
+
+    assert provider.username_exists("bob")
+    assert provider.email_exists("bob@example.com")
+    assert ipa.calls == []
+
+    # reading the account itself still checks whether bob has verified since
+    assert provider.read_account_by_username("bob").verified is False
+    assert ("stageuser_find", "bob", None) in ipa.calls
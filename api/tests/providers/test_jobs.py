@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from v1 import models
+from v1.config import config
+from v1.providers import jobs
+
+@pytest.fixture
+def database_url(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'jobs.db'}"
+    monkeypatch.setattr(config.jobs, "database_url", url)
+    monkeypatch.setattr(config.jobs, "max_concurrent_per_node", 2)
+    monkeypatch.setattr(config.jobs, "workers", 4)
+    return url
+
+def make_queue(release: threading.Event, ran: list) -> jobs.JobQueue:
+    queue = jobs.JobQueue()
+    queue._executor = ThreadPoolExecutor(max_workers=config.jobs.workers)
+
+    @queue.handler("test")
+    def run(job_id, payload):
+        ran.append(payload["n"])
+        release.wait(5)
+
+    return queue
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def running(queue: jobs.JobQueue):
+    return [job_id for job_id in queue._running]
+
+def test_jobs_run_and_succeed(database_url):
+    release = threading.Event()
+    ran = []
+    queue = make_queue(release, ran)
+
+    job = queue.enqueue("test", "alice", {"n": 1})
+    assert job.status == models.job.Status.Queued
+
+    queue._dispatch()
+    wait_for(lambda: ran == [1])
+    assert queue.read(job.id).status == models.job.Status.Running
+
+    release.set()
+    wait_for(lambda: queue.read(job.id).status == models.job.Status.Succeeded)
+
+def test_unknown_kind(database_url):
+    queue = make_queue(threading.Event(), [])
+
+    with pytest.raises(Exception):
+        queue.enqueue("nope", "alice", {})
+
+def test_node_limit_holds_across_processes(database_url):
+    release = threading.Event()
+    ran = []
+    queues = [make_queue(release, ran) for _ in range(4)]
+
+    for n in range(8):
+        queues[0].enqueue("test", "alice", {"n": n}, node="n1")
+    queues[0].enqueue("test", "alice", {"n": 100}, node="n2")
+
+    # every process dispatches at the same time
+    threads = [threading.Thread(target=queue._dispatch) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    wait_for(lambda: len(ran) == 3)
+    assert sorted(ran)[-1] == 100
+    assert sum(len(running(queue)) for queue in queues) == 3
+
+    release.set()
+    for queue in queues:
+        queue._executor.shutdown()
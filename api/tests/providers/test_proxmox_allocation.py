@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from v1 import exceptions, models
+from v1.config import config
+from v1.providers import proxmox
+
+@pytest.fixture
+def containers(proxmox_server, stub_container):
+    containers = [
+        stub_container(101, "n1", "web.alice.container.netsoc.cloud", "alice", "10.10.10.3"),
+        stub_container(102, "n2", "web.bob.container.netsoc.cloud", "bob", "10.10.10.4")
+    ]
+    proxmox_server.resources["cluster/resources"] = [container.resource for container in containers]
+
+    return containers
+
+@pytest.fixture
+def processes(stub_provider, monkeypatch):
+    """Two providers standing in for two API worker processes, sharing nothing but the jobs database"""
+
+    # the worst case, both processes start handing out IPs from the same place
+    monkeypatch.setattr(proxmox.random, "randrange", lambda size: 0)
+
+    providers = [stub_provider(), stub_provider()]
+    for prox in providers:
+        # an empty cluster, read just now
+        prox.inventory.replace({}, time.monotonic())
+
+    return providers
+
+def read(prox, container):
+    return prox._read_instance_on_node(
+        models.proxmox.Type.LXC,
+        container.resource["node"],
+        container.resource["vmid"],
+        resource=container.resource,
+        validate_vhosts=False
+    )
+
+def ports(container):
+    return models.proxmox.Metadata.from_description(container.config["description"]).network.ports
+
+def ips(nic_allocation):
+    return [str(address.ip) for address in nic_allocation.addresses]
+
+def test_processes_get_different_ips(processes):
+    first, second = processes
+
+    assert ips(first._allocate_nic()) == ["10.10.10.3"]
+    assert ips(second._allocate_nic()) == ["10.10.10.4"]
+
+def test_committed_ips_stay_held_until_every_index_has_seen_them(processes):
+    first, second = processes
+
+    allocation = first._allocate_nic()
+    first._commit_nic(allocation)
+
+    # second's index hasn't seen the instance using 10.10.10.3 yet
+    assert second._get_ip_index().is_free(0)
+    assert ips(second._allocate_nic()) == ["10.10.10.4"]
+
+def test_released_ips_can_be_handed_out_again(processes):
+    first, second = processes
+    allocation = first._allocate_nic()
+
+    # i.e the clone failed
+    first._release_nic(allocation)
+
+    assert ips(second._allocate_nic()) == ["10.10.10.3"]
+
+def test_ports_are_reserved_and_released_on_remove(processes, containers):
+    prox = processes[0]
+    alice, bob = read(prox, containers[0]), read(prox, containers[1])
+
+    prox.add_instance_port(alice, 16400, 80)
+
+    assert ports(containers[0]) == { 16400: 80 }
+    assert not prox._get_port_index().is_free(16400 - 16384)
+
+    with pytest.raises(exceptions.resource.Unavailable, match="taken"):
+        prox.add_instance_port(bob, 16400, 22)
+
+    prox.remove_instance_port(alice, 16400)
+
+    assert ports(containers[0]) == {}
+    assert prox._get_port_index().is_free(16400 - 16384)
+
+    prox.add_instance_port(read(prox, containers[1]), 16400, 22)
+    assert ports(containers[1]) == { 16400: 22 }
+
+def test_processes_cannot_map_the_same_port(processes, containers):
+    first, second = processes
+
+    # second built its index before first mapped the port
+    second._get_port_index()
+    first.add_instance_port(read(first, containers[0]), 16400, 80)
+
+    with pytest.raises(exceptions.resource.Unavailable, match="taken"):
+        second.add_instance_port(read(second, containers[1]), 16400, 22)
+
+    assert ports(containers[1]) == {}
+
+def test_free_ports_skip_ones_other_processes_mapped(processes, containers, monkeypatch):
+    monkeypatch.setattr(config.proxmox.network.port_forward, "range", (16400, 16401))
+    first, second = processes
+
+    second._get_port_index()
+    first.add_instance_port(read(first, containers[0]), 16400, 80)
+
+    assert set(second.get_random_available_external_port() for _ in range(20)) == { 16401 }
+
+def test_ports_out_of_range(processes, containers):
+    with pytest.raises(exceptions.resource.Unavailable, match="between 16384 and 17384"):
+        processes[0].add_instance_port(read(processes[0], containers[0]), 80, 80)
@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+
+import pytest
+
+from v1 import models, utilities
+from v1.config import config
+from v1.providers import proxmox
+
+def description(owner: str, ip: str) -> str:
+    return models.proxmox.Metadata(
+        owner=owner,
+        inactivity=models.proxmox.Inactivity(marked_active_at=datetime.date.today()),
+        wake_on_request=False,
+        network=models.proxmox.Network(
+            nic_allocation=models.proxmox.NICAllocation(
+                addresses=[f"{ip}/24"],
+                gateway4="10.10.10.1",
+                macaddress="02:00:00:00:00:01"
+            )
+        ),
+        root_user=models.proxmox.RootUser(password_hash="hash", ssh_public_key="key")
+    ).to_description()
+
+def container(vmid: int, node: str, fqdn: str, owner: str, ip: str, status: str = "running") -> dict:
+    return {
+        "resource": { "vmid": vmid, "node": node, "type": "lxc", "name": fqdn, "status": status, "maxmem": 2 ** 30, "mem": 2 ** 29, "maxdisk": 2 ** 33, "disk": 2 ** 30, "cpu": 0.01, "maxcpu": 1, "uptime": 10, "template": 0 },
+        "config": { "hostname": fqdn, "description": description(owner, ip), "rootfs": "local:100/disk.raw,size=8G", "cores": 1, "memory": 512, "swap": 0, "digest": "abc" }
+    }
+
+@pytest.fixture
+def prox(proxmox_server, monkeypatch):
+    # token auth doesn't log in when the client is made, nothing reaches the cluster in the sample config
+    monkeypatch.setattr(config.proxmox.cluster.api, "password", "")
+
+    prox = proxmox.Proxmox()
+    prox.aprox = utilities.async_proxmox.AsyncProxmoxAPI(host="unused", user="root@pam", password="secret", base_url=proxmox_server.base_url)
+
+    containers = [
+        container(101, "n1", "web.alice.container.netsoc.cloud", "alice", "10.10.10.3"),
+        container(102, "n2", "db.alice.container.netsoc.cloud", "alice", "10.10.10.4", status="stopped"),
+        container(103, "n1", "web.bob.container.netsoc.cloud", "bob", "10.10.10.5"),
+        container(104, "n2", "broken.bob.container.netsoc.cloud", "bob", "10.10.10.6")
+    ]
+
+    resources = [c["resource"] for c in containers]
+
+    # neither are instances
+    resources.append({ "vmid": 900, "node": "n1", "type": "lxc", "name": "ubuntu.container.template.netsoc.cloud", "status": "stopped", "template": 1 })
+    resources.append({ "vmid": 901, "node": "n1", "type": "qemu", "name": "unrelated", "status": "running" })
+
+    proxmox_server.resources["cluster/resources"] = resources
+
+    # 104's config can't be read
+    for c in containers[:3]:
+        proxmox_server.resources[f"nodes/{c['resource']['node']}/lxc/{c['resource']['vmid']}/config"] = c["config"]
+
+    return prox
+
+def run(prox, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await prox.aprox.aclose()
+
+    return asyncio.run(main())
+
+def test_read_instances_from_cluster(prox, proxmox_server):
+    instances = run(prox, prox._read_instances_from_cluster_async())
+
+    assert sorted(instances) == ["db.alice.container.netsoc.cloud", "web.alice.container.netsoc.cloud", "web.bob.container.netsoc.cloud"]
+
+    web = instances["web.alice.container.netsoc.cloud"]
+    assert web.id == 101 and web.node == "n1" and web.hostname == "web"
+    assert web.status == models.proxmox.Status.Running
+    assert web.metadata.owner == "alice"
+    assert instances["db.alice.container.netsoc.cloud"].status == models.proxmox.Status.Stopped
+
+    # statuses come from the listing, nobody asks for each instance's status
+    assert not any(path.endswith("status/current") for _, path, _, _ in proxmox_server.requests)
+
+    assert prox.locations.get("web.bob.container.netsoc.cloud") == proxmox.InstanceLocation(models.proxmox.Type.LXC, "n1", 103)
+
+def test_errors_are_raised_unless_ignored(prox):
+    with pytest.raises(Exception):
+        run(prox, prox._read_instances_from_cluster_async(ignore_errors=False))
+
+def test_read_instances_by_account(prox):
+    class Account:
+        username = "alice"
+
+    instances = run(prox, prox.read_instances_by_account_async(models.proxmox.Type.LXC, Account, max_age=0))
+
+    assert sorted(instances) == ["db", "web"]
+
+def test_refresh_inventory(prox):
+    run(prox, prox.refresh_inventory_async())
+
+    assert len(prox.inventory.snapshot(60)[0]) == 3
@@ -0,0 +1,151 @@
+import socket
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+import pytest
+
+from v1.config import config
+from v1.providers import proxmox
+
+class StubDNSServer:
+    """Answers UDP queries on localhost from a dict of (name, rdtype) -> (ttl, [values]), unknown names are NXDOMAIN"""
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, addr = self._sock.recvfrom(4096)
+            except OSError:
+                return
+
+            query = dns.message.from_wire(data)
+            question = query.question[0]
+            name = question.name.to_text(omit_final_dot=True)
+            rdtype = dns.rdatatype.to_text(question.rdtype)
+            self.queries.append((name, rdtype))
+
+            response = dns.message.make_response(query)
+            if (name, rdtype) in self.records:
+                ttl, values = self.records[(name, rdtype)]
+                response.answer.append(dns.rrset.from_text(question.name, ttl, "IN", rdtype, *values))
+            elif not any(record_name == name for record_name, _ in self.records):
+                response.set_rcode(dns.rcode.NXDOMAIN)
+
+            self._sock.sendto(response.to_wire(), addr)
+
+    def close(self):
+        self._sock.close()
+
+allowed = sorted(config.proxmox.network.vhosts.user_domain.allowed_a_aaaa)[0]
+
+@pytest.fixture
+def server():
+    server = StubDNSServer({
+        ("example.com", "A"): (120, [allowed]),
+        ("_netsoc.example.com", "TXT"): (600, ['"alice"']),
+        ("wrong.com", "A"): (120, ["192.0.2.1"]),
+        ("_netsoc.wrong.com", "TXT"): (600, ['"alice"']),
+        ("notxt.com", "A"): (120, [allowed]),
+    })
+    yield server
+    server.close()
+
+@pytest.fixture
+def prox(server, monkeypatch):
+    monkeypatch.setattr(config.proxmox.network.dns, "nameservers", ["127.0.0.1"])
+    monkeypatch.setattr(config.proxmox.network.dns, "port", server.port)
+
+    # only the resolver is needed, skip connecting to the cluster
+    prox = proxmox.Proxmox.__new__(proxmox.Proxmox)
+    prox._resolver = dns.resolver.Resolver(configure=False)
+    prox._resolver.nameservers = ["127.0.0.1"]
+    prox._resolver.port = server.port
+    prox._resolver.lifetime = 2
+
+    return prox
+
+def test_valid_custom_domain(prox):
+    valid, remarks, ttl = prox._validate_domain_uncached("alice", "example.com")
+
+    assert valid is True
+    assert remarks is None
+    assert ttl == min(max(120, config.proxmox.network.dns.min_ttl), config.proxmox.network.dns.max_ttl)
+
+def test_txt_record_of_another_user(prox):
+    valid, remarks, ttl = prox._validate_domain_uncached("bob", "example.com")
+
+    assert valid is False
+    assert "could not find TXT record" in remarks[0]
+    assert ttl <= config.proxmox.network.dns.negative_ttl
+
+def test_unknown_a_record(prox):
+    valid, remarks, _ = prox._validate_domain_uncached("alice", "wrong.com")
+
+    assert valid is False
+    assert remarks == [f"Invalid domain wrong.com: unknown A/AAAA record (192.0.2.1), must be one of {config.proxmox.network.vhosts.user_domain.allowed_a_aaaa}"]
+
+def test_missing_txt_record(prox):
+    valid, remarks, _ = prox._validate_domain_uncached("alice", "notxt.com")
+
+    assert valid is False
+    assert len(remarks) == 1 and "could not find TXT record" in remarks[0]
+
+def test_unregistered_domain_with_configured_nameservers(prox, monkeypatch):
+    def getaddrinfo(*args):
+        raise AssertionError("getaddrinfo is only a fallback for the system resolvers")
+
+    monkeypatch.setattr(proxmox.socket, "getaddrinfo", getaddrinfo)
+
+    valid, remarks, ttl = prox._validate_domain_uncached("alice", "unregistered.com")
+
+    assert valid is False
+    assert "is the domain registered?" in remarks[0]
+    assert ttl == config.proxmox.network.dns.negative_ttl
+
+def test_system_resolvers_fall_back_to_hosts_file(prox, server, monkeypatch):
+    monkeypatch.setattr(config.proxmox.network.dns, "nameservers", None)
+    server.records[("_netsoc.hosts-only.com", "TXT")] = (600, ['"alice"'])
+
+    def getaddrinfo(host, port):
+        assert host == "hosts-only.com"
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (allowed, port))]
+
+    monkeypatch.setattr(proxmox.socket, "getaddrinfo", getaddrinfo)
+
+    assert prox._validate_domain_uncached("alice", "hosts-only.com")[0] is True
+
+def test_lookups_batch_and_cache(prox, server):
+    prox._domain_validations = proxmox.DomainValidationCache(16)
+    prox._dns_fanout = proxmox.utilities.fanout.FanOut(4, "dns-test")
+
+    class Metadata:
+        owner = "alice"
+
+    class Instance:
+        metadata = Metadata()
+
+    results = prox.validate_domains([(Instance(), "example.com"), (Instance(), "wrong.com"), (Instance(), "example.com")])
+
+    assert [valid for valid, _ in results] == [True, False, True]
+
+    # one miss per distinct domain, the lookups don't check the cache again
+    assert (prox._domain_validations.hits, prox._domain_validations.misses) == (0, 2)
+
+    queries = len(server.queries)
+    assert prox.validate_domain(Instance(), "example.com") == (True, None)
+    assert len(server.queries) == queries
+    assert (prox._domain_validations.hits, prox._domain_validations.misses) == (1, 2)
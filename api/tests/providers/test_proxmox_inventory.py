@@ -0,0 +1,149 @@
+import time
+import threading
+
+from types import SimpleNamespace
+
+import pytest
+
+from v1.config import config
+from v1.providers import proxmox
+
+def instance(fqdn, vmid):
+    # the inventory only looks at fqdn and id
+    return SimpleNamespace(fqdn=fqdn, id=vmid)
+
+def test_replace_indexes_by_fqdn_and_vmid():
+    inventory = proxmox.InstanceInventory()
+    inventory.replace({ "a.example": instance("a.example", 100) }, time.monotonic())
+
+    assert inventory.get_by_fqdn("a.example").id == 100
+    assert inventory.get_by_vmid(100).fqdn == "a.example"
+    assert inventory.snapshot(60) == ({ "a.example": inventory.get_by_fqdn("a.example") }, set())
+
+def test_snapshot_is_not_served_once_too_old():
+    inventory = proxmox.InstanceInventory()
+    assert inventory.snapshot(60) is None
+
+    inventory.replace({}, time.monotonic() - 120)
+    assert inventory.snapshot(60) is None
+    assert inventory.snapshot(180) is not None
+
+def test_refresh_in_flight_keeps_our_changes():
+    inventory = proxmox.InstanceInventory()
+    inventory.replace({ "a.example": instance("a.example", 100), "b.example": instance("b.example", 101) }, time.monotonic())
+
+    # a refresh starts reading, then we create c, delete b and change a before it finishes
+    taken_at = time.monotonic()
+    inventory.put(instance("c.example", 102))
+    inventory.remove("b.example")
+    inventory.put(instance("a.example", 100))
+
+    inventory.replace({ "a.example": instance("a.example", 100), "b.example": instance("b.example", 101) }, taken_at)
+    instances, dirty = inventory.snapshot(60)
+
+    assert "c.example" in instances
+    assert inventory.get_by_vmid(102).fqdn == "c.example"
+    assert dirty == { "a.example", "b.example" }
+
+def test_later_refresh_drops_old_touches():
+    inventory = proxmox.InstanceInventory()
+    inventory.put(instance("a.example", 100))
+
+    inventory.replace({}, time.monotonic())
+
+    assert inventory.snapshot(60) == ({}, set())
+
+def test_invalidate():
+    inventory = proxmox.InstanceInventory()
+    inventory.replace({ "a.example": instance("a.example", 100) }, time.monotonic())
+
+    inventory.invalidate("a.example")
+    assert inventory.snapshot(60)[1] == { "a.example" }
+
+    # a refresh that started before the whole snapshot was expired doesn't make it fresh again
+    taken_at = time.monotonic()
+    inventory.invalidate()
+    inventory.replace({}, taken_at)
+    assert inventory.snapshot(60) is None
+
+    inventory.replace({}, time.monotonic())
+    assert inventory.snapshot(60) is not None
+
+def test_locations_replace_from_cluster_resources():
+    locations = proxmox.InstanceLocations()
+    locations.replace([
+        { "type": "lxc", "name": "a.example", "node": "n1", "vmid": 100 },
+        { "type": "qemu", "name": "b.example", "node": "n2", "vmid": 101 },
+        { "type": "storage", "node": "n1", "storage": "local" }
+    ])
+
+    assert locations.get("a.example") == proxmox.InstanceLocation(proxmox.models.proxmox.Type.LXC, "n1", 100)
+    assert locations.get("b.example").type == proxmox.models.proxmox.Type.VPS
+    assert locations.get("local") is None
+
+class FakeTasks:
+    """Answers nodes(".../status").get() with running until a task is stopped"""
+
+    def __init__(self):
+        self.polls = []
+        self.stopped = {}
+        self.fail = None
+
+    def nodes(self, path):
+        return SimpleNamespace(get=lambda: self._status(path))
+
+    def _status(self, path):
+        upid = path.split("/")[2]
+        self.polls.append(threading.current_thread())
+
+        if self.fail is not None:
+            raise self.fail
+        if upid in self.stopped:
+            return { "status": "stopped", "exitstatus": self.stopped[upid] }
+        return { "status": "running" }
+
+UPID = "UPID:n1:0000ABCD:00000001:5F000000:vzclone:100:root@pam:"
+
+@pytest.fixture
+def tasks(monkeypatch):
+    monkeypatch.setattr(config.proxmox.tasks, "poll_initial_interval", 0.01)
+    monkeypatch.setattr(config.proxmox.tasks, "poll_max_interval", 0.02)
+
+    return FakeTasks()
+
+def test_wait_returns_the_final_status(tasks):
+    tasks.stopped[UPID] = "OK"
+
+    assert proxmox.TaskWaiter(tasks).wait(UPID, 5)["exitstatus"] == "OK"
+
+def test_wait_times_out_while_running(tasks):
+    start = time.monotonic()
+
+    assert proxmox.TaskWaiter(tasks).wait(UPID, 0.1) is None
+    assert time.monotonic() - start < 1
+
+def test_one_thread_polls_each_task(tasks):
+    waiter = proxmox.TaskWaiter(tasks)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(waiter.wait(UPID, 5))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + 5
+    while len(tasks.polls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    tasks.stopped[UPID] = "OK"
+
+    for thread in threads:
+        thread.join(5)
+
+    assert [result["exitstatus"] for result in results] == ["OK"] * 4
+    assert len(set(tasks.polls)) == 1
+
+def test_poll_errors_are_raised(tasks):
+    tasks.fail = RuntimeError("node went away")
+
+    with pytest.raises(RuntimeError):
+        proxmox.TaskWaiter(tasks).wait(UPID, 5)
@@ -0,0 +1,87 @@
+import pytest
+
+from v1 import exceptions, models
+
+@pytest.fixture
+def container(stub_container):
+    return stub_container(101, "n1", "web.alice.container.netsoc.cloud", "alice", "10.10.10.3")
+
+@pytest.fixture
+def prox(stub_provider):
+    return stub_provider()
+
+def read(prox, container):
+    return prox._read_instance_on_node(
+        models.proxmox.Type.LXC,
+        container.resource["node"],
+        container.resource["vmid"],
+        resource=container.resource,
+        validate_vhosts=False
+    )
+
+def metadata(container) -> models.proxmox.Metadata:
+    return models.proxmox.Metadata.from_description(container.config["description"])
+
+def add_port(metadata: models.proxmox.Metadata):
+    metadata.network.ports[16400] = 80
+
+def test_write_sends_the_digest_it_read(prox, container):
+    prox.write_out_instance_metadata(read(prox, container), add_port)
+
+    assert [put["digest"] for put in container.puts] == ["digest-0"]
+    assert metadata(container).network.ports == { 16400: 80 }
+
+def test_unchanged_description_is_not_written(prox, container):
+    instance = read(prox, container)
+
+    prox.write_out_instance_metadata(instance)
+    prox.write_out_instance_metadata(instance, lambda metadata: None)
+
+    assert container.puts == []
+
+def test_conflict_is_retried_on_fresh_metadata(prox, container):
+    # someone else adds a vhost between our read and our write
+    def add_vhost_elsewhere():
+        container.before_put = None
+
+        changed = metadata(container)
+        changed.network.vhosts["alice.example.com"] = models.proxmox.VHostOptions(port=8080)
+        container.change(changed.to_description())
+
+    container.before_put = add_vhost_elsewhere
+    instance = read(prox, container)
+
+    prox.write_out_instance_metadata(instance, add_port)
+
+    assert [put["digest"] for put in container.puts] == ["digest-0", "digest-1"]
+
+    # both changes made it
+    assert metadata(container).network.ports == { 16400: 80 }
+    assert list(metadata(container).network.vhosts) == ["alice.example.com"]
+    assert instance.metadata.network.ports == { 16400: 80 }
+
+def test_gives_up_after_attempts(prox, container):
+    # someone else keeps changing the config just before each of our writes
+    def touch_elsewhere():
+        changed = metadata(container)
+        changed.reason = f"changed {len(container.puts)} times"
+        container.change(changed.to_description())
+
+    container.before_put = touch_elsewhere
+
+    with pytest.raises(exceptions.resource.Unavailable, match="changed by someone else"):
+        prox.write_out_instance_metadata(read(prox, container), add_port, attempts=3)
+
+    assert len(container.puts) == 3
+    assert metadata(container).network.ports == {}
+
+def test_conflicts_without_mutate_are_not_retried(prox, container):
+    instance = read(prox, container)
+    instance.metadata.network.ports[16400] = 80
+
+    container.change(container.config["description"])
+
+    with pytest.raises(exceptions.resource.Unavailable):
+        prox.write_out_instance_metadata(instance)
+
+    assert len(container.puts) == 1
@@ -0,0 +1,136 @@
+import io
+import os
+import subprocess
+
+import pytest
+
+from v1 import exceptions
+from v1.providers import proxmox
+
+steps = [
+    ("true", "could not prepare: "),
+    ("cat \"$dir/password\"", "could not set password: "),
+    ("true", "could not restart sshd: ")
+]
+
+class FakeChannel:
+    def __init__(self, status):
+        self.status = status
+
+    def recv_exit_status(self):
+        return self.status
+
+class FakeStream(io.BytesIO):
+    def __init__(self, data, status=0):
+        super().__init__(data)
+        self.channel = FakeChannel(status)
+
+class FakeSFTP:
+    def __init__(self):
+        self.dirs = []
+        self.files = {}
+
+    def mkdir(self, path, mode):
+        self.dirs.append(path)
+
+    def open(self, path, mode):
+        sftp = self
+
+        class File(io.StringIO):
+            def close(self):
+                sftp.files[path] = self.getvalue()
+                super().close()
+
+        return File()
+
+class FakeSSH:
+    """Answers the run.sh command with canned output and exit status, other commands (cleanup) are just recorded"""
+
+    def __init__(self, out, err, status):
+        self.out, self.err, self.status = out, err, status
+        self.commands = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        return None, FakeStream(self.out, self.status), FakeStream(self.err)
+
+class FakeConnection:
+    def __init__(self, out=b"", err=b"", status=0):
+        self.sftp = FakeSFTP()
+        self.ssh = FakeSSH(out, err, status)
+
+@pytest.fixture
+def prox():
+    # only _run_node_steps is used, skip connecting to the cluster
+    return proxmox.Proxmox.__new__(proxmox.Proxmox)
+
+def run(prox, con):
+    prox._run_node_steps(con, files={ "password": "root:hash\n" }, steps=steps)
+
+def test_success(prox):
+    con = FakeConnection(out=b"@@step 0 0\n@@step 1 0\n@@step 2 0\n")
+
+    run(prox, con)
+
+    workdir = con.sftp.dirs[0]
+    assert con.sftp.files[f"{workdir}/password"] == "root:hash\n"
+    assert "step 1 'cat \"$dir/password\"'" in con.sftp.files[f"{workdir}/run.sh"]
+    assert con.ssh.commands == [f"sh '{workdir}/run.sh'"]
+
+def test_failure_midway(prox):
+    con = FakeConnection(out=b"@@step 0 0\n@@step 1 3\nno such user\n", err=b"chpasswd: failed", status=3)
+
+    with pytest.raises(exceptions.resource.Unavailable) as e:
+        run(prox, con)
+
+    assert str(e.value) == "could not set password: 3: b'no such user\\n' b'chpasswd: failed'"
+
+def test_truncated_output_blames_the_step_after_the_last_success(prox):
+    # the connection dropped (or the script was killed) before step 1 reported back
+    con = FakeConnection(out=b"@@step 0 0\n", status=255)
+
+    with pytest.raises(exceptions.resource.Unavailable) as e:
+        run(prox, con)
+
+    assert str(e.value).startswith("could not set password: 255")
+
+def test_no_markers_at_all_blames_the_first_step(prox):
+    con = FakeConnection(out=b"", err=b"sh: can't open run.sh", status=2)
+
+    with pytest.raises(exceptions.resource.Unavailable) as e:
+        run(prox, con)
+
+    assert str(e.value).startswith("could not prepare: 2")
+
+class LocalConnection:
+    """Runs the script with the local sh, like the node would"""
+
+    def __init__(self):
+        class SFTP:
+            def mkdir(self, path, mode):
+                os.mkdir(path, mode)
+
+            def open(self, path, mode):
+                return open(path, mode)
+
+        class SSH:
+            def exec_command(self, command):
+                result = subprocess.run(command, shell=True, capture_output=True)
+                return None, FakeStream(result.stdout, result.returncode), FakeStream(result.stderr)
+
+        self.sftp = SFTP()
+        self.ssh = SSH()
+
+def test_script_reports_the_failed_step(prox):
+    with pytest.raises(exceptions.resource.Unavailable) as e:
+        prox._run_node_steps(
+            LocalConnection(),
+            files={ "password": "root:hash\n" },
+            steps=[
+                ("cat \"$dir/password\"", "could not read password: "),
+                ("echo \"it's broken\"; exit 4", "could not restart sshd: "),
+                ("true", "never runs: ")
+            ]
+        )
+
+    assert str(e.value) == "could not restart sshd: 4: b\"it's broken\\n\" b''"
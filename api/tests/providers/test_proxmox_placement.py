@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from v1 import exceptions, models
+from v1.config import config
+
+GiB = 1024 ** 3
+
+@pytest.fixture
+def processes(stub_provider, proxmox_server):
+    """Two providers standing in for two API worker processes, placing on two empty 4GiB nodes"""
+
+    proxmox_server.resources["nodes"] = [
+        { "node": node, "status": "online", "mem": 0, "maxmem": 4 * GiB, "cpu": 0, "maxcpu": 4 }
+        for node in ("n1", "n2")
+    ]
+
+    def resources(method, params):
+        if params.get("type") == "storage":
+            return [
+                { "node": node, "storage": config.proxmox.instance_dir_pool, "status": "available", "disk": 0, "maxdisk": 100 * GiB }
+                for node in ("n1", "n2")
+            ]
+
+        return []
+
+    proxmox_server.resources["cluster/resources"] = resources
+
+    providers = [stub_provider(), stub_provider()]
+    for prox in providers:
+        prox.inventory.replace({}, time.monotonic())
+
+    return providers
+
+# one of these fits on a node, two don't
+specs = models.proxmox.Specs(cores=1, memory=3000, disk_space=8)
+
+def test_placements_count_across_processes(processes):
+    first, second = processes
+
+    node, placement = first._reserve_node(specs)
+
+    assert second.plan_placement(specs).node != node
+    assert second._reserve_node(specs)[0] != node
+
+    with pytest.raises(exceptions.resource.Unavailable):
+        first._reserve_node(specs)
+
+    first._release_node(placement)
+
+    assert second._reserve_node(specs)[0] == node
+
+def test_placement_scores_count_pending_instances(processes):
+    first, second = processes
+
+    node, placement = first._reserve_node(specs)
+    scores = { score.node: score for score in second.plan_placement(specs).scores }
+
+    assert scores[node].pending == 1
+    assert scores[node].fits is False
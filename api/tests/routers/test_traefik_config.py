@@ -0,0 +1,86 @@
+import sys
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from v1 import models, exceptions
+from v1.config import config
+
+@pytest.fixture
+def prox(stub_provider, stub_container, proxmox_server, monkeypatch):
+    containers = [
+        stub_container(101, "n1", "web.alice.container.netsoc.cloud", "alice", "10.10.10.3"),
+        stub_container(102, "n2", "web.bob.container.netsoc.cloud", "bob", "10.10.10.4")
+    ]
+    proxmox_server.resources["cluster/resources"] = [container.resource for container in containers]
+
+    prox = stub_provider()
+
+    # the routers reach providers through v1.providers, which the tests don't instantiate, and register
+    # their job handlers on import
+    from v1.providers import jobs
+
+    monkeypatch.setattr(sys.modules["v1.providers"], "proxmox", prox, raising=False)
+    monkeypatch.setattr(sys.modules["v1.providers"], "jobs", jobs.JobQueue(), raising=False)
+
+    return prox
+
+@pytest.fixture
+def client(prox):
+    from v1 import routers
+
+    app = FastAPI()
+    app.include_router(routers.proxmox.router)
+
+    return TestClient(app)
+
+def get(client, etag=None):
+    headers = { "If-None-Match": etag } if etag is not None else {}
+    return client.get("/traefik-config", params={ "key": config.proxmox.network.traefik.config_key }, headers=headers)
+
+def test_wrong_key(client):
+    with pytest.raises(exceptions.rest.Error) as e:
+        client.get("/traefik-config", params={ "key": "nope" })
+
+    assert e.value.status_code == 403
+
+def test_matching_etag_is_not_modified(client):
+    first = get(client)
+    assert first.status_code == 200
+    assert first.headers["ETag"].startswith('"')
+
+    response = get(client, first.headers["ETag"])
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == first.headers["ETag"]
+
+    # weak and listed etags match too
+    assert get(client, f'"stale", W/{first.headers["ETag"]}').status_code == 304
+    assert get(client, "*").status_code == 304
+
+def test_stale_etag_gets_the_config(client):
+    first = get(client)
+
+    response = get(client, '"stale"')
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == first.headers["ETag"]
+    assert response.json() == first.json()
+
+def test_etag_changes_with_the_inventory(client, prox):
+    first = get(client)
+
+    # alice maps a port, which changes the inventory version and the config built from it
+    instance = prox._read_instance_on_node(models.proxmox.Type.LXC, "n1", 101, validate_vhosts=False)
+    prox.add_instance_port(instance, 16400, 80)
+
+    response = get(client, first.headers["ETag"])
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != first.headers["ETag"]
+    assert "16400" in response.text
+
+    assert get(client, response.headers["ETag"]).status_code == 304
@@ -0,0 +1,74 @@
+import time
+
+from v1.utilities.allocator import BitmapAllocator
+
+def test_reserve_any_hands_out_each_index_once():
+    allocator = BitmapAllocator(4, blocked=[1])
+
+    indexes = [allocator.reserve_any() for _ in range(4)]
+
+    assert sorted(indexes[:3]) == [0, 2, 3]
+    assert indexes[3] is None
+
+def test_reserve_any_moves_on_from_the_last_index():
+    allocator = BitmapAllocator(4)
+
+    assert allocator.reserve_any() == 0
+    allocator.release(0)
+
+    # released indexes aren't handed straight back out
+    assert allocator.reserve_any() == 1
+
+def test_reserve_commit_release():
+    allocator = BitmapAllocator(8)
+
+    assert allocator.reserve(3) is True
+    assert allocator.reserve(3) is False
+    assert allocator.is_free(3) is False
+
+    allocator.commit(3)
+    assert allocator.reserve(3) is False
+    assert allocator.free_count() == 7
+
+    allocator.release(3)
+    assert allocator.is_free(3) is True
+    assert allocator.free_count() == 8
+
+def test_out_of_range_indexes_are_ignored():
+    allocator = BitmapAllocator(8)
+
+    assert allocator.reserve(-1) is False
+    assert allocator.reserve(8) is False
+    assert allocator.is_free(-1) is False
+
+    allocator.commit(-1)
+    allocator.commit(8)
+    allocator.release(-5)
+    allocator.release(100)
+
+    assert allocator.free_count() == 8
+    assert sorted(allocator.reserve_any() for _ in range(8)) == list(range(8))
+    assert allocator.reserve_any() is None
+
+def test_reset_keeps_changes_made_after_the_read_started():
+    allocator = BitmapAllocator(8)
+    allocator.commit(1)
+
+    taken_at = time.monotonic()
+    allocator.commit(2)
+    allocator.release(1)
+
+    # the read started before 2 was committed and 1 released, and also saw 5 in use
+    allocator.reset([1, 5], taken_at)
+
+    assert allocator.is_free(1) is True
+    assert allocator.is_free(2) is False
+    assert allocator.is_free(5) is False
+
+def test_reset_keeps_reservations():
+    allocator = BitmapAllocator(4)
+    assert allocator.reserve(0) is True
+
+    allocator.reset([], time.monotonic())
+
+    assert allocator.is_free(0) is False
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from v1.utilities import async_proxmox
+
+def password_client(server, **kwargs) -> async_proxmox.AsyncProxmoxAPI:
+    return async_proxmox.AsyncProxmoxAPI(host="unused", user="root@pam", password="secret", base_url=server.base_url, **kwargs)
+
+def run(client, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await client.aclose()
+
+    return asyncio.run(main())
+
+def test_token_auth(proxmox_server):
+    proxmox_server.resources["nodes"] = [{"node": "n1"}]
+    client = async_proxmox.AsyncProxmoxAPI(host="unused", user="root@pam", token_name="test", token_value="token", base_url=proxmox_server.base_url)
+
+    assert run(client, client.nodes.get()) == [{"node": "n1"}]
+    assert proxmox_server.logins == 0
+
+def test_paths_and_params(proxmox_server):
+    proxmox_server.resources["nodes/n1/lxc/100/config"] = lambda method, params: {"method": method, "params": params}
+    proxmox_server.resources["cluster/resources"] = lambda method, params: params
+    client = password_client(proxmox_server)
+
+    async def requests():
+        return (
+            await client.nodes("n1").lxc("100/config").get(),
+            await client.nodes("n1").lxc(100)("config").put(memory=512),
+            await client.cluster.resources.get(type="vm")
+        )
+
+    get, put, resources = run(client, requests())
+
+    assert get == {"method": "GET", "params": {}}
+    assert put == {"method": "PUT", "params": {"memory": "512"}}
+    assert resources == {"type": "vm"}
+
+def test_one_login_for_concurrent_requests(proxmox_server):
+    proxmox_server.resources["version"] = {"version": "6.3"}
+    client = password_client(proxmox_server)
+
+    async def requests():
+        return await asyncio.gather(*[client.version.get() for _ in range(10)])
+
+    assert run(client, requests()) == [{"version": "6.3"}] * 10
+    assert proxmox_server.logins == 1
+
+def test_ticket_renewed_before_it_expires(proxmox_server):
+    proxmox_server.resources["version"] = {"version": "6.3"}
+    client = password_client(proxmox_server)
+
+    async def requests():
+        await client.version.get()
+        client._ticket_at -= async_proxmox.TICKET_LIFETIME
+        await client.version.get()
+
+    run(client, requests())
+
+    assert proxmox_server.logins == 2
+
+def test_relogin_when_ticket_rejected(proxmox_server):
+    proxmox_server.resources["version"] = {"version": "6.3"}
+    client = password_client(proxmox_server)
+
+    async def requests():
+        await client.version.get()
+
+        # e.g. the cluster restarted
+        proxmox_server.tickets.clear()
+
+        return await asyncio.gather(*[client.version.get() for _ in range(5)])
+
+    assert run(client, requests()) == [{"version": "6.3"}] * 5
+
+    # everyone that was rejected shares the one new login
+    assert proxmox_server.logins == 2
+
+def test_errors(proxmox_server):
+    def config(method, params):
+        raise proxmox_server.Error(500, "Configuration file 'nodes/n1/lxc/999.conf' does not exist")
+
+    proxmox_server.resources["nodes/n1/lxc/999/config"] = config
+    client = password_client(proxmox_server)
+
+    with pytest.raises(async_proxmox.ResourceException) as e:
+        run(client, client.nodes("n1").lxc("999/config").get())
+
+    assert e.value.status_code == 500
+    assert "does not exist" in str(e.value)
+    assert str(e.value).startswith("500 ")
+
+def test_bad_password(proxmox_server):
+    client = async_proxmox.AsyncProxmoxAPI(host="unused", user="root@pam", password="wrong", base_url=proxmox_server.base_url)
+
+    with pytest.raises(async_proxmox.ResourceException) as e:
+        run(client, client.version.get())
+
+    assert e.value.status_code == 401
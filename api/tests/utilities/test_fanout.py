@@ -0,0 +1,70 @@
+import time
+import threading
+
+import pytest
+
+from v1.utilities.fanout import FanOut
+
+def test_results_keep_item_order():
+    fanout = FanOut(4, "test")
+
+    # later items finish first
+    results = fanout.map(lambda n: time.sleep(0.01 * (5 - n)) or n * n, range(5))
+
+    assert [result.item for result in results] == [0, 1, 2, 3, 4]
+    assert [result.value for result in results] == [0, 1, 4, 9, 16]
+    assert all(result.error is None for result in results)
+
+def test_max_workers_bounds_calls_in_flight():
+    fanout = FanOut(2, "test")
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def call(item):
+        with lock:
+            in_flight.append(item)
+            peak.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(item)
+
+    fanout.map(call, range(8))
+
+    assert max(peak) == 2
+
+def test_errors_are_returned_per_item():
+    def call(n):
+        if n == 1:
+            raise ValueError("bad item")
+        return n
+
+    results = FanOut(4, "test").map(call, range(3))
+
+    assert [result.value for result in results] == [0, None, 2]
+    assert isinstance(results[1].error, ValueError)
+
+def test_first_error_is_raised_unless_ignored():
+    def call(n):
+        if n >= 1:
+            raise ValueError(f"bad item {n}")
+        return n
+
+    with pytest.raises(ValueError, match="bad item 1"):
+        FanOut(4, "test").map(call, range(3), ignore_errors=False)
+
+def test_slow_items_time_out():
+    release = threading.Event()
+
+    def call(n):
+        if n == 1:
+            release.wait(5)
+        return n
+
+    try:
+        results = FanOut(4, "test").map(call, range(3), timeout=0.2)
+    finally:
+        release.set()
+
+    assert [result.value for result in results] == [0, None, 2]
+    assert isinstance(results[1].error, TimeoutError)
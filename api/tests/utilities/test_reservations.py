@@ -0,0 +1,78 @@
+import time
+import threading
+
+import pytest
+
+from v1.utilities.reservations import Reservations
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'jobs.db'}"
+
+def test_a_key_is_held_once(database_url):
+    # two processes, each with their own connection to the database
+    first = Reservations(database_url)
+    second = Reservations(database_url)
+
+    assert first.reserve("ip", "10.0.0.5", 60) is True
+    assert second.reserve("ip", "10.0.0.5", 60) is False
+    assert second.reserve("port", "10.0.0.5", 60) is True
+
+    first.release("ip", "10.0.0.5")
+    assert second.reserve("ip", "10.0.0.5", 60) is True
+
+def test_reservations_lapse(database_url):
+    reservations = Reservations(database_url)
+
+    assert reservations.reserve("ip", "10.0.0.5", 0.05, value="left behind") is True
+    assert reservations.held("ip") == { "10.0.0.5": "left behind" }
+
+    time.sleep(0.1)
+
+    assert reservations.held("ip") == {}
+    assert reservations.reserve("ip", "10.0.0.5", 60) is True
+
+def test_renew(database_url):
+    reservations = Reservations(database_url)
+
+    reservations.reserve("ip", "10.0.0.5", 0.05)
+    reservations.renew("ip", "10.0.0.5", 60)
+    reservations.renew("ip", "10.0.0.6", 60)
+    time.sleep(0.1)
+
+    assert sorted(reservations.held("ip")) == ["10.0.0.5", "10.0.0.6"]
+
+def test_reserve_with_sees_every_other_hold(database_url):
+    processes = [Reservations(database_url) for _ in range(4)]
+    barrier = threading.Barrier(len(processes) * 2)
+
+    # every caller takes the next number after those already held, which only works if nobody can slip in between
+    def take_next(held):
+        return str(len(held))
+
+    def run(reservations, key):
+        barrier.wait(5)
+        reservations.reserve_with("placement", key, 60, take_next)
+
+    threads = [
+        threading.Thread(target=run, args=(reservations, f"{i}-{j}"))
+        for i, reservations in enumerate(processes)
+        for j in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(int(value) for value in processes[0].held("placement").values()) == list(range(8))
+
+def test_reserve_with_can_refuse(database_url):
+    reservations = Reservations(database_url)
+
+    def refuse(held):
+        raise ValueError("no room")
+
+    with pytest.raises(ValueError):
+        reservations.reserve_with("placement", "a", 60, refuse)
+
+    assert reservations.held("placement") == {}
@@ -0,0 +1,78 @@
+import pytest
+
+from v1 import models
+from v1.utilities import scheduler
+
+GiB = 1024 ** 3
+
+weights = scheduler.Weights(memory=1, cpu=1, disk=1, instances=1)
+limits = scheduler.Limits(max_memory_ratio=0.9, max_disk_ratio=0.9)
+specs = models.proxmox.Specs(cores=2, disk_space=10, memory=2048)
+
+def node(name, mem=1 * GiB, disk=10 * GiB, maxdisk=1000 * GiB, cpu=0.1, instances=0, pending=()):
+    return scheduler.NodeState(
+        name=name,
+        mem=mem,
+        maxmem=16 * GiB,
+        disk=disk,
+        maxdisk=maxdisk,
+        cpu=cpu,
+        maxcpu=8,
+        instances=instances,
+        pending=list(pending)
+    )
+
+def test_least_loaded_spreads_instances():
+    placement = scheduler.place("least-loaded", [node("busy", mem=8 * GiB, cpu=0.8), node("idle")], specs, weights, limits)
+
+    assert placement.node == "idle"
+
+def test_bin_packing_fills_nodes():
+    placement = scheduler.place("bin-packing", [node("busy", mem=8 * GiB, cpu=0.8), node("idle")], specs, weights, limits)
+
+    assert placement.node == "busy"
+
+def test_pending_instances_count_towards_their_node():
+    pending = [models.proxmox.Specs(cores=1, disk_space=10, memory=8000)] * 2
+    placement = scheduler.place("least-loaded", [node("a", pending=pending), node("b", mem=2 * GiB)], specs, weights, limits)
+
+    assert placement.node == "b"
+
+def test_nodes_without_room_are_not_picked():
+    scores = {
+        score.node: score
+        for score in scheduler.score(
+            [node("full-memory", mem=15 * GiB), node("full-disk", disk=995 * GiB), node("no-storage", disk=0, maxdisk=0)],
+            specs,
+            weights,
+            limits
+        )
+    }
+
+    assert scores["full-memory"].remarks == ["not enough memory"]
+    assert scores["full-disk"].remarks == ["not enough disk"]
+    assert scores["no-storage"].remarks == ["no instance storage"]
+
+    placement = scheduler.place("least-loaded", [node("full-memory", mem=15 * GiB), node("no-storage", maxdisk=0)], specs, weights, limits)
+    assert placement.node is None
+
+def test_specs_are_in_binary_units():
+    # 14746MiB is just over 90% of 16GiB, 91GiB just over 90% of 100GiB (in decimal units both would fit)
+    scores = scheduler.score(
+        [node("a", mem=0, disk=0, maxdisk=100 * GiB)],
+        models.proxmox.Specs(cores=1, disk_space=91, memory=14746),
+        weights,
+        limits
+    )
+
+    assert scores[0].remarks == ["not enough memory", "not enough disk"]
+
+def test_too_many_cores():
+    placement = scheduler.place("least-loaded", [node("a")], models.proxmox.Specs(cores=16, disk_space=10, memory=512), weights, limits)
+
+    assert placement.node is None
+    assert placement.scores[0].remarks == ["not enough cores"]
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        scheduler.place("random", [node("a")], specs, weights, limits)
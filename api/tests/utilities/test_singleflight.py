@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from v1.utilities.singleflight import AsyncSingleFlight, SingleFlight
+
+def test_concurrent_calls_share_one_call():
+    shared = []
+    flight = SingleFlight(shared.append)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "listing"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", read)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", read))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+
+    # followers register as sharing before they wait
+    deadline = time.monotonic() + 5
+    while len(shared) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert results == ["listing"] * 4
+    assert len(calls) == 1
+    assert shared == ["key"] * 3
+
+def test_calls_after_one_finishes_run_again():
+    flight = SingleFlight()
+    calls = []
+
+    def read():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do("key", read) == 1
+    assert flight.do("key", read) == 2
+
+def test_different_keys_dont_share():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: "a") == "a"
+    assert flight.do("b", lambda: "b") == "b"
+
+def test_errors_are_shared_and_not_kept():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("unavailable")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2
+    assert flight.do("key", lambda: "ok") == "ok"
+
+def test_async_calls_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def read():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "listing"
+
+    async def main():
+        return await asyncio.gather(*[flight.do("key", read) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["listing"] * 5
+    assert len(calls) == 1
+
+def test_async_cancelled_caller_doesnt_cancel_the_others():
+    flight = AsyncSingleFlight()
+
+    async def read():
+        await asyncio.sleep(0.05)
+        return "listing"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", read))
+        second = asyncio.ensure_future(flight.do("key", read))
+        await asyncio.sleep(0)
+
+        first.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        return await second
+
+    assert asyncio.run(main()) == "listing"
+
+def test_async_errors_are_shared_and_not_kept():
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("unavailable")
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        return results, await flight.do("key", ok)
+
+    results, after = asyncio.run(main())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert after == "ok"
@@ -10,7 +10,7 @@ from prometheus_client import Gauge
 from starlette.middleware.cors import CORSMiddleware
 from starlette_prometheus import metrics, PrometheusMiddleware
 
-from . import exceptions, routers, models, logging_config, utilities
+from . import exceptions, routers, models, logging_config, utilities, providers
 
 from .config import config
 
@@ -38,6 +38,57 @@ utilities.yaml.use_prettier_multiline_strings()
 def heartbeat():
     hb.set_to_current_time()
 
+@api.on_event("startup")
+def start_jobs():
+    providers.jobs.start()
+
+@api.on_event("startup")
+@repeat_every(seconds=config.proxmox.inventory.refresh_interval)
+async def refresh_proxmox_inventory():
+    try:
+        await providers.proxmox.refresh_inventory_async()
+    except Exception as e:
+        logger.error("Could not refresh Proxmox inventory", e=e, exc_info=True)
+
+@api.on_event("startup")
+@repeat_every(seconds=config.proxmox.templates.refresh_interval)
+def refresh_proxmox_templates():
+    try:
+        providers.proxmox.refresh_templates()
+    except Exception as e:
+        logger.error("Could not refresh Proxmox templates", e=e, exc_info=True)
+
+@api.on_event("startup")
+@repeat_every(seconds=config.accounts.freeipa.groups.refresh_interval)
+def refresh_freeipa_groups():
+    try:
+        providers.accounts.refresh_groups()
+    except Exception as e:
+        logger.error("Could not refresh FreeIPA groups", e=e, exc_info=True)
+
+@api.on_event("startup")
+@repeat_every(seconds=config.accounts.freeipa.replica.sync_interval)
+def sync_freeipa_directory():
+    if not config.accounts.freeipa.replica.enabled:
+        return
+
+    try:
+        providers.accounts.sync_directory()
+    except Exception as e:
+        logger.error("Could not sync FreeIPA directory", e=e, exc_info=True)
+
+@api.on_event("startup")
+@repeat_every(seconds=60)
+def reap_ssh_connections():
+    try:
+        providers.proxmox.reap_ssh_connections()
+    except Exception as e:
+        logger.error("Could not reap SSH connections", e=e, exc_info=True)
+
+@api.on_event("shutdown")
+async def close_proxmox_connections():
+    await providers.proxmox.aprox.aclose()
+
 
 logger.info("setting up routers")
 api.include_router(
@@ -58,6 +109,12 @@ api.include_router(
     tags=['proxmox']
 )
 
+api.include_router(
+    routers.jobs.router,
+    prefix='/v1/jobs',
+    tags=['jobs']
+)
+
 """
 Return a Rest error model whenever our API throws exceptions.rest.Error
 """
@@ -6,4 +6,5 @@ from . import group
 from . import password
 from . import sign_up
 from . import captcha
-from . import proxmox
\ No newline at end of file
+from . import proxmox
+from . import job
\ No newline at end of file
@@ -91,9 +91,37 @@ class Accounts(BaseModel):
     ]
 
     class FreeIPA(BaseModel):
+        class Cache(BaseModel):
+            # accounts (active and staged) kept in memory, and seconds before they are read from FreeIPA again
+            size: int = 1024
+            ttl: int = 90
+
+            # seconds a username/email that had no account is remembered for (sign up checks these as you type)
+            negative_ttl: int = 10
+
+        class Groups(BaseModel):
+            # seconds between background reloads of the group catalogue
+            refresh_interval: int = 300
+
+            # oldest catalogue (in seconds) lookups will use before reloading it themselves
+            max_age: int = 900
+
+        class Replica(BaseModel):
+            # keep every user and staged user in memory (synced from FreeIPA in bulk) and serve reads from there
+            enabled: bool = False
+
+            # seconds between full syncs
+            sync_interval: int = 60
+
+            # a replica older than this (in seconds, i.e syncs are failing) is not used, reads go to FreeIPA instead
+            max_age: int = 300
+
         server: str
         username: str
         password: str
+        cache: Cache = Cache()
+        groups: Groups = Groups()
+        replica: Replica = Replica()
 
     freeipa: FreeIPA
 
@@ -143,6 +171,18 @@ class Proxmox(BaseModel):
             username: str = "root"
             password: str
 
+            # most node sessions (each an ssh connection + sftp tunnelled through the jump host) open per node at once
+            max_sessions_per_node: int = 4
+
+            # seconds to wait for a free session on a node before giving up
+            acquire_timeout: int = 60
+
+            # idle sessions (and the jump connection, once it has no sessions) are closed after this many seconds
+            idle_timeout: int = 300
+
+            # seconds between keepalives on pooled connections, idle sessions older than this are health-checked before reuse
+            keepalive_interval: int = 30
+
         class API(BaseModel):
             server: str
             port: str
@@ -151,6 +191,25 @@ class Proxmox(BaseModel):
             token_name: str
             token_value: str
 
+            # maximum number of per-VM reads in flight at once when reading many instances/templates
+            max_concurrent_reads: int = 8
+
+            # connections kept open to the API by the async client
+            max_connections: int = 32
+
+            # connections kept open to the API by the (threaded) proxmoxer client, threads wait for a free one beyond that
+            # defaults to the number of threads that can call the API at once
+            pool_size: Optional[int] = None
+
+            # seconds to connect to the API and to wait for a response, a hung node shouldn't hang a worker forever
+            connect_timeout: float = 5
+            timeout: float = 60
+
+            # times a GET that failed to connect, timed out or got a 502/503/504 is retried
+            # waits up to retry_backoff * 2^(retry - 1) seconds (picked at random) before each retry
+            retries: int = 3
+            retry_backoff: float = 0.5
+
         api: API
         ssh: SSH
 
@@ -259,6 +318,31 @@ class Proxmox(BaseModel):
             service_subdomain_cert_resolver: str
             user_domain_cert_resolver: str
 
+            # seconds before vhosts in the generated config are re-validated even if no instance changed
+            revalidate_interval: int = 300
+
+        class DNS(BaseModel):
+            # bounds in seconds on how long a custom domain validation is cached, within these the DNS record TTL is used
+            min_ttl: int = 30
+            max_ttl: int = 900
+
+            # how long failed validations are cached for
+            negative_ttl: int = 30
+
+            # number of (domain, owner) validation results kept
+            cache_size: int = 4096
+
+            # resolvers to validate custom domains with, defaults to the system resolvers
+            # (only with the system resolvers do names DNS doesn't know fall back to /etc/hosts)
+            nameservers: Optional[List[str]] = None
+            port: int = 53
+
+            # seconds allowed for a single lookup, and for a whole batch of validations
+            lookup_timeout: float = 3
+            batch_deadline: float = 10
+
+            max_concurrent_lookups: int = 16
+
         base_fqdn: str
         bridge: str
         vlan: Optional[int]
@@ -269,16 +353,96 @@ class Proxmox(BaseModel):
         port_forward: PortForward
         vhosts: VHostRequirements
         traefik: Traefik
+        dns: DNS = DNS()
+
+    class Inventory(BaseModel):
+        # seconds between background refreshes of the instance inventory snapshot
+        refresh_interval: int = 30
+
+        # oldest snapshot (in seconds) that listings will be served from
+        max_age: int = 60
+
+    class Provisioning(BaseModel):
+        # clones out of a single template node / migrations into a single target node running at once
+        max_concurrent_clones_per_node: int = 2
+        max_concurrent_migrations_per_node: int = 2
+
+        # instances a bulk creation works on at once
+        bulk_parallelism: int = 8
+
+        # seconds an IP/port/node held (across worker processes) for an instance still being set up is kept for
+        # if the process holding it goes away
+        reservation_ttl: int = 1800
+
+    class Scheduler(BaseModel):
+        class Weights(BaseModel):
+            memory: float = 0.5
+            cpu: float = 0.2
+            disk: float = 0.2
+            instances: float = 0.1
+
+        # least-loaded spreads instances out, bin-packing fills nodes up one at a time
+        strategy: str = "least-loaded"
+        weights: Weights = Weights()
+
+        # nodes are only considered if their memory/disk use stays under these fractions with the instance on them
+        max_memory_ratio: float = 0.9
+        max_disk_ratio: float = 0.9
+
+    class Templates(BaseModel):
+        # seconds the template catalogue is served from memory before it is read from Proxmox again
+        ttl: int = 3600
+
+        # seconds between background refreshes of the template catalogue
+        refresh_interval: int = 600
+
+    class Tasks(BaseModel):
+        # first and longest delay (in seconds) between polls of a task/lock/guest agent
+        poll_initial_interval: float = 0.25
+        poll_max_interval: float = 5
+
+        # how long to wait for a clone/migrate task to finish
+        timeout: int = 300
 
     blacklisted_nodes: List[str]
     cluster: Cluster
     lxc: LXC
     vps: VPS
     network: Network
+    inventory: Inventory = Inventory()
+    tasks: Tasks = Tasks()
+    templates: Templates = Templates()
+    scheduler: Scheduler = Scheduler()
+    provisioning: Provisioning = Provisioning()
 
     instance_dir_pool: str = "local"
     template_dir_pool: str = "local"
 
+class Jobs(BaseModel):
+    # where queued/running/finished jobs are kept, shared by every API worker process
+    # defaults to jobs.db in the app directory (/app in the image), give sqlite an absolute path (sqlite:////path/to/jobs.db)
+    # since relative ones depend on the working directory
+    database_url: str = f"sqlite:///{Path(__file__).resolve().parents[2] / 'jobs.db'}"
+
+    # jobs each API worker process runs at once
+    workers: int = 4
+
+    # jobs touching the same Proxmox node that may run at once across all processes
+    max_concurrent_per_node: int = 2
+
+    # seconds between checks for new jobs
+    poll_interval: float = 1
+
+    # a running job whose lease isn't renewed for this many seconds is assumed lost and retried/failed
+    lease_seconds: int = 60
+
+    # delay before retrying a failed job, doubled for every attempt up to the max
+    retry_backoff: float = 30
+    retry_backoff_max: float = 600
+
+    # finished jobs are kept (so their status can be read) for this many seconds
+    retention: int = 7 * 24 * 60 * 60
+
 class Config(BaseModel):
     production: bool = False
     accounts: Accounts
@@ -289,3 +453,4 @@ class Config(BaseModel):
     metrics: Metrics = Metrics()
     captcha: Optional[Captcha]
     proxmox: Proxmox
+    jobs: Jobs = Jobs()
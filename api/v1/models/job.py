@@ -0,0 +1,36 @@
+import datetime
+
+from pydantic import BaseModel
+from typing import Optional, Dict
+from enum import Enum
+
+class Status(str, Enum):
+    Queued = "queued"
+    Running = "running"
+    Succeeded = "succeeded"
+    Failed = "failed"
+
+class Job(BaseModel):
+    id: str
+    kind: str
+
+    # username of the account the job was started for
+    owner: str
+
+    status: Status
+
+    # human readable description of what the job is currently doing
+    progress: Optional[str]
+
+    # breakdown of the progress for jobs made up of many parts, e.g. the stage of each instance in a bulk creation
+    detail: Optional[Dict[str, str]]
+
+    attempts: int
+    max_attempts: int
+
+    # error from the most recent failed attempt
+    error: Optional[str]
+
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    finished_at: Optional[datetime.datetime]
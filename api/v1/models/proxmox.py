@@ -1,9 +1,14 @@
 
 import datetime
 import ipaddress
+import json
+import hashlib
+import threading
+import cachetools
+import yaml
 
 from typing import Optional, Union, List, Dict, Tuple, Set
-from pydantic import BaseModel, constr, EmailStr, Field, conint
+from pydantic import BaseModel, constr, EmailStr, Field, conint, PrivateAttr
 from enum import Enum
 
 from .account import Username
@@ -81,7 +86,101 @@ class Specs(BaseModel):
     # swap
     swap: int = 0
 
-class TemplateMetadata(BaseModel):
+class NodeScore(BaseModel):
+    node: str
+
+    # whether an instance with the requested specs fits on the node, remarks say why not
+    fits: bool
+    remarks: List[str] = []
+
+    # weighted load (0-1) of the node if the instance was placed on it
+    load: float
+
+    # fraction of memory/disk in use if the instance was placed on it, cpu load right now
+    memory: float
+    cpu: float
+    disk: float
+
+    instances: int
+
+    # instances still being created on the node
+    pending: int
+
+class Placement(BaseModel):
+    strategy: str
+
+    # None if the instance doesn't fit anywhere
+    node: Optional[str]
+
+    scores: List[NodeScore]
+
+# the libyaml bindings are many times faster, fall back to the pure python ones if PyYAML was built without them
+_DescriptionLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+class _DescriptionDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """Dumps multiline strings as blocks so they're readable in the Proxmox web ui"""
+
+def _represent_str(dumper, data):
+    if '\n' in data:
+        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_scalar(u'tag:yaml.org,2002:str', data)
+
+_DescriptionDumper.add_representer(str, _represent_str)
+
+class Description(BaseModel):
+    """
+    Metadata stored as YAML in the description of an instance/template
+
+    Parsed descriptions are cached by their hash so listing instances doesn't parse the same descriptions
+    over and over, callers always get their own copy since metadata is modified in place before being written back
+    """
+
+    # parsed descriptions kept in memory, shared by every Description model
+    _cache = cachetools.LRUCache(maxsize=4096)
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def _cache_key(cls, description: str):
+        return (cls, hashlib.sha1(description.encode()).digest())
+
+    @classmethod
+    def from_description(cls, description: str):
+        """Parse a description written out by to_description"""
+        key = cls._cache_key(description)
+
+        with Description._cache_lock:
+            parsed = Description._cache.get(key)
+
+        if parsed is None:
+            parsed = cls.parse_obj(yaml.load(description, Loader=_DescriptionLoader))
+
+            with Description._cache_lock:
+                Description._cache[key] = parsed
+
+        return parsed.copy(deep=True)
+
+    def to_description(self) -> str:
+        """Turns metadata into readable yaml so it looks pretty in the Proxmox web ui"""
+        # https://github.com/samuelcolvin/pydantic/issues/1043
+        data = json.loads(self.json())
+
+        description = yaml.dump(
+            data,
+            Dumper=_DescriptionDumper,
+            default_flow_style=False,
+            explicit_start=None,
+            default_style='', width=8192
+        )
+
+        # it's about to be written out so it'll be read back soon, cache what parsing it would give
+        parsed = self.parse_obj(data)
+
+        with Description._cache_lock:
+            Description._cache[self._cache_key(description)] = parsed
+
+        return description
+
+class TemplateMetadata(Description):
     title: str
     subtitle: str
     description: str
@@ -97,6 +196,9 @@ class Template(BaseModel):
     metadata: TemplateMetadata
     specs: Specs
 
+    # digest of the Proxmox config the template was read from
+    _digest: Optional[str] = PrivateAttr(default=None)
+
 from .account import Username
 from .jwt import Payload, Serialized
     
@@ -139,6 +241,13 @@ class VHostOptions(BaseModel):
     port: int = Field(**Port)
     https: bool = False
 
+class VHostClaim(BaseModel):
+    fqdn: str
+    owner: str
+
+    # None if the domain could not be validated in time
+    valid: Optional[bool]
+
 class Network(BaseModel):
     vhosts: Dict[str,VHostOptions] = {}
     ports: Dict[int, int] = {}
@@ -148,6 +257,12 @@ class InstanceRequestDetail(BaseModel):
     template_id: str = Field(**TemplateID)
     reason: str = Field(**Reason)
 
+class BulkInstanceRequest(BaseModel):
+    username: str = Field(**Username)
+    type: Type
+    hostname: str = Field(**Hostname)
+    detail: InstanceRequestDetail
+
 class InstanceRequest(Payload):
     sub: constr(regex=r'^admin instance request$') = "admin instance request"
     username: str = Field(**Username)
@@ -161,7 +276,7 @@ class InstanceRequestDenial(BaseModel):
 class RespecRequest(BaseModel):
     details: str
 
-class Metadata(BaseModel):
+class Metadata(Description):
     groups: List[str] = []
     host_vars: dict = {}
 
@@ -193,6 +308,21 @@ class Status(str, Enum):
     Stopped = 'Stopped'
     Running = 'Running'
 
+class Usage(BaseModel):
+    # fraction of the allocated cores in use
+    cpu: float = 0
+
+    # bytes of ram
+    memory: int = 0
+    max_memory: int = 0
+
+    # bytes of disk
+    disk: int = 0
+    max_disk: int = 0
+
+    # seconds since boot
+    uptime: int = 0
+
 class Instance(BaseModel):
     type: Type
 
@@ -224,4 +354,11 @@ class Instance(BaseModel):
     # Remarks about the VM and it's configuration we return to the user
     remarks: List[str] = []
 
-    status: Status
\ No newline at end of file
+    status: Status
+
+    # Live resource usage, as last reported by the cluster
+    usage: Optional[Usage] = None
+
+    # digest of the Proxmox config and the description the metadata was read from
+    _digest: Optional[str] = PrivateAttr(default=None)
+    _description: Optional[str] = PrivateAttr(default=None)
\ No newline at end of file
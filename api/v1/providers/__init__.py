@@ -8,7 +8,7 @@ import random
 from pathlib import Path
 
 from v1 import exceptions
-from . import accounts, email, proxmox
+from . import accounts, email, proxmox, jobs
 
 from v1.config import config
 
@@ -26,6 +26,8 @@ try:
 
   proxmox = proxmox.Proxmox()
 
+  jobs = jobs.JobQueue()
+
 except exceptions.provider.Unavailable as e:
   # Kills the docker container
   t = random.randint(2,6)
@@ -8,10 +8,11 @@ import python_freeipa as freeipa
 import requests
 import cachetools
 import time
-import cachetools
 import inspect
+import threading
 
-from pydantic import EmailStr
+from typing import Optional, Set
+from pydantic import EmailStr, ValidationError
 from v1 import models, exceptions
 from v1.config import config
 
@@ -22,12 +23,205 @@ import warnings
 # Toggles error given off by FreeIPA
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 
+class AccountCache:
+    """
+        Accounts read from FreeIPA, looked up by username or by email
+
+        Both indexes lead to the same record so an account read one way is cached for the other, and invalidating
+        an account drops it from both. Usernames/emails that had no account are remembered (for a shorter time) too
+    """
+
+    def __init__(self, size: int, ttl: int, negative_ttl: int):
+        self._lock = threading.Lock()
+
+        self._accounts = cachetools.TTLCache(maxsize=size, ttl=ttl)
+
+        # lowercase email -> username, checked against the record it leads to since the two expire separately
+        self._usernames_by_email = cachetools.TTLCache(maxsize=size, ttl=ttl)
+
+        # ("username" | "email", key) of lookups that found nothing
+        self._missing = cachetools.TTLCache(maxsize=size, ttl=negative_ttl)
+
+    def get_by_username(
+        self,
+        username: str
+    ) -> Optional[models.account.Account]:
+        with self._lock:
+            return self._accounts.get(username)
+
+    def get_by_email(
+        self,
+        email: str
+    ) -> Optional[models.account.Account]:
+        with self._lock:
+            username = self._usernames_by_email.get(email.lower())
+            if username is None:
+                return None
+
+            account = self._accounts.get(username)
+            if account is None or account.email is None or account.email.lower() != email.lower():
+                return None
+
+            return account
+
+    def put(
+        self,
+        account: models.account.Account
+    ):
+        with self._lock:
+            old = self._accounts.get(account.username)
+            if old is not None and old.email is not None:
+                self._usernames_by_email.pop(old.email.lower(), None)
+
+            self._accounts[account.username] = account
+            self._missing.pop(("username", account.username), None)
+
+            if account.email is not None:
+                self._usernames_by_email[account.email.lower()] = account.username
+                self._missing.pop(("email", account.email.lower()), None)
+
+    def is_missing(
+        self,
+        kind: str,
+        key: str
+    ) -> bool:
+        with self._lock:
+            return (kind, key.lower() if kind == "email" else key) in self._missing
+
+    def put_missing(
+        self,
+        kind: str,
+        key: str
+    ):
+        with self._lock:
+            self._missing[(kind, key.lower() if kind == "email" else key)] = True
+
+    def invalidate(
+        self,
+        username: Optional[str] = None,
+        email: Optional[str] = None
+    ):
+        """Forget everything about an account (including that it didn't exist) by its username and/or email"""
+        with self._lock:
+            if username is not None:
+                account = self._accounts.pop(username, None)
+                if account is not None and account.email is not None:
+                    self._usernames_by_email.pop(account.email.lower(), None)
+
+                self._missing.pop(("username", username), None)
+
+            if email is not None:
+                username = self._usernames_by_email.pop(email.lower(), None)
+                if username is not None:
+                    self._accounts.pop(username, None)
+
+                self._missing.pop(("email", email.lower()), None)
+
+class DirectoryReplica:
+    """
+        Copy of every account (active and staged) in FreeIPA, replaced wholesale by each sync
+
+        Accounts we change are written through as soon as we change them, and a sync that was already
+        reading when that happened leaves them alone so it can't undo the change
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._accounts: Dict[str, models.account.Account] = {}
+        self._usernames_by_email: Dict[str, str] = {}
+
+        # monotonic time of our last write through for each username
+        self._touched_at: Dict[str, float] = {}
+
+        self._synced_at: Optional[float] = None
+
+    def age(self) -> float:
+        """Seconds since the replica was last synced"""
+        if self._synced_at is None:
+            return float("inf")
+
+        return time.monotonic() - self._synced_at
+
+    def _index(
+        self,
+        accounts: Dict[str, models.account.Account]
+    ) -> Dict[str, str]:
+        return { account.email.lower(): username for username, account in accounts.items() if account.email is not None }
+
+    def replace(
+        self,
+        accounts: Dict[str, models.account.Account],
+        taken_at: float
+    ):
+        """Replace every account with a full read of FreeIPA that started at taken_at"""
+        with self._lock:
+            accounts = dict(accounts)
+
+            for username, touched_at in self._touched_at.items():
+                if touched_at < taken_at:
+                    continue
+
+                if username in self._accounts:
+                    accounts[username] = self._accounts[username]
+                else:
+                    accounts.pop(username, None)
+
+            self._accounts = accounts
+            self._usernames_by_email = self._index(accounts)
+            self._touched_at = { username: touched_at for username, touched_at in self._touched_at.items() if touched_at >= taken_at }
+            self._synced_at = taken_at
+
+    def put(
+        self,
+        account: models.account.Account
+    ):
+        with self._lock:
+            self._accounts = { **self._accounts, account.username: account }
+            self._usernames_by_email = self._index(self._accounts)
+            self._touched_at[account.username] = time.monotonic()
+
+    def remove(
+        self,
+        username: str
+    ):
+        with self._lock:
+            self._accounts = { name: account for name, account in self._accounts.items() if name != username }
+            self._usernames_by_email = self._index(self._accounts)
+            self._touched_at[username] = time.monotonic()
+
+    def get_by_username(
+        self,
+        username: str
+    ) -> Optional[models.account.Account]:
+        return self._accounts.get(username)
+
+    def get_by_email(
+        self,
+        email: str
+    ) -> Optional[models.account.Account]:
+        with self._lock:
+            username = self._usernames_by_email.get(email.lower())
+
+            return self._accounts.get(username) if username is not None else None
+
+    def all(self) -> Dict[str, models.account.Account]:
+        return self._accounts
+
 class FreeIPA:    
     _client_instance : freeipa.ClientMeta = None
     _session_timer: int = 0
 
-    _account_cache: cachetools.TTLCache
-    _group_cache: cachetools.TTLCache
+    _account_cache: AccountCache
+
+    # every group in FreeIPA by name, loaded in one go
+    _groups: Optional[Dict[str, models.group.Group]] = None
+    _groups_loaded_at: float = 0
+
+    # groups in FreeIPA our group model can't represent (i.e "trust admins"), left out of the catalogue
+    _unsupported_groups: Set[str] = set()
+
+    # None unless enabled in the config
+    _replica: Optional[DirectoryReplica] = None
 
 
     def __init__(self):
@@ -35,8 +229,15 @@ class FreeIPA:
         
         logger.info("Ensuring groups setup in FreeIPA")
 
-        self._group_cache = cachetools.TTLCache(maxsize=16, ttl=300)
-        self._account_cache = cachetools.TTLCache(maxsize=100, ttl=90)
+        self._groups_lock = threading.Lock()
+
+        if config.accounts.freeipa.replica.enabled:
+            self._replica = DirectoryReplica()
+        self._account_cache = AccountCache(
+            config.accounts.freeipa.cache.size,
+            config.accounts.freeipa.cache.ttl,
+            config.accounts.freeipa.cache.negative_ttl
+        )
 
         for group in models.group.groups:
             if not self.group_exists(group.group_name):
@@ -46,6 +247,7 @@ class FreeIPA:
                     o_description = group.description,
                     o_gidnumber = group.gid
                 )
+                self._put_group(group)
 
     @property
     def _client(self):
@@ -93,6 +295,8 @@ class FreeIPA:
         account: models.account.Account, 
         password: models.password.Password
     ):
+        self._account_cache.invalidate(account.username, account.email)
+
         if account.verified is True:
             find = self._client.user_find(
                 o_uid=account.username
@@ -144,39 +348,21 @@ class FreeIPA:
         self,
         username: models.account.Username
     ) -> bool:
-        if username in self._account_cache:
-            return True
-
-        res = self._client.user_find(o_uid=username)
-        
-        if res['count'] > 0:
-            return True
-
-        res2 = self._client.stageuser_find(o_uid=username)
-
-        if res2['count'] > 0:
+        try:
+            self.read_account_by_username(username, fresh_verification=False)
             return True
-
-        return False
+        except exceptions.resource.NotFound:
+            return False
 
     def email_exists(
         self,
         email: EmailStr
     ) -> bool:
-        if email in self._account_cache:
-            return True
-
-        res = self._client.user_find(o_mail=email)
-
-        if res['count'] > 0:
-            return True
-
-        res2 = self._client.stageuser_find(o_mail=email)
-
-        if res2['count'] > 0:
+        try:
+            self.read_account_by_email(email, fresh_verification=False)
             return True
-
-        return False
+        except exceptions.resource.NotFound:
+            return False
 
     def group_exists(
         self,
@@ -188,83 +374,242 @@ class FreeIPA:
         except exceptions.resource.NotFound:
             return False
 
+    def _group_from_find_result(
+        self,
+        name: str,
+        result: dict
+    ) -> models.group.Group:
+        if 'posixgroup' in result['objectclass']:
+            description = None
+            if 'description' in result:
+                description = result['description'][0]
+
+            return models.group.Group(
+                group_name = name,
+                description = description,
+                gid = result['gidnumber'][0]
+            )
+        else:
+            return models.group.Group(
+                group_name = name
+            )
+
+    def refresh_groups(
+        self
+    ) -> Dict[str, models.group.Group]:
+        """Reload the catalogue of every group in FreeIPA with a single group_find"""
+        loaded_at = time.monotonic()
+        group_find = self._client.group_find(o_sizelimit=0)
+
+        groups = {}
+        unsupported_groups = set()
+        for result in group_find['result']:
+            name = result['cn'][0]
+
+            try:
+                groups[name] = self._group_from_find_result(name, result)
+            except ValidationError as e:
+                logger.info("skipping group with unsupported name", group=name, e=e)
+                unsupported_groups.add(name)
+
+        with self._groups_lock:
+            self._groups = groups
+            self._groups_loaded_at = loaded_at
+            self._unsupported_groups = unsupported_groups
+
+        return groups
+
+    def _get_groups(
+        self
+    ) -> Dict[str, models.group.Group]:
+        with self._groups_lock:
+            groups = self._groups
+
+            if groups is not None and time.monotonic() - self._groups_loaded_at <= config.accounts.freeipa.groups.max_age:
+                return groups
+
+        return self.refresh_groups()
+
+    def _put_group(
+        self,
+        group: models.group.Group
+    ):
+        """Add a group to the catalogue without reloading it"""
+        with self._groups_lock:
+            if self._groups is not None:
+                self._groups = { **self._groups, group.group_name: group }
+
     def read_group_by_name(
         self,
         name: models.group.GroupName
     ) -> models.group.Group:
-        if name in self._group_cache:
-            return self._group_cache[name]
+        group = self._get_groups().get(name)
+        if group is not None:
+            return group
 
+        if name in self._unsupported_groups:
+            raise exceptions.resource.NotFound(f"group {name} is not supported")
+
+        # may have been added since the catalogue was loaded
         group_find = self._client.group_find(o_cn=name)
  
         if group_find['count'] != 0:
-            if 'posixgroup' in group_find['result'][0]['objectclass']:
-                description = None
-                if 'description' in group_find['result'][0]:
-                    description = group_find['result'][0]['description'][0]
-
-                return models.group.Group(
-                    group_name = name,
-                    description = description,
-                    gid = group_find['result'][0]['gidnumber'][0]
-                )
-            else:
-                return models.group.Group(
-                    group_name = name
-                )
+            try:
+                group = self._group_from_find_result(name, group_find['result'][0])
+            except ValidationError:
+                with self._groups_lock:
+                    self._unsupported_groups = self._unsupported_groups | {name}
+
+                raise exceptions.resource.NotFound(f"group {name} is not supported")
+
+            self._put_group(group)
 
             return group
         
         raise exceptions.resource.NotFound(f"could not find group {name}")
 
-    def _populate_accounts_from_user_find(self, find) -> Dict[str, models.account.Account]:
+    def _populate_accounts_from_user_find(self, find, skip_invalid: bool = False) -> Dict[str, models.account.Account]:
+        """skip_invalid leaves out accounts our model can't represent instead of failing the whole find"""
         if find['count'] == 0:
             return {}   
 
         accounts = {}
+        catalogue = self._get_groups()
 
         for i in range(find['count']):
             groups = {}
             
-            for group_name in find['result'][i]['memberof_group']:
-                groups[group_name] = self.read_group_by_name(group_name)
+            # groups missing from the catalogue are unsupported or new, new ones are picked up by the next refresh
+            for group_name in find['result'][i].get('memberof_group', []):
+                if group_name in catalogue:
+                    groups[group_name] = catalogue[group_name]
 
             username = find['result'][i]['uid'][0]
-            accounts[username] = models.account.Account(
-                username=find['result'][i]['uid'][0],
-                email=find['result'][i]['mail'][0] if 'mail' in find['result'][i] else None,
-                uid=find['result'][i]['uidnumber'][0],
-                groups=groups,
-                home_dir=find['result'][i]['homedirectory'][0],
-                verified=True
-            )
+            try:
+                accounts[username] = models.account.Account(
+                    username=find['result'][i]['uid'][0],
+                    email=find['result'][i]['mail'][0] if 'mail' in find['result'][i] else None,
+                    uid=find['result'][i]['uidnumber'][0],
+                    groups=groups,
+                    home_dir=find['result'][i]['homedirectory'][0],
+                    verified=True
+                )
+            except ValidationError as e:
+                if not skip_invalid:
+                    raise
+
+                logger.info("skipping unsupported account", username=username, e=e)
 
         return accounts
 
 
-    def _populate_accounts_from_stageuser_find(self, find) -> Dict[str, models.account.Account]:
+    def _populate_accounts_from_stageuser_find(self, find, skip_invalid: bool = False) -> Dict[str, models.account.Account]:
         if find['count'] == 0:
             return {}
 
         accounts = {}
         for i in range(find['count']):
-            username = find['result'][0]['uid'][0]
-            accounts[username] = models.account.Account(
-                username=find['result'][0]['uid'][0],
-                email=find['result'][0]['mail'][0],
-                groups={},
-                home_dir=None,
-                verified=False  
-            )
+            username = find['result'][i]['uid'][0]
+            try:
+                accounts[username] = models.account.Account(
+                    username=find['result'][i]['uid'][0],
+                    email=find['result'][i]['mail'][0],
+                    groups={},
+                    home_dir=None,
+                    verified=False  
+                )
+            except ValidationError as e:
+                if not skip_invalid:
+                    raise
+
+                logger.info("skipping unsupported staged account", username=username, e=e)
 
         return accounts
 
+    def _use_replica(self, max_age: Optional[int] = None) -> bool:
+        if max_age is None:
+            max_age = config.accounts.freeipa.replica.max_age
+
+        return self._replica is not None and self._replica.age() <= max_age
+
+    def sync_directory(self):
+        """Re-read every account (and group) from FreeIPA into the replica, if there is one"""
+        if self._replica is None:
+            return
+
+        start = time.monotonic()
+        self.refresh_groups()
+
+        taken_at = time.monotonic()
+        find = self._client.user_find(o_sizelimit=0)
+        find2 = self._client.stageuser_find(o_sizelimit=0)
+
+        accounts = self._populate_accounts_from_user_find(find, skip_invalid=True)
+        staged_accounts = self._populate_accounts_from_stageuser_find(find2, skip_invalid=True)
+
+        self._replica.replace({**staged_accounts, **accounts}, taken_at)
+
+        logger.debug("synced FreeIPA directory", accounts=len(accounts), staged_accounts=len(staged_accounts), seconds=time.monotonic() - start)
+
+    def _write_through(
+        self,
+        username: str
+    ):
+        """Re-read an account we just changed from FreeIPA into the replica"""
+        if self._replica is None:
+            return
+
+        find = self._client.user_find(o_uid=username)
+        if find['count'] > 0:
+            self._replica.put(self._populate_accounts_from_user_find(find)[username])
+            return
+
+        find2 = self._client.stageuser_find(o_uid=username)
+        if find2['count'] > 0:
+            self._replica.put(self._populate_accounts_from_stageuser_find(find2)[username])
+            return
+
+        self._replica.remove(username)
+
+    def _is_fresh_enough(
+        self,
+        account: Optional[models.account.Account],
+        fresh_verification: bool
+    ) -> bool:
+        """Whether a replica/cached copy of an account can be served"""
+        return account is not None and (account.verified or not fresh_verification)
+
+    def _replica_max_age(
+        self,
+        fresh_verification: bool
+    ) -> Optional[int]:
+        # reads that back auth only trust a replica that missed a sync as long as a cached copy would be trusted,
+        # otherwise group revocations made elsewhere would stick around for the replica's max_age
+        return config.accounts.freeipa.cache.ttl if fresh_verification else None
+
     def read_account_by_username(
         self,
-        username : models.account.Username
+        username : models.account.Username,
+        fresh_verification: bool = True
     ) -> models.account.Account:
-        if username in self._account_cache:
-           return self._account_cache[username]
+        """
+        Accounts made or verified by other API workers only show up in our replica/cache after the next sync or expiry,
+        so misses and unverified copies (someone could be verifying right now) go to FreeIPA
+
+        Callers that only need to know the account exists (verifying it doesn't change that) pass fresh_verification=False
+        to be served unverified copies too
+        """
+        if self._use_replica(self._replica_max_age(fresh_verification)):
+            account = self._replica.get_by_username(username)
+            if self._is_fresh_enough(account, fresh_verification):
+                return account
+
+        account = self._account_cache.get_by_username(username)
+        if self._is_fresh_enough(account, fresh_verification):
+            return account
+
+        if self._account_cache.is_missing("username", username):
+            raise exceptions.resource.NotFound("could not find user account")
 
         find = self._client.user_find(
             o_uid=username
@@ -273,7 +618,7 @@ class FreeIPA:
         if find['count'] > 0:
             account = self._populate_accounts_from_user_find(find)[username]
 
-            self._account_cache[account.username] = account
+            self._account_cache.put(account)
             return account
 
         find2 = self._client.stageuser_find(
@@ -282,16 +627,30 @@ class FreeIPA:
 
         if find2['count'] > 0:
             account = self._populate_accounts_from_stageuser_find(find2)[username]
+
+            self._account_cache.put(account)
             return account
 
+        self._account_cache.put_missing("username", username)
         raise exceptions.resource.NotFound("could not find user account")
 
     def read_account_by_email(
         self,
-        email : EmailStr
+        email : EmailStr,
+        fresh_verification: bool = True
     ) -> models.account.Account:
-        if email in self._account_cache:
-           return self._account_cache[email]
+        """Like read_account_by_username"""
+        if self._use_replica(self._replica_max_age(fresh_verification)):
+            account = self._replica.get_by_email(email)
+            if self._is_fresh_enough(account, fresh_verification):
+                return account
+
+        account = self._account_cache.get_by_email(email)
+        if self._is_fresh_enough(account, fresh_verification):
+            return account
+
+        if self._account_cache.is_missing("email", email):
+            raise exceptions.resource.NotFound("could not find user account")
 
         find = self._client.user_find(
             o_mail=email
@@ -300,7 +659,7 @@ class FreeIPA:
         if find['count'] > 0:
             account = list(self._populate_accounts_from_user_find(find).items())[0][1]
 
-            self._account_cache[email] = account
+            self._account_cache.put(account)
             return account
 
         find2 = self._client.stageuser_find(
@@ -309,19 +668,25 @@ class FreeIPA:
 
         if find2['count'] > 0:
             account = list(self._populate_accounts_from_stageuser_find(find2).items())[0][1]
+
+            self._account_cache.put(account)
             return account
 
+        self._account_cache.put_missing("email", email)
         raise exceptions.resource.NotFound("could not find user account")
 
 
     def read_accounts_all(
         self
     ) -> Dict[str, models.account.Account]:
+        if self._use_replica():
+            return dict(self._replica.all())
+
         find = self._client.user_find()
         find2 = self._client.stageuser_find()
 
-        accounts = self._populate_accounts_from_user_find(find)
-        staged_accounts = self._populate_accounts_from_stageuser_find(find2)
+        accounts = self._populate_accounts_from_user_find(find, skip_invalid=True)
+        staged_accounts = self._populate_accounts_from_stageuser_find(find2, skip_invalid=True)
 
         return {**staged_accounts, **accounts}
 
@@ -332,7 +697,7 @@ class FreeIPA:
         if self.username_exists(sign_up.username):
             raise exceptions.resource.AlreadyExists("account already exists with this username")
 
-        if self.email_exists(sign_up.username):
+        if self.email_exists(sign_up.email):
             raise exceptions.resource.AlreadyExists("account already exists with this email")
 
         if self.group_exists(sign_up.username):
@@ -362,6 +727,10 @@ class FreeIPA:
             o_homedirectory=str(home_dir),
             o_mail=sign_up.email
         )
+
+        # both were just cached as not existing
+        self._account_cache.invalidate(sign_up.username, sign_up.email)
+        self._write_through(sign_up.username)
         
     def verify_account(
         self,
@@ -381,6 +750,7 @@ class FreeIPA:
 
         # Activate the user
         self._client.stageuser_activate(account.username)
+        self._account_cache.invalidate(account.username, account.email)
 
         # Add the user we just activated to account group
         for group in [models.group.NetsocAccount]:
@@ -392,6 +762,9 @@ class FreeIPA:
             except freeipa.exceptions.FreeIPAError as e:
                 raise exceptions.provider.Failed(f"error adding newly activated user to group: {e}")
 
+        # picks up the groups it was just added to
+        self._account_cache.invalidate(account.username, account.email)
+        self._write_through(account.username)
         account = self.read_account_by_username(account.username)
 
         # Set their password
@@ -0,0 +1,406 @@
+import os
+import json
+import uuid
+import time
+import datetime
+import socket
+import threading
+import contextlib
+import structlog as logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import create_engine, func, Column, Integer, Float, String, Text, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import aliased, sessionmaker
+
+from v1 import models, exceptions
+from v1.config import config
+
+logger = logging.getLogger(__name__)
+
+Base = declarative_base()
+
+class JobRecord(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(36), primary_key=True)
+    kind = Column(String(64), nullable=False)
+    owner = Column(String(64), nullable=False, index=True)
+
+    # jobs with the same node count towards that node's concurrency limit
+    node = Column(String(64), nullable=True)
+
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, index=True)
+    progress = Column(Text, nullable=True)
+
+    # JSON, handler specific breakdown of the progress
+    detail = Column(Text, nullable=True)
+
+    error = Column(Text, nullable=True)
+
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=1)
+
+    # unix times, when the job may next be started and when the lease of whoever is running it runs out
+    run_after = Column(Float, nullable=False)
+    lease_owner = Column(String(128), nullable=True)
+    lease_expires = Column(Float, nullable=True)
+
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+class Handler(NamedTuple):
+    fn: Callable[[str, Dict[str, Any]], None]
+    max_attempts: int
+
+class JobQueue:
+    """
+        Persistent queue of long running jobs (like creating instances) run by a pool of worker threads
+
+        Jobs are stored in a database shared by every API worker process, a process claims a job by taking a
+        lease on it and keeps renewing the lease while the job runs, so jobs left behind by a process that died
+        are retried (or failed) once their lease runs out
+
+        Handlers are registered by name and called with (job id, payload) where payload is the JSON-able dict
+        the job was enqueued with
+    """
+
+    _handlers: Dict[str, Handler]
+    _running: Dict[str, str]
+
+    def __init__(self):
+        logger.info("job queue provider created")
+
+        self._engine = create_engine(
+            config.jobs.database_url,
+            connect_args={"check_same_thread": False, "timeout": 30} if config.jobs.database_url.startswith("sqlite") else {}
+        )
+        Base.metadata.create_all(self._engine)
+        self._sessionmaker = sessionmaker(bind=self._engine)
+
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers = {}
+
+        self._lock = threading.Lock()
+        self._running = {}
+        self._wakeup = threading.Event()
+        self._executor = None
+        self._dispatcher = None
+        self._purged_at = 0.0
+
+    @contextlib.contextmanager
+    def _session(
+        self,
+        exclusive: bool = False
+    ):
+        """
+        A session committed when the block exits
+
+        An exclusive session takes the database's write lock up front (on SQLite), so nothing another process
+        writes can land between what it reads and what it writes
+        """
+        session = self._sessionmaker()
+        try:
+            if exclusive and self._engine.dialect.name == "sqlite":
+                session.execute("BEGIN IMMEDIATE")
+
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _to_model(
+        self,
+        record: JobRecord
+    ) -> models.job.Job:
+        return models.job.Job(
+            id=record.id,
+            kind=record.kind,
+            owner=record.owner,
+            status=record.status,
+            progress=record.progress,
+            detail=json.loads(record.detail) if record.detail is not None else None,
+            attempts=record.attempts,
+            max_attempts=record.max_attempts,
+            error=record.error,
+            created_at=record.created_at,
+            updated_at=record.updated_at,
+            finished_at=record.finished_at
+        )
+
+    def handler(
+        self,
+        kind: str,
+        max_attempts: int = 1
+    ):
+        """
+        Decorator registering a function as the handler for jobs of a kind
+
+        Jobs are tried up to max_attempts times, only allow retries if the handler is safe to re-run after failing part way
+        """
+        def register(fn: Callable[[str, Dict[str, Any]], None]):
+            self._handlers[kind] = Handler(fn=fn, max_attempts=max_attempts)
+            return fn
+
+        return register
+
+    def enqueue(
+        self,
+        kind: str,
+        owner: str,
+        payload: Dict[str, Any],
+        node: Optional[str] = None
+    ) -> models.job.Job:
+        """Queue a job to be run by a registered handler, returns the queued job"""
+        if kind not in self._handlers:
+            raise exceptions.resource.NotFound(f"No handler for {kind} jobs")
+
+        now = datetime.datetime.utcnow()
+
+        with self._session() as session:
+            record = JobRecord(
+                id=str(uuid.uuid4()),
+                kind=kind,
+                owner=owner,
+                node=node,
+                payload=json.dumps(payload),
+                status=models.job.Status.Queued.value,
+                progress="Waiting to start",
+                attempts=0,
+                max_attempts=self._handlers[kind].max_attempts,
+                run_after=time.time(),
+                created_at=now,
+                updated_at=now
+            )
+            session.add(record)
+            session.flush()
+
+            job = self._to_model(record)
+
+        self._wakeup.set()
+
+        return job
+
+    def read(
+        self,
+        job_id: str
+    ) -> models.job.Job:
+        with self._session() as session:
+            record = session.query(JobRecord).get(job_id)
+
+            if record is None:
+                raise exceptions.resource.NotFound(f"No such job {job_id}")
+
+            return self._to_model(record)
+
+    def set_progress(
+        self,
+        job_id: str,
+        progress: str,
+        detail: Optional[Dict[str, str]] = None
+    ):
+        """Update the progress message (and optionally the detailed breakdown) of a running job, also renews its lease"""
+        values = {
+            JobRecord.progress: progress,
+            JobRecord.lease_expires: time.time() + config.jobs.lease_seconds,
+            JobRecord.updated_at: datetime.datetime.utcnow()
+        }
+
+        if detail is not None:
+            values[JobRecord.detail] = json.dumps(detail)
+
+        with self._session() as session:
+            session.query(JobRecord).filter(
+                JobRecord.id == job_id,
+                JobRecord.lease_owner == self._worker_id
+            ).update(values, synchronize_session=False)
+
+    def start(self):
+        """Start running jobs in the background"""
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+
+            self._executor = ThreadPoolExecutor(max_workers=config.jobs.workers, thread_name_prefix="job")
+            self._dispatcher = threading.Thread(target=self._dispatch_forever, name="job-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_forever(self):
+        while True:
+            try:
+                self._dispatch()
+            except Exception as e:
+                logger.error("Job dispatch failed", e=e, exc_info=True)
+
+            self._wakeup.wait(config.jobs.poll_interval)
+            self._wakeup.clear()
+
+    def _retry_delay(
+        self,
+        attempts: int
+    ) -> float:
+        return min(config.jobs.retry_backoff * (2 ** (attempts - 1)), config.jobs.retry_backoff_max)
+
+    def _dispatch(self):
+        """Renew our leases, recover lost jobs and claim as many new jobs as we have free workers for"""
+        now = time.time()
+        utcnow = datetime.datetime.utcnow()
+
+        with self._lock:
+            running = list(self._running.keys())
+
+        with self._session() as session:
+            if len(running) > 0:
+                session.query(JobRecord).filter(
+                    JobRecord.id.in_(running),
+                    JobRecord.lease_owner == self._worker_id
+                ).update({
+                    JobRecord.lease_expires: now + config.jobs.lease_seconds
+                }, synchronize_session=False)
+
+            # whoever was running these went away
+            for record in session.query(JobRecord).filter(
+                JobRecord.status == models.job.Status.Running.value,
+                JobRecord.lease_expires < now
+            ).all():
+                logger.info("job lease expired", job=record.id, kind=record.kind, lease_owner=record.lease_owner)
+                self._record_failure(record, "The job was interrupted", now, utcnow)
+
+            if now - self._purged_at > 600:
+                session.query(JobRecord).filter(
+                    JobRecord.finished_at < utcnow - datetime.timedelta(seconds=config.jobs.retention)
+                ).delete(synchronize_session=False)
+                self._purged_at = now
+
+        free = config.jobs.workers - len(running)
+        if free <= 0:
+            return
+
+        claimed = []
+
+        # the per node counts and the claims happen in one transaction, so processes can't both claim a node's last slot
+        with self._session(exclusive=True) as session:
+            running_by_node = dict(
+                session.query(JobRecord.node, func.count(JobRecord.id)).filter(
+                    JobRecord.status == models.job.Status.Running.value,
+                    JobRecord.node != None
+                ).group_by(JobRecord.node).all()
+            )
+
+            candidates = session.query(JobRecord).filter(
+                JobRecord.status == models.job.Status.Queued.value,
+                JobRecord.run_after <= now,
+                JobRecord.kind.in_(list(self._handlers.keys()))
+            ).order_by(JobRecord.created_at).limit(free * 4).all()
+
+            for record in candidates:
+                if len(claimed) >= free:
+                    break
+
+                if record.node is not None and running_by_node.get(record.node, 0) >= config.jobs.max_concurrent_per_node:
+                    continue
+
+                # only one process can win the claim, and only while the node still has room
+                conditions = [
+                    JobRecord.id == record.id,
+                    JobRecord.status == models.job.Status.Queued.value
+                ]
+
+                if record.node is not None:
+                    running = aliased(JobRecord)
+                    conditions.append(session.query(func.count(running.id)).filter(
+                        running.node == record.node,
+                        running.status == models.job.Status.Running.value
+                    ).as_scalar() < config.jobs.max_concurrent_per_node)
+
+                updated = session.query(JobRecord).filter(*conditions).update({
+                    JobRecord.status: models.job.Status.Running.value,
+                    JobRecord.attempts: record.attempts + 1,
+                    JobRecord.lease_owner: self._worker_id,
+                    JobRecord.lease_expires: now + config.jobs.lease_seconds,
+                    JobRecord.progress: "Started",
+                    JobRecord.updated_at: utcnow
+                }, synchronize_session=False)
+
+                if updated == 1:
+                    claimed.append((record.id, record.kind, record.payload))
+
+                    if record.node is not None:
+                        running_by_node[record.node] = running_by_node.get(record.node, 0) + 1
+
+        for job_id, kind, payload in claimed:
+            with self._lock:
+                self._running[job_id] = kind
+
+            self._executor.submit(self._run, job_id, kind, json.loads(payload))
+
+    def _record_failure(
+        self,
+        record: JobRecord,
+        error: str,
+        now: float,
+        utcnow: datetime.datetime
+    ):
+        """Requeue a failed job with backoff if it has attempts left, otherwise mark it failed"""
+        record.error = error
+        record.lease_owner = None
+        record.lease_expires = None
+        record.updated_at = utcnow
+
+        if record.attempts < record.max_attempts:
+            record.status = models.job.Status.Queued.value
+            record.progress = "Waiting to retry"
+            record.run_after = now + self._retry_delay(record.attempts)
+        else:
+            record.status = models.job.Status.Failed.value
+            record.progress = "Failed"
+            record.finished_at = utcnow
+
+    def _run(
+        self,
+        job_id: str,
+        kind: str,
+        payload: Dict[str, Any]
+    ):
+        error = None
+
+        try:
+            self._handlers[kind].fn(job_id, payload)
+        except Exception as e:
+            logger.error("Job failed", job=job_id, kind=kind, e=e, exc_info=True)
+            error = str(e)
+
+        try:
+            with self._session() as session:
+                record = session.query(JobRecord).get(job_id)
+
+                # lost the lease while running, whoever took over owns the job now
+                if record is None or record.lease_owner != self._worker_id:
+                    return
+
+                now = time.time()
+                utcnow = datetime.datetime.utcnow()
+
+                if error is None:
+                    record.status = models.job.Status.Succeeded.value
+                    record.progress = "Done"
+                    record.error = None
+                    record.lease_owner = None
+                    record.lease_expires = None
+                    record.updated_at = utcnow
+                    record.finished_at = utcnow
+                else:
+                    self._record_failure(record, error, now, utcnow)
+        finally:
+            with self._lock:
+                del self._running[job_id]
+
+            # a worker is free, check for more work straight away
+            self._wakeup.set()
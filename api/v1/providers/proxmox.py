@@ -1,6 +1,7 @@
 
 import random
-import yaml
+import json
+import asyncio
 import datetime
 import base64
 import requests
@@ -17,24 +18,215 @@ import ipaddress
 import io
 import re
 import crypt
-import functools
 import string
 import random
 import time
 import selectors
+import threading
+import uuid
+import cachetools
 
 import structlog as logging
 
 from urllib.parse import urlparse, unquote
 
-from typing import Optional, Tuple, List, Dict, Union, Generator
+from typing import Optional, Tuple, List, Dict, Set, Union, Generator, Callable, NamedTuple, Awaitable
 from proxmoxer import ProxmoxAPI
+from prometheus_client import Counter, Histogram
 
 from v1 import models, exceptions, utilities, templates
 from v1.config import config
 
 logger = logging.getLogger(__name__)
 
+domain_validation_cache_lookups = Counter('netsoc_cloud_domain_validation_cache_lookups', 'Vhost validation cache lookups', ['result'])
+vm_read_seconds = Histogram('netsoc_cloud_proxmox_vm_read_seconds', 'Time taken to read a single VM/container config and status', ['kind'])
+coalesced_reads = Counter('netsoc_cloud_proxmox_coalesced_reads', 'Reads that shared the result of an identical read already in flight', ['read'])
+api_pool_wait_seconds = Histogram('netsoc_cloud_proxmox_api_pool_wait_seconds', 'Time spent waiting for a free connection to the Proxmox API')
+
+class NodeSession:
+    """An ssh connection (and sftp session on it) to a cluster node, tunnelled through the jump host"""
+
+    ssh: paramiko.SSHClient
+    sftp: paramiko.SFTPClient
+    jump_transport: paramiko.Transport
+    last_used: float
+
+    def __init__(
+        self,
+        node_name: str,
+        jump_transport: paramiko.Transport
+    ):
+        self.jump_transport = jump_transport
+        self.ssh = paramiko.SSHClient()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        channel = jump_transport.open_channel("direct-tcpip", (node_name, 22), ("0.0.0.0", 22))
+
+        try:
+            self.ssh.connect(
+                node_name, # nodes should be setup in /etc/hosts correctly
+                username=config.proxmox.cluster.ssh.username,
+                password=config.proxmox.cluster.ssh.password,
+                port=22,
+                sock=channel
+            )
+            self.ssh.get_transport().set_keepalive(config.proxmox.cluster.ssh.keepalive_interval)
+
+            self.sftp = self.ssh.open_sftp()
+        except Exception:
+            self.ssh.close()
+            raise
+
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        transport = self.ssh.get_transport()
+
+        if transport is None or not transport.is_active() or not self.jump_transport.is_active():
+            return False
+
+        # cheap round trip to catch connections that died without us noticing
+        if time.monotonic() - self.last_used > config.proxmox.cluster.ssh.keepalive_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+
+        return True
+
+    def close(self):
+        try:
+            self.sftp.close()
+        finally:
+            self.ssh.close()
+
+class SSHPool:
+    """
+        Keeps one authenticated connection to the jump host and pools node sessions tunnelled through it
+
+        Sessions are capped per node, reused while healthy and closed after sitting idle
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jump: Optional[paramiko.SSHClient] = None
+        self._jump_last_used = 0.0
+        self._idle: Dict[str, List[NodeSession]] = {}
+        self._limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._checked_out = 0
+
+    def _get_jump_transport(self) -> paramiko.Transport:
+        """The transport to the jump host, (re)connecting if needed, caller must hold the lock"""
+        if self._jump is not None:
+            transport = self._jump.get_transport()
+
+            if transport is not None and transport.is_active():
+                return transport
+
+            self._jump.close()
+            self._jump = None
+
+        jump = paramiko.SSHClient()
+        jump.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        jump.connect(
+            hostname=config.proxmox.cluster.ssh.server,
+            username=config.proxmox.cluster.ssh.username,
+            password=config.proxmox.cluster.ssh.password,
+            port=config.proxmox.cluster.ssh.port
+        )
+        jump.get_transport().set_keepalive(config.proxmox.cluster.ssh.keepalive_interval)
+
+        self._jump = jump
+        return jump.get_transport()
+
+    def acquire(
+        self,
+        node_name: str
+    ) -> NodeSession:
+        """Check out a session to a node, waiting if the node already has the maximum number of sessions in use"""
+        with self._lock:
+            limit = self._limits.setdefault(node_name, threading.BoundedSemaphore(config.proxmox.cluster.ssh.max_sessions_per_node))
+
+        if not limit.acquire(timeout=config.proxmox.cluster.ssh.acquire_timeout):
+            raise exceptions.resource.Unavailable(f"Timeout occured waiting for an SSH session to {node_name}")
+
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.get(node_name, [])
+                    session = idle.pop() if len(idle) > 0 else None
+
+                if session is None:
+                    break
+
+                if session.is_alive():
+                    break
+
+                session.close()
+
+            if session is None:
+                with self._lock:
+                    jump_transport = self._get_jump_transport()
+                    self._jump_last_used = time.monotonic()
+
+                session = NodeSession(node_name, jump_transport)
+
+            with self._lock:
+                self._checked_out += 1
+
+            return session
+        except Exception:
+            limit.release()
+            raise
+
+    def release(
+        self,
+        node_name: str,
+        session: NodeSession,
+        reusable: bool = True
+    ):
+        """Return a session to the pool, or close it if it shouldn't be reused"""
+        session.last_used = time.monotonic()
+
+        try:
+            if reusable and session.is_alive():
+                with self._lock:
+                    self._idle.setdefault(node_name, []).append(session)
+                    self._jump_last_used = session.last_used
+            else:
+                session.close()
+        finally:
+            with self._lock:
+                self._checked_out -= 1
+
+            self._limits[node_name].release()
+
+    def reap(self):
+        """Close sessions that have been idle too long, and the jump connection if nothing is using it"""
+        now = time.monotonic()
+        expired = []
+
+        with self._lock:
+            for node_name, idle in self._idle.items():
+                expired += [session for session in idle if now - session.last_used > config.proxmox.cluster.ssh.idle_timeout]
+                self._idle[node_name] = [session for session in idle if now - session.last_used <= config.proxmox.cluster.ssh.idle_timeout]
+
+            pooled = any(len(idle) > 0 for idle in self._idle.values())
+
+            jump = None
+            if self._jump is not None and self._checked_out == 0 and not pooled and now - self._jump_last_used > config.proxmox.cluster.ssh.idle_timeout:
+                jump = self._jump
+                self._jump = None
+
+        for session in expired:
+            session.close()
+
+        if jump is not None:
+            jump.close()
+
+ssh_pool = SSHPool()
+
 class ClusterNodeSSH:
     """
         Paramiko SSH client that will first SSH into an exposed Proxmox node, then jump into any of the nodes in the Cluster
@@ -42,56 +234,487 @@ class ClusterNodeSSH:
 
         i.e "ssh leela" should ssh into a clusternode named leela
 
-        Contains ssh and sftp objects for use within the manager
+        Contains ssh and sftp objects for use within the manager, these are borrowed from a shared pool
+        of connections so they must not be closed
     """
 
-    jump: paramiko.SSHClient
-    ssh: paramiko.SSHClient
     node_name: str
+    session: Optional[NodeSession]
 
     ssh: paramiko.SSHClient
     sftp: paramiko.SFTPClient
 
     def __init__(self, node_name: str):
-        self.jump = paramiko.SSHClient()
-        self.ssh = paramiko.SSHClient()
         self.node_name = node_name
+        self.session = None
 
     def __enter__(self):
-        self.jump.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        self.jump.connect(
-            hostname=config.proxmox.cluster.ssh.server,
-            username=config.proxmox.cluster.ssh.username,
-            password=config.proxmox.cluster.ssh.password,
-            port=config.proxmox.cluster.ssh.port
-        )
-
-        self.jump_transport = self.jump.get_transport()
-        self.jump_channel = self.jump_transport.open_channel("direct-tcpip", (self.node_name, 22), ("0.0.0.0", 22))
-
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(
-            self.node_name, # nodes should be setup in /etc/hosts correctly
-            username=config.proxmox.cluster.ssh.username,
-            password=config.proxmox.cluster.ssh.password,
-            port=22,
-            sock=self.jump_channel
-        )
-
-        self.sftp = self.ssh.open_sftp()
+        self.session = ssh_pool.acquire(self.node_name)
+        self.ssh = self.session.ssh
+        self.sftp = self.session.sftp
 
         return self
 
     def __exit__(self, type, value, traceback):
-        self.sftp.close()
-        self.ssh.close()
-        self.jump.close()
+        # don't put a connection back that might be in a weird state
+        reusable = type is None or not issubclass(type, (paramiko.SSHException, socket.error, EOFError))
+
+        ssh_pool.release(self.node_name, self.session, reusable)
+        self.session = None
 
 def build_proxmox_config_string(options: dict):
     """Turns a dict into string of e.g.'key1=value1,key2=value2'"""
     return ",".join(map(lambda d: f"{d[0]}={d[1]}", options.items()))
 
+class InstanceInventory:
+    """
+        Snapshot of every instance in the cluster, keyed by fqdn (and vmid)
+
+        The snapshot is replaced wholesale by a refresh, individual instances are marked dirty
+        by our own mutating calls so readers know to re-read just those instances
+
+        Instances handed out by the snapshot are shared between readers and must be treated as read-only
+    """
+
+    _lock: threading.RLock
+    _instances: Dict[str, models.proxmox.Instance]
+    _fqdn_by_vmid: Dict[int, str]
+    _dirty: Set[str]
+
+    # monotonic time of the last mutation we made to each instance, lets a refresh that was
+    # already in flight avoid clobbering changes made while it was reading
+    _touched_at: Dict[str, float]
+
+    _taken_at: Optional[float]
+    _expired_at: Optional[float]
+
+    # bumped every time the contents of the snapshot change
+    version: int
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instances = {}
+        self._fqdn_by_vmid = {}
+        self._dirty = set()
+        self._touched_at = {}
+        self._taken_at = None
+        self._expired_at = None
+        self.version = 0
+
+    def age(self) -> float:
+        """Seconds since the snapshot was last refreshed"""
+        if self._taken_at is None:
+            return float("inf")
+
+        return time.monotonic() - self._taken_at
+
+    def replace(
+        self,
+        instances: Dict[str, models.proxmox.Instance],
+        taken_at: float
+    ):
+        """Replace the contents of the snapshot with a full read of the cluster that started at taken_at"""
+        with self._lock:
+            instances = dict(instances)
+            dirty = set()
+
+            for fqdn, touched_at in self._touched_at.items():
+                if touched_at < taken_at:
+                    continue
+
+                # we changed this instance after the read started, so the read may be out of date
+                if fqdn in instances:
+                    dirty.add(fqdn)
+                elif fqdn in self._instances:
+                    instances[fqdn] = self._instances[fqdn]
+
+            self._instances = instances
+            self._fqdn_by_vmid = { instance.id: fqdn for fqdn, instance in instances.items() }
+            self._dirty = dirty
+            self._touched_at = { fqdn: touched_at for fqdn, touched_at in self._touched_at.items() if touched_at >= taken_at }
+
+            if self._expired_at is not None and self._expired_at >= taken_at:
+                self._taken_at = None
+            else:
+                self._taken_at = taken_at
+
+            self.version += 1
+
+    def put(
+        self,
+        instance: models.proxmox.Instance
+    ):
+        """Insert or update a single instance"""
+        with self._lock:
+            old = self._instances.get(instance.fqdn)
+            if old is not None and old.id != instance.id:
+                self._fqdn_by_vmid.pop(old.id, None)
+
+            self._instances[instance.fqdn] = instance
+            self._fqdn_by_vmid[instance.id] = instance.fqdn
+            self._dirty.discard(instance.fqdn)
+            self._touched_at[instance.fqdn] = time.monotonic()
+            self.version += 1
+
+    def remove(
+        self,
+        fqdn: str
+    ):
+        """Drop an instance from the snapshot"""
+        with self._lock:
+            instance = self._instances.pop(fqdn, None)
+            if instance is not None:
+                self._fqdn_by_vmid.pop(instance.id, None)
+
+            self._dirty.discard(fqdn)
+            self._touched_at[fqdn] = time.monotonic()
+            self.version += 1
+
+    def invalidate(
+        self,
+        fqdn: Optional[str] = None
+    ):
+        """Mark an instance as needing a re-read, or expire the whole snapshot if fqdn is None/unknown"""
+        with self._lock:
+            if fqdn is not None and fqdn in self._instances:
+                self._dirty.add(fqdn)
+                self._touched_at[fqdn] = time.monotonic()
+            else:
+                self._taken_at = None
+                self._expired_at = time.monotonic()
+
+            self.version += 1
+
+    def snapshot(
+        self,
+        max_age: float
+    ) -> Optional[Tuple[Dict[str, models.proxmox.Instance], Set[str]]]:
+        """Returns (instances by fqdn, dirty fqdns) if the snapshot is no older than max_age seconds, otherwise None"""
+        with self._lock:
+            if self.age() > max_age:
+                return None
+
+            return dict(self._instances), set(self._dirty)
+
+    def get_by_fqdn(
+        self,
+        fqdn: str
+    ) -> Optional[models.proxmox.Instance]:
+        return self._instances.get(fqdn)
+
+    def get_by_vmid(
+        self,
+        vmid: int
+    ) -> Optional[models.proxmox.Instance]:
+        with self._lock:
+            fqdn = self._fqdn_by_vmid.get(vmid)
+
+            if fqdn is None:
+                return None
+
+            return self._instances.get(fqdn)
+
+class DomainValidationCache:
+    """
+        Caches vhost validation results keyed by (domain, owner), each entry expiring after its own TTL
+    """
+
+    _lock: threading.Lock
+    _entries: cachetools.LRUCache
+
+    hits: int
+    misses: int
+
+    def __init__(self, maxsize: int):
+        self._lock = threading.Lock()
+        self._entries = cachetools.LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        key: Tuple[str, str]
+    ) -> Optional[Tuple[bool, Optional[List[str]]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                domain_validation_cache_lookups.labels("hit").inc()
+
+                valid, remarks = entry[1]
+                return (valid, list(remarks) if remarks is not None else None)
+
+            if entry is not None:
+                del self._entries[key]
+
+            self.misses += 1
+            domain_validation_cache_lookups.labels("miss").inc()
+            return None
+
+    def put(
+        self,
+        key: Tuple[str, str],
+        result: Tuple[bool, Optional[List[str]]],
+        ttl: float
+    ):
+        valid, remarks = result
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, (valid, list(remarks) if remarks is not None else None))
+
+    def invalidate(
+        self,
+        domain: Optional[str] = None
+    ):
+        """Forget cached results for a domain (for every owner), or everything if domain is None"""
+        with self._lock:
+            if domain is None:
+                self._entries.clear()
+                return
+
+            for key in list(self._entries.keys()):
+                if key[0] == domain:
+                    del self._entries[key]
+
+class VHostIndex:
+    """
+        Which instances (and their owners) claim each vhost domain, built from instance metadata
+
+        Like the inventory, a rebuild from a read that started at taken_at keeps changes made to
+        individual instances after that
+    """
+
+    _lock: threading.Lock
+    _claims: Dict[str, Dict[str, str]]
+    _domains_by_fqdn: Dict[str, Set[str]]
+    _changed_at: Dict[str, float]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claims = {}
+        self._domains_by_fqdn = {}
+        self._changed_at = {}
+
+    def _set(
+        self,
+        fqdn: str,
+        owner: Optional[str],
+        domains: Set[str]
+    ):
+        for domain in self._domains_by_fqdn.pop(fqdn, set()):
+            claimants = self._claims.get(domain, {})
+            claimants.pop(fqdn, None)
+            if len(claimants) == 0:
+                self._claims.pop(domain, None)
+
+        if owner is None:
+            return
+
+        for domain in domains:
+            self._claims.setdefault(domain, {})[fqdn] = owner
+
+        self._domains_by_fqdn[fqdn] = domains
+
+    def rebuild(
+        self,
+        instances: Dict[str, models.proxmox.Instance],
+        taken_at: float
+    ):
+        """Replace the index with the vhosts of instances read starting at taken_at"""
+        with self._lock:
+            kept = {
+                fqdn: (self._claims_owner(fqdn), self._domains_by_fqdn.get(fqdn, set()))
+                for fqdn, changed_at in self._changed_at.items() if changed_at >= taken_at
+            }
+
+            self._claims = {}
+            self._domains_by_fqdn = {}
+            self._changed_at = { fqdn: self._changed_at[fqdn] for fqdn in kept }
+
+            for fqdn, instance in instances.items():
+                if fqdn not in kept:
+                    self._set(fqdn, instance.metadata.owner, set(instance.metadata.network.vhosts.keys()))
+
+            for fqdn, (owner, domains) in kept.items():
+                self._set(fqdn, owner, domains)
+
+            for domain, claimants in self._claims.items():
+                if len(claimants) > 1:
+                    logger.info(f"warning, duplicate vhost claim: {domain} is claimed by {', '.join(sorted(claimants.keys()))}")
+
+    def _claims_owner(
+        self,
+        fqdn: str
+    ) -> Optional[str]:
+        for domain in self._domains_by_fqdn.get(fqdn, set()):
+            return self._claims[domain][fqdn]
+
+        return None
+
+    def set_instance(
+        self,
+        instance: models.proxmox.Instance
+    ):
+        """Update the vhosts claimed by a single instance"""
+        with self._lock:
+            self._set(instance.fqdn, instance.metadata.owner, set(instance.metadata.network.vhosts.keys()))
+            self._changed_at[instance.fqdn] = time.monotonic()
+
+    def remove_instance(
+        self,
+        fqdn: str
+    ):
+        """Drop every claim of a deleted instance"""
+        with self._lock:
+            self._set(fqdn, None, set())
+            self._changed_at[fqdn] = time.monotonic()
+
+    def claims(
+        self,
+        domain: str
+    ) -> Dict[str, str]:
+        """Owner by fqdn of every instance claiming domain"""
+        with self._lock:
+            return dict(self._claims.get(domain, {}))
+
+    def duplicates(self) -> Dict[str, Dict[str, str]]:
+        """Every domain claimed by more than one instance, with the owner by fqdn of each claimant"""
+        with self._lock:
+            return { domain: dict(claimants) for domain, claimants in self._claims.items() if len(claimants) > 1 }
+
+class TaskWaiter:
+    """
+        Waits for Proxmox tasks (identified by their UPID) to finish
+
+        Only one thread polls a given task, anyone else waiting on the same task waits for that thread
+        to see it finish. Polling backs off exponentially and keeps going until the latest deadline of
+        everyone waiting
+    """
+
+    class _Task:
+        def __init__(self):
+            self.done = threading.Event()
+            self.deadline = 0.0
+            self.status = None
+            self.error = None
+
+    def __init__(self, prox: ProxmoxAPI):
+        self._prox = prox
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, "TaskWaiter._Task"] = {}
+
+    def _poll(
+        self,
+        upid: str,
+        task: "TaskWaiter._Task"
+    ):
+        # UPID:$node:$pid:$pstart:$starttime:$type:$id:$user:
+        node = upid.split(":")[1]
+        interval = config.proxmox.tasks.poll_initial_interval
+
+        while True:
+            status = self._prox.nodes(f"{node}/tasks/{upid}/status").get()
+
+            if status.get("status") == "stopped":
+                task.status = status
+                return
+
+            with self._lock:
+                remaining = task.deadline - time.monotonic()
+
+            if remaining <= 0:
+                return
+
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, config.proxmox.tasks.poll_max_interval)
+
+    def wait(
+        self,
+        upid: str,
+        timeout: float
+    ) -> Optional[dict]:
+        """Wait for a task to stop, returns its final status (with exitstatus) or None if it's still running after timeout"""
+        with self._lock:
+            task = self._tasks.get(upid)
+            poller = task is None
+
+            if poller:
+                task = TaskWaiter._Task()
+                self._tasks[upid] = task
+
+            task.deadline = max(task.deadline, time.monotonic() + timeout)
+
+        if poller:
+            try:
+                self._poll(upid, task)
+            except Exception as e:
+                task.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._tasks[upid]
+                task.done.set()
+        else:
+            task.done.wait(timeout)
+
+            if task.error is not None:
+                raise task.error
+
+        return task.status
+
+class InstanceLocation(NamedTuple):
+    type: models.proxmox.Type
+    node: str
+    vmid: int
+
+class InstanceLocations:
+    """
+        Where each instance (by fqdn) was last seen in the cluster
+
+        Entries can go stale (migrations, deletions made outside the API) so whoever uses one
+        has to check the fqdn at that location still matches
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locations: Dict[str, InstanceLocation] = {}
+
+    def get(
+        self,
+        fqdn: str
+    ) -> Optional[InstanceLocation]:
+        return self._locations.get(fqdn)
+
+    def put(
+        self,
+        fqdn: str,
+        location: InstanceLocation
+    ):
+        with self._lock:
+            self._locations[fqdn] = location
+
+    def remove(
+        self,
+        fqdn: str
+    ):
+        with self._lock:
+            self._locations.pop(fqdn, None)
+
+    def replace(
+        self,
+        resources: List[dict]
+    ):
+        """Replace every location with those in a cluster/resources listing"""
+        locations = {}
+        for entry in resources:
+            if 'name' in entry and entry.get('type') in ('lxc', 'qemu'):
+                instance_type = models.proxmox.Type.LXC if entry['type'] == 'lxc' else models.proxmox.Type.VPS
+                locations[entry['name']] = InstanceLocation(instance_type, entry['node'], entry['vmid'])
+
+        with self._lock:
+            self._locations = locations
+
 class Proxmox():
     def __init__(self):
         if config.proxmox.cluster.api.password:
@@ -112,39 +735,205 @@ class Proxmox():
                 verify_ssl=False
             )
 
-    def _select_best_node(
+        # proxmoxer doesn't expose its requests session, it has no timeouts or retries and only pools 10 connections
+        self.prox._store["session"].mount("https://", utilities.http.TimedHTTPAdapter(
+            timeout=(config.proxmox.cluster.api.connect_timeout, config.proxmox.cluster.api.timeout),
+            on_pool_wait=api_pool_wait_seconds.observe,
+            pool_connections=1,
+            pool_maxsize=self._api_pool_size(),
+            pool_block=True,
+            max_retries=utilities.http.get_retries(config.proxmox.cluster.api.retries, config.proxmox.cluster.api.retry_backoff)
+        ))
+
+        # used by the async read paths (listings), shares one connection pool between every request
+        self.aprox = utilities.async_proxmox.AsyncProxmoxAPI(
+            host=config.proxmox.cluster.api.server,
+            user=config.proxmox.cluster.api.username,
+            port=config.proxmox.cluster.api.port,
+            password=config.proxmox.cluster.api.password if config.proxmox.cluster.api.password else None,
+            token_name=config.proxmox.cluster.api.token_name,
+            token_value=config.proxmox.cluster.api.token_value,
+            verify_ssl=False,
+            max_connections=config.proxmox.cluster.api.max_connections,
+            timeout=config.proxmox.cluster.api.timeout,
+            connect_timeout=config.proxmox.cluster.api.connect_timeout
+        )
+
+        # concurrent identical reads share one call to the cluster
+        self._flights = utilities.singleflight.SingleFlight(self._count_coalesced)
+        self._async_flights = utilities.singleflight.AsyncSingleFlight(self._count_coalesced)
+
+        self.inventory = InstanceInventory()
+        self.locations = InstanceLocations()
+        self.tasks = TaskWaiter(self.prox)
+        self._domain_validations = DomainValidationCache(config.proxmox.network.dns.cache_size)
+        self._dns_fanout = utilities.fanout.FanOut(config.proxmox.network.dns.max_concurrent_lookups, "dns")
+
+        self._resolver = dns.resolver.Resolver(configure=config.proxmox.network.dns.nameservers is None)
+        if config.proxmox.network.dns.nameservers is not None:
+            self._resolver.nameservers = config.proxmox.network.dns.nameservers
+            self._resolver.port = config.proxmox.network.dns.port
+        self._resolver.lifetime = config.proxmox.network.dns.lookup_timeout
+        self._read_fanout = utilities.fanout.FanOut(config.proxmox.cluster.api.max_concurrent_reads, "proxmox-read")
+
+        self._traefik_lock = threading.Lock()
+        self._traefik_fragments = {}
+        self._traefik_serialized = None
+
+        # what other worker processes are in the middle of handing out, see _get_reservations
+        self._reservations_lock = threading.Lock()
+        self._reservations = None
+
+        self._ip_index_lock = threading.Lock()
+        self._ip_index = None
+
+        self._port_index_lock = threading.Lock()
+        self._port_index = None
+
+        self._vhost_index_lock = threading.Lock()
+        self._vhost_index = None
+
+        # template catalogue, (monotonic time read, templates by hostname) by type
+        self._templates_lock = threading.Lock()
+        self._templates: Dict[models.proxmox.Type, Tuple[float, Dict[str, models.proxmox.Template]]] = {}
+
+        self._slots_lock = threading.Lock()
+        self._clone_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._migration_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._provisioning_fanout = utilities.fanout.FanOut(config.proxmox.provisioning.bulk_parallelism, "provision")
+
+    def plan_placement(
         self,
         specs: models.proxmox.Specs
-    ) -> Optional[str]:
-        """Finds a good node based off specs given"""
+    ) -> models.proxmox.Placement:
+        """
+        Score every node for an instance with the given specs using the configured scheduler strategy
+
+        Counts instances that are still being created (by any worker process) against the node they're headed to
+        """
+        nodes, storages, instances_by_node = self._read_placement_inputs()
+        pending = self._pending_placements(self._get_reservations().held("placement"))
+
+        return self._plan_placement(specs, nodes, storages, instances_by_node, pending)
+
+    def _read_placement_inputs(
+        self
+    ) -> Tuple[List[dict], Dict[str, dict], Dict[str, int]]:
+        """
+        Reads what placement is based on from the cluster
+
+        Returns (nodes, the instance storage's cluster/resources entry by node, number of instances by node)
+        """
         nodes = self.prox.nodes.get()
 
-        if len(nodes) == 0:
-            return None
-        
-        choice = nodes[0]["node"]
+        # instances' disks go on the instance storage, not the node's root filesystem nodes.get() reports
+        storages = {}
+        for entry in self.prox.cluster.resources.get(type="storage"):
+            if entry.get('storage') == config.proxmox.instance_dir_pool and entry.get('status', 'available') == 'available':
+                storages[entry['node']] = entry
+
+        instances_by_node = {}
+        for fqdn, instance in self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age).items():
+            instances_by_node[instance.node] = instances_by_node.get(instance.node, 0) + 1
 
-        scoreboard = {}
+        return nodes, storages, instances_by_node
+
+    def _pending_placements(
+        self,
+        held: Dict[str, Optional[str]]
+    ) -> List[Tuple[str, models.proxmox.Specs]]:
+        """(node name, specs) of every instance still being created from the placements held in the reservations"""
+        pending = []
+        for value in held.values():
+            placement = json.loads(value)
+            pending.append((placement["node"], models.proxmox.Specs.parse_obj(placement["specs"])))
+
+        return pending
+
+    def _plan_placement(
+        self,
+        specs: models.proxmox.Specs,
+        nodes: List[dict],
+        storages: Dict[str, dict],
+        instances_by_node: Dict[str, int],
+        pending: List[Tuple[str, models.proxmox.Specs]]
+    ) -> models.proxmox.Placement:
+        pending_by_node = {}
+        for node_name, pending_specs in pending:
+            pending_by_node.setdefault(node_name, []).append(pending_specs)
+
+        states = []
         for node in nodes:
-            node_name = node['node']
-            
-            if node_name not in scoreboard:
-                scoreboard[node_name] = 0
+            if node['node'] in config.proxmox.blacklisted_nodes or node.get('status', 'online') != 'online':
+                continue
+
+            states.append(utilities.scheduler.NodeState(
+                name=node['node'],
+                mem=node['mem'],
+                maxmem=node['maxmem'],
+                disk=storages.get(node['node'], {}).get('disk', 0),
+                maxdisk=storages.get(node['node'], {}).get('maxdisk', 0),
+                cpu=node.get('cpu', 0),
+                maxcpu=node['maxcpu'],
+                instances=instances_by_node.get(node['node'], 0),
+                pending=pending_by_node.get(node['node'], [])
+            ))
+
+        return utilities.scheduler.place(
+            config.proxmox.scheduler.strategy,
+            states,
+            specs,
+            utilities.scheduler.Weights(**config.proxmox.scheduler.weights.dict()),
+            utilities.scheduler.Limits(
+                max_memory_ratio=config.proxmox.scheduler.max_memory_ratio,
+                max_disk_ratio=config.proxmox.scheduler.max_disk_ratio
+            )
+        )
 
-            if (node['maxmem'] - node['mem']) > (specs.memory*1000000):
-                scoreboard[node_name] += 1
+    def _select_best_node(
+        self,
+        specs: models.proxmox.Specs
+    ) -> str:
+        """Finds a good node based off specs given"""
+        node_name = self.plan_placement(specs).node
 
-            if (node['mem']/node['maxmem']) < 0.6:
-                scoreboard[node_name] += 1
-            
-            if (node['maxcpu'] >= specs.cores):
-                scoreboard[node_name] += 1
+        if node_name is None:
+            raise exceptions.resource.Unavailable("No node has enough capacity for the instance")
+
+        return node_name
+
+    def _reserve_node(
+        self,
+        specs: models.proxmox.Specs
+    ) -> Tuple[str, str]:
+        """
+        Pick a node for a new instance and count specs against it until released, returns (node name, placement id)
+
+        Placements are held in the reservations shared with the other worker processes, so creations running in any
+        of them count against the node they're headed to
+        """
+
+        # the cluster is read first, only choosing the node and recording it need to happen together
+        nodes, storages, instances_by_node = self._read_placement_inputs()
+
+        def choose(held: Dict[str, Optional[str]]) -> str:
+            node_name = self._plan_placement(specs, nodes, storages, instances_by_node, self._pending_placements(held)).node
+
+            if node_name is None:
+                raise exceptions.resource.Unavailable("No node has enough capacity for the instance")
+
+            return json.dumps({ "node": node_name, "specs": specs.dict() })
 
-            if node_name in config.proxmox.blacklisted_nodes:
-                del scoreboard[node_name]
+        placement = str(uuid.uuid4())
+        value = self._get_reservations().reserve_with("placement", placement, config.proxmox.provisioning.reservation_ttl, choose)
 
-        # return the node with the highest score
-        return sorted(scoreboard, key=scoreboard.get, reverse=True)[0]
+        return json.loads(value)["node"], placement
+
+    def _release_node(
+        self,
+        placement: str
+    ):
+        self._get_reservations().release("placement", placement)
 
     def _get_instance_type_base_fqdn(
         self,
@@ -177,80 +966,312 @@ class Proxmox():
 
         return self._get_instance_fqdn_for_username(instance_type, account.username, hostname)
 
+    def _api_pool_size(self) -> int:
+        """Connections to pool to the API, by default one for every thread that may be using it at once"""
+        if config.proxmox.cluster.api.pool_size is not None:
+            return config.proxmox.cluster.api.pool_size
+
+        # request handlers run on the default executor, whose size this matches
+        request_threads = min(32, (os.cpu_count() or 1) + 4)
+
+        return (
+            request_threads +
+            config.proxmox.cluster.api.max_concurrent_reads +
+            config.proxmox.provisioning.bulk_parallelism +
+            config.jobs.workers
+        )
+
+    def _count_coalesced(
+        self,
+        key: Union[str, tuple]
+    ):
+        coalesced_reads.labels(key if isinstance(key, str) else key[0]).inc()
+
+    def _read_cluster_resources(
+        self,
+        fresh: bool = False
+    ) -> List[dict]:
+        """
+        cluster/resources entries of every vm/container (and template), shared by concurrent callers
+
+        A shared listing may have been requested before the caller's own last change, callers that need to see
+        that change (i.e a clone that just finished) ask for a fresh listing of their own
+        """
+        if fresh:
+            return self.prox.cluster.resources.get(type="vm")
+
+        return self._flights.do("cluster/resources", lambda: self.prox.cluster.resources.get(type="vm"))
+
+    async def _read_cluster_resources_async(self) -> List[dict]:
+        return await self._async_flights.do("cluster/resources", lambda: self.aprox.cluster.resources.get(type="vm"))
+
+    def _fan_out_reads(
+        self,
+        kind: str,
+        read: Callable[[dict], object],
+        entries: List[dict],
+        ignore_errors: bool
+    ) -> List[utilities.fanout.Result]:
+        """Read many VMs from cluster resource entries concurrently, recording how long each one took"""
+
+        start = time.monotonic()
+        results = self._read_fanout.map(read, entries, ignore_errors=ignore_errors)
+
+        for result in results:
+            vm_read_seconds.labels(kind).observe(result.seconds)
+
+        if len(results) > 0:
+            slowest = max(results, key=lambda result: result.seconds)
+            logger.debug(
+                f"read {len(results)} {kind}s",
+                seconds=time.monotonic() - start,
+                slowest=slowest.item.get('name'),
+                slowest_seconds=slowest.seconds
+            )
+
+        return results
+
+    async def _fan_out_reads_async(
+        self,
+        kind: str,
+        read: Callable[[dict], Awaitable[object]],
+        entries: List[dict],
+        ignore_errors: bool
+    ) -> List[utilities.fanout.Result]:
+        """Async version of _fan_out_reads, reads run concurrently on the event loop instead of the thread pool"""
+
+        start = time.monotonic()
+        limit = asyncio.Semaphore(config.proxmox.cluster.api.max_concurrent_reads)
+
+        async def timed(entry: dict) -> utilities.fanout.Result:
+            async with limit:
+                read_start = time.monotonic()
+                try:
+                    return utilities.fanout.Result(entry, await read(entry), None, time.monotonic() - read_start)
+                except Exception as e:
+                    return utilities.fanout.Result(entry, None, e, time.monotonic() - read_start)
+
+        results = await asyncio.gather(*[timed(entry) for entry in entries])
+
+        for result in results:
+            if result.error is not None and ignore_errors == False:
+                raise result.error
+
+            vm_read_seconds.labels(kind).observe(result.seconds)
+
+        if len(results) > 0:
+            slowest = max(results, key=lambda result: result.seconds)
+            logger.debug(
+                f"read {len(results)} {kind}s",
+                seconds=time.monotonic() - start,
+                slowest=slowest.item.get('name'),
+                slowest_seconds=slowest.seconds
+            )
+
+        return list(results)
+
+    def _get_reservations(self) -> utilities.reservations.Reservations:
+        """Reservations shared with the other API worker processes, kept in the jobs database"""
+        with self._reservations_lock:
+            if self._reservations is None:
+                self._reservations = utilities.reservations.Reservations(config.jobs.database_url)
+
+            return self._reservations
+
+    def _refresh_indexes(self):
+        """
+        Make sure the IP/port indexes are no older than the inventory's max_age
+
+        Whatever another process hands out stays reserved for max_age after it's in use (see _settle), so an index
+        this fresh has either seen it in the cluster or can't get it from the reservations
+        """
+        if self.inventory.age() > config.proxmox.inventory.max_age:
+            self.refresh_inventory()
+
+    def _settle(
+        self,
+        kind: str,
+        key: str
+    ):
+        """Keep something we handed out (and is now in use) reserved until every process' indexes have seen it"""
+        self._get_reservations().renew(kind, key, config.proxmox.inventory.max_age)
+
+    def _ip_to_index(
+        self,
+        ip: ipaddress.IPv4Address
+    ) -> int:
+        return int(ip) - int(config.proxmox.network.range[0])
+
+    def _index_to_ip(
+        self,
+        index: int
+    ) -> ipaddress.IPv4Address:
+        return config.proxmox.network.range[0] + index
+
+    def _used_ip_indexes(
+        self,
+        instances: Dict[str, models.proxmox.Instance]
+    ) -> List[int]:
+        return [
+            self._ip_to_index(address.ip)
+            for instance in instances.values()
+            for address in instance.metadata.network.nic_allocation.addresses
+        ]
+
+    def _get_ip_index(self) -> utilities.allocator.BitmapAllocator:
+        """Get the IP allocation index over the configured network range, building it from the inventory the first time"""
+        with self._ip_index_lock:
+            if self._ip_index is None:
+                network = config.proxmox.network.network.network
+                gateway = config.proxmox.network.network.ip + 1
+                size = int(config.proxmox.network.range[1]) - int(config.proxmox.network.range[0]) + 1
+
+                # network/broadcast address, the gateway and anything outside the network can never be handed out
+                blocked = []
+                for index in range(size):
+                    ip = self._index_to_ip(index)
+                    if ip not in network or ip in (network.network_address, network.broadcast_address, gateway):
+                        blocked.append(index)
+
+                # each process starts handing out IPs somewhere else, so they rarely go after the same one
+                ip_index = utilities.allocator.BitmapAllocator(size, blocked, start=random.randrange(size))
+
+                taken_at = time.monotonic()
+                instances = self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age)
+                ip_index.reset(self._used_ip_indexes(instances), taken_at)
+
+                self._ip_index = ip_index
+
+            return self._ip_index
+
     def _allocate_nic(
         self
     ) -> models.proxmox.NICAllocation:
-        """Examine all other instances and find a new IP and NIC stuff like mac address"""
-        # world's most ghetto ip allocation algorithm
+        """
+        Reserve a new IP and generate NIC stuff like mac address
+
+        The IP stays reserved until _commit_nic or _release_nic is called with the allocation
+        """
         network = config.proxmox.network.network.network
-        base_ip = config.proxmox.network.network.ip
-        gateway = base_ip + 1
-
-        # returns set with network and broadcast address removed
-        ips = set(network.hosts())
-
-        # list of possible ips an instance can have
-        allowed_ips = functools.reduce(
-            lambda x,y: x+y,
-            map(
-                list,
-                [ipaddr for ipaddr in ipaddress.summarize_address_range(
-                    config.proxmox.network.range[0],
-                    config.proxmox.network.range[1]
-                )]
-            ), []
+        gateway = config.proxmox.network.network.ip + 1
+
+        self._refresh_indexes()
+        ip_index = self._get_ip_index()
+
+        while True:
+            index = ip_index.reserve_any()
+            if index is None:
+                raise exceptions.resource.Unavailable("Could not allocate an IP for the instance. No IPs available")
+
+            # other worker processes hand out IPs from their own index, the shared reservation decides who gets it
+            if self._get_reservations().reserve("ip", str(self._index_to_ip(index)), config.proxmox.provisioning.reservation_ttl):
+                break
+
+            # another process has it, count it as used until an inventory refresh says otherwise
+            ip_index.commit(index)
+
+        return models.proxmox.NICAllocation(
+            addresses=[
+                ipaddress.IPv4Interface(f"{self._index_to_ip(index)}/{network.prefixlen}")
+            ],
+            gateway4=gateway,
+            macaddress="02:00:00:%02x:%02x:%02x" % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)),
+            vlan=config.proxmox.network.vlan
         )
 
-        ips = ips.intersection(allowed_ips)
-
-        if gateway in ips:
-            ips.remove(gateway)
-
-        # remove any addresses assigned to any of the other instances
-        for fqdn, instance in self.read_all_instances(ignore_errors=True).items():
-            for address in instance.metadata.network.nic_allocation.addresses:
-                if address.ip in ips:
-                    ips.remove(address.ip)
-    
-        if len(ips) > 0:
-            ip_addr = random.sample(list(ips),1)[0]
-
-            return models.proxmox.NICAllocation(
-                addresses=[
-                    ipaddress.IPv4Interface(f"{ip_addr}/{network.prefixlen}")
-                ],
-                gateway4=gateway,
-                macaddress="02:00:00:%02x:%02x:%02x" % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)),
-                vlan=config.proxmox.network.vlan
-            )
-        else:
-            raise exception.resource.Unavailable("Could not allocate an IP for the instance. No IPs available")
+    def _commit_nic(
+        self,
+        nic_allocation: models.proxmox.NICAllocation
+    ):
+        """Mark the IPs of an allocation as in use by an instance that now exists"""
+        for address in nic_allocation.addresses:
+            self._get_ip_index().commit(self._ip_to_index(address.ip))
+            self._settle("ip", str(address.ip))
+
+    def _release_nic(
+        self,
+        nic_allocation: models.proxmox.NICAllocation
+    ):
+        """Give the IPs of an allocation back, either the instance was never created or it has been deleted"""
+        for address in nic_allocation.addresses:
+            self._get_ip_index().release(self._ip_to_index(address.ip))
+            self._get_reservations().release("ip", str(address.ip))
 
     def _serialize_metadata(
         self,
         metadata: models.proxmox.Metadata
     ):
         """Turns metadata into readable yaml so it looks pretty in the Proxmox web ui"""
-        # https://github.com/samuelcolvin/pydantic/issues/1043
-        return yaml.safe_dump(
-            yaml.safe_load(metadata.json()),
-            default_flow_style=False,
-            explicit_start=None,
-            default_style='', width=8192
-        )
+        return metadata.to_description()
+
+    def _is_config_conflict(
+        self,
+        e: Exception
+    ) -> bool:
+        """Whether a config PUT failed because the digest we sent no longer matches"""
+        return "detected modified configuration" in str(e)
 
     def write_out_instance_metadata(
         self,
-        instance: models.proxmox.Instance
+        instance: models.proxmox.Instance,
+        mutate: Optional[Callable[[models.proxmox.Metadata], None]] = None,
+        attempts: int = 3
     ):
-        """Write metadata to the instances description in Proxmox"""
+        """
+        Write metadata to the instances description in Proxmox, changing it with mutate first if given
 
-        yaml_description = self._serialize_metadata(instance.metadata)
-        
-        if instance.type == models.proxmox.Type.LXC:
-            self.prox.nodes(f"{instance.node}/lxc/{instance.id}/config").put(description=yaml_description)
-        elif instance.type == models.proxmox.Type.VPS:
-            self.prox.nodes(f"{instance.node}/qemu/{instance.id}/config").put(description=yaml_description)
+        Nothing is written if the description is unchanged. The write only goes through if the instance's config
+        hasn't changed since it was read, otherwise it's read again and mutate is reapplied to the fresh metadata
+        """
+
+        for attempt in range(attempts):
+            if mutate is not None:
+                mutate(instance.metadata)
+
+            yaml_description = self._serialize_metadata(instance.metadata)
+
+            if yaml_description == instance._description:
+                return
+
+            params = { "description": yaml_description }
+            if instance._digest is not None:
+                params["digest"] = instance._digest
+
+            try:
+                if instance.type == models.proxmox.Type.LXC:
+                    self.prox.nodes(f"{instance.node}/lxc/{instance.id}/config").put(**params)
+                elif instance.type == models.proxmox.Type.VPS:
+                    self.prox.nodes(f"{instance.node}/qemu/{instance.id}/config").put(**params)
+                break
+            except Exception as e:
+                if not self._is_config_conflict(e):
+                    raise
+
+                if mutate is None or attempt == attempts - 1:
+                    raise exceptions.resource.Unavailable(
+                        "The instance was changed by someone else at the same time, please try again"
+                    )
+
+                logger.info("instance config changed since it was read, retrying", fqdn=instance.fqdn, attempt=attempt + 1)
+
+                fresh = self._read_instance_on_node(
+                    instance.type,
+                    instance.node,
+                    instance.id,
+                    expected_fqdn=instance.fqdn,
+                    validate_vhosts=False
+                )
+                instance.metadata = fresh.metadata
+                instance._digest = fresh._digest
+                instance._description = fresh._description
+
+        # the new digest isn't known without reading the config again, so later writes of this instance aren't conditional
+        instance._digest = None
+        instance._description = yaml_description
+
+        self.inventory.invalidate(instance.fqdn)
+        if self._vhost_index is not None:
+            self._vhost_index.set_instance(instance)
 
     def _hash_fqdn(
         self,
@@ -268,12 +1289,20 @@ class Proxmox():
         instance_type: models.proxmox.Type,
         account: models.account.Account,
         hostname: str,
-        request_detail: models.proxmox.InstanceRequestDetail
+        request_detail: models.proxmox.InstanceRequestDetail,
+        on_progress: Optional[Callable[[str], None]] = None
     ):
-        """Create an instance of type associated with a user account with hostname and requested detail like template"""
+        """
+        Create an instance of type associated with a user account with hostname and requested detail like template
+
+        on_progress is called with a short description of each stage as the creation gets to it
+        """
+
+        if on_progress is None:
+            on_progress = lambda stage: None
 
         # get template data
-        template = self.read_template(instance_type, request_detail.template_id)
+        template = self.read_template(instance_type, request_detail.template_id, verify=True)
 
         # see if instance with this hostname already exists
         try: 
@@ -301,6 +1330,8 @@ class Proxmox():
             https=False
         )
 
+        nic_allocation = self._allocate_nic()
+
         # set metadata for the proxmox description
         metadata = models.proxmox.Metadata(
             owner=account.username,
@@ -310,69 +1341,158 @@ class Proxmox():
                 marked_active_at=datetime.date.today()
             ),
             network=models.proxmox.Network(
-                nic_allocation=self._allocate_nic(),
+                nic_allocation=nic_allocation,
                 vhosts=vhosts
             ),
             root_user=root_user,
             wake_on_request=template.metadata.wake_on_request
         )
 
-        # get hash for the vm id
-        hash_id = self._hash_fqdn(fqdn)
+        try:
+            # get hash for the vm id
+            hash_id = self._hash_fqdn(fqdn)
+
+            if instance_type == models.proxmox.Type.LXC:
+                metadata.groups = set(["netsoc_cloud_container", "netsoc_cloud_instance"])
+            elif instance_type == models.proxmox.Type.VPS:
+                metadata.groups = set(["netsoc_cloud_vps", "netsoc_cloud_instance"])
+
+
+            yaml_description = self._serialize_metadata(metadata)
+
+            # pick a node for the instance based off the required specs,
+            # it counts against that node's capacity until we're finished with it
+            target_node_name, placement = self._reserve_node(template.specs)
+
+            try:
+                # we need to clone the template to the node its stored on and then migrate it to the target node
+                # (this lets us use templates without shared storage)
+                on_progress("cloning")
+                instance = self._clone_template(template, fqdn, hash_id, yaml_description)
+
+                if instance.node != target_node_name:
+                    on_progress("migrating")
+                    self._migrate_instance(instance, target_node_name)
+
+                instance = self._read_instance_by_fqdn(instance_type, fqdn, fresh=True)
+                self.inventory.put(instance)
+                if self._vhost_index is not None:
+                    self._vhost_index.set_instance(instance)
+            finally:
+                self._release_node(placement)
+        except Exception:
+            # the instance may still have been cloned, only give the IP back if it doesn't exist
+            try:
+                self._read_instance_by_fqdn(instance_type, fqdn, fresh=True)
+                self._commit_nic(nic_allocation)
+            except exceptions.resource.NotFound:
+                self._release_nic(nic_allocation)
+            except Exception:
+                # can't tell, keep the IP out of circulation until the next inventory refresh sorts it out
+                self._commit_nic(nic_allocation)
+            raise
+
+        self._commit_nic(nic_allocation)
+        on_progress("created")
+
+    def _node_semaphore(
+        self,
+        semaphores: Dict[str, threading.BoundedSemaphore],
+        node_name: str,
+        limit: int
+    ) -> threading.BoundedSemaphore:
+        with self._slots_lock:
+            return semaphores.setdefault(node_name, threading.BoundedSemaphore(limit))
+
+    def _clone_template(
+        self,
+        template: models.proxmox.Template,
+        fqdn: str,
+        hash_id: int,
+        yaml_description: str
+    ) -> models.proxmox.Instance:
+        """Clone a template into a new instance on the template's node, limited to a few clones per node at once"""
+
+        with self._node_semaphore(self._clone_slots, template.node, config.proxmox.provisioning.max_concurrent_clones_per_node):
+            if template.type == models.proxmox.Type.LXC:
+                upid = self.prox.nodes(f"{template.node}/lxc/{template.id}/clone").post(**{
+                    "hostname": fqdn,
+                    "newid": hash_id,
+                    "description": yaml_description,
+                    "storage": config.proxmox.instance_dir_pool,
+                    "pool": "netsoc_cloud",
+                    "full": 1
+                })
+            elif template.type == models.proxmox.Type.VPS:
+                upid = self.prox.nodes(f"{template.node}/qemu/{template.id}/clone").post(**{
+                    "name": fqdn,
+                    "newid": hash_id,
+                    "description": yaml_description,
+                    "storage": config.proxmox.instance_dir_pool,
+                    "pool": "netsoc_cloud",
+                    "full": 1
+                })
+
+            self._wait_for_task(upid, "created")
+
+        return self._read_instance_by_fqdn(template.type, fqdn, fresh=True)
+
+    def _migrate_instance(
+        self,
+        instance: models.proxmox.Instance,
+        target_node_name: str
+    ):
+        """Migrate an instance to another node, limited to a few migrations into each node at once"""
+
+        with self._node_semaphore(self._migration_slots, target_node_name, config.proxmox.provisioning.max_concurrent_migrations_per_node):
+            if instance.type == models.proxmox.Type.LXC:
+                upid = self.prox.nodes(f"{instance.node}/lxc/{instance.id}/migrate").post(**{
+                    "target": target_node_name,
+                    "restart": 1
+                })
+            elif instance.type == models.proxmox.Type.VPS:
+                upid = self.prox.nodes(f"{instance.node}/qemu/{instance.id}/migrate").post(**{
+                    "target": target_node_name
+                })
 
-        if instance_type == models.proxmox.Type.LXC:
-            metadata.groups = set(["netsoc_cloud_container", "netsoc_cloud_instance"])
-        elif instance_type == models.proxmox.Type.VPS:
-            metadata.groups = set(["netsoc_cloud_vps", "netsoc_cloud_instance"])
+            self._wait_for_task(upid, "migrated")
 
-            
-        yaml_description = self._serialize_metadata(metadata)
+        self.locations.put(instance.fqdn, InstanceLocation(instance.type, target_node_name, instance.id))
 
-        # pick a node for the instance based off the required specs
-        target_node_name = self._select_best_node(template.specs)
+    def create_instances(
+        self,
+        creations: List[Tuple[models.proxmox.Type, models.account.Account, str, models.proxmox.InstanceRequestDetail]],
+        on_progress: Optional[Callable[[int, str], None]] = None
+    ) -> List[Optional[Exception]]:
+        """
+        Create many instances from (type, account, hostname, request detail) tuples at once
 
-        # we need to clone the template to the node its stored on and then migrate it to the target node
-        # (this lets us use templates without shared storage)
+        Clones and migrations of different instances overlap, limited per node, on_progress is called with
+        (index of the creation, stage) as each instance moves along
 
-        if instance_type == models.proxmox.Type.LXC:
-            self.prox.nodes(f"{template.node}/lxc/{template.id}/clone").post(**{
-                "hostname": fqdn,
-                "newid": hash_id,
-                "description": yaml_description,
-                "storage": config.proxmox.instance_dir_pool,
-                "pool": "netsoc_cloud",
-                "full": 1
-            })
+        Returns the exception each creation failed with, or None if it succeeded
+        """
 
-            self._wait_for_instance_created(instance_type, fqdn)
-            instance = self._read_instance_by_fqdn(instance_type, fqdn)
+        if on_progress is None:
+            on_progress = lambda index, stage: None
 
-            if instance.node != target_node_name:
-                self.prox.nodes(f"{instance.node}/lxc/{instance.id}/migrate").post(**{
-                    "target": target_node_name,
-                    "restart": 1
-                })
+        fqdns = [self._get_instance_fqdn_for_account(instance_type, account, hostname) for instance_type, account, hostname, _ in creations]
+        duplicates = sorted(set(fqdn for fqdn in fqdns if fqdns.count(fqdn) > 1))
+        if len(duplicates) > 0:
+            raise exceptions.resource.AlreadyExists(f"Instances requested more than once: {', '.join(duplicates)}")
 
-        elif instance_type == models.proxmox.Type.VPS:
-            self.prox.nodes(f"{template.node}/qemu/{template.id}/clone").post(**{
-                "name": fqdn,
-                "newid": hash_id,
-                "description": yaml_description,
-                "storage": config.proxmox.instance_dir_pool,
-                "pool": "netsoc_cloud",
-                "full": 1
-            })
+        def create(index: int):
+            instance_type, account, hostname, request_detail = creations[index]
 
-            self._wait_for_instance_created(instance_type, fqdn)
-            instance = self._read_instance_by_fqdn(instance_type, fqdn)
+            try:
+                self.create_instance(instance_type, account, hostname, request_detail, lambda stage: on_progress(index, stage))
+            except Exception as e:
+                on_progress(index, f"failed: {e}")
+                raise
 
-            if instance.node != target_node_name:
-                self.prox.nodes(f"{instance.node}/qemu/{instance.id}/migrate").post(**{
-                    "target": target_node_name
-                })
+        results = self._provisioning_fanout.map(create, range(len(creations)))
 
-        self._wait_for_instance_migrated(instance.type, instance.fqdn, target_node_name)
-        
+        return [result.error for result in results]
 
     def delete_instance(
         self,
@@ -396,101 +1516,58 @@ class Proxmox():
 
             self.prox.nodes(instance.node).qemu(f"{instance.id}").delete()
 
+        self.inventory.remove(instance.fqdn)
+        self.locations.remove(instance.fqdn)
+        self._release_nic(instance.metadata.network.nic_allocation)
+        if self._vhost_index is not None:
+            self._vhost_index.remove_instance(instance.fqdn)
+
+        for external_port in instance.metadata.network.ports:
+            index = self._port_to_index(external_port)
+            if index is not None:
+                self._get_port_index().release(index)
+                self._get_reservations().release("port", str(external_port))
+
     def _wait_vmid_lock(
         self,
         instance_type: models.proxmox.Type,
         node_name: str,
         vm_id: int,
-        timeout: int = 25,
-        poll_interval: int = 1
+        timeout: int = 25
     ):
         """Waits for Proxmox to unlock the VM, it typically locks it when it's resizing a disk/creating a vm/etc..."""
-        start = time.time()
-        while True:
+
+        def unlocked() -> bool:
             if instance_type == models.proxmox.Type.LXC:
                 res = self.prox.nodes(node_name).lxc(f"{vm_id}/config").get()
             elif instance_type == models.proxmox.Type.VPS:
                 res = self.prox.nodes(node_name).qemu(f"{vm_id}/config").get()
 
+            return 'lock' not in res
 
-            if 'lock' not in res: 
-                break
-
-            now = time.time()
-            if (now-start) > timeout:
-                raise exceptions.resource.Unavailable("Timeout occured waiting for instance to unlock.")
-
-            time.sleep(poll_interval)
-
-    def _wait_for_instance_created(
-        self,
-        instance_type: models.proxmox.Type,
-        fqdn: str,
-        timeout: int = 300,
-        poll_interval: int = 1
-    ):
-        """Wait for an instance of the specified name to appear in the Proxmox cluster"""
-
-        start = time.time()
-        while True:
-            now = time.time()
-
-            lxcs_qemus = self.prox.cluster.resources.get(type="vm")
-
-            for entry in lxcs_qemus:
-                if 'name' in entry and entry['name'] == fqdn:
-                    if instance_type == models.proxmox.Type.LXC:
-                        config = self.prox.nodes(f"{entry['node']}/lxc/{entry['vmid']}/config").get()
-
-                        # logger.info(config)
-                        if 'lock' not in config and 'hostname' in config and config['hostname'] == fqdn:
-                            return
-
-                    elif instance_type == models.proxmox.Type.VPS:
-                        config = self.prox.nodes(f"{entry['node']}/qemu/{entry['vmid']}/config").get()
-
-                        if 'name' in config and config['name'] == fqdn and 'lock' not in config:
-                            return
+        if not utilities.backoff.poll(unlocked, timeout, config.proxmox.tasks.poll_initial_interval, config.proxmox.tasks.poll_max_interval):
+            raise exceptions.resource.Unavailable("Timeout occured waiting for instance to unlock.")
 
-            if (now-start) > timeout:
-                raise exceptions.resource.Unavailable(f"Timeout occured waiting for instance to created")
-
-            time.sleep(poll_interval)
-
-    def _wait_for_instance_migrated(
+    def _wait_for_task(
         self,
-        instance_type: models.proxmox.Type,
-        fqdn: str,
-        target_node: str,
-        timeout: int = 300,
-        poll_interval: int = 1
+        upid: str,
+        description: str,
+        timeout: Optional[int] = None
     ):
-        """Wait for an instance of the specified name to be migrated in the Proxmox cluster"""
-
-        start = time.time()
-        while True:
-            now = time.time()
-
-            lxcs_qemus = self.prox.cluster.resources.get(type="vm")
-
-            for entry in lxcs_qemus:
-                if 'name' in entry and entry['name'] == fqdn and entry['node'] == target_node: 
-                    if instance_type == models.proxmox.Type.LXC:
-                        config = self.prox.nodes(f"{entry['node']}/lxc/{entry['vmid']}/config").get()
-
-                        if 'lock' not in config and 'hostname' in config and config['hostname'] == fqdn:
-                            return
+        """Wait for a Proxmox task to finish, exception if it fails or doesn't finish in time"""
 
-                    elif instance_type == models.proxmox.Type.VPS:
-                        config = self.prox.nodes(f"{entry['node']}/qemu/{entry['vmid']}/config").get()
+        if timeout is None:
+            timeout = config.proxmox.tasks.timeout
 
-                        if 'name' in config and config['name'] == fqdn and 'lock' not in config:
-                            return
+        status = self.tasks.wait(upid, timeout)
 
-            if (now-start) > timeout:
-                raise exceptions.resource.Unavailable(f"Timeout occured waiting for instance to be migrated")
+        if status is None:
+            raise exceptions.resource.Unavailable(f"Timeout occured waiting for instance to be {description}")
 
-            time.sleep(poll_interval)
+        # anything other than OK/WARNINGS: n is the error message of the failed task
+        exitstatus = status.get("exitstatus", "")
+        if exitstatus != "OK" and not exitstatus.startswith("WARNINGS"):
+            raise exceptions.resource.Unavailable(f"Instance could not be {description}: {exitstatus}")
 
     def _get_template_base_fqdn(
         self
@@ -528,7 +1605,6 @@ class Proxmox():
             except Exception as e:
                 raise exceptions.resource.NotFound("The template does not exist")
 
-            logger.info(lxc_config)
             if not 'template' in lxc_config or lxc_config['template'] != 1:
                 raise exceptions.resource.NotFound("The specified VMID is not a template")
 
@@ -539,8 +1615,8 @@ class Proxmox():
 
             # decode description
             try:
-                metadata = models.proxmox.TemplateMetadata.parse_obj(
-                    yaml.safe_load(lxc_config['description'])
+                metadata = models.proxmox.TemplateMetadata.from_description(
+                    lxc_config['description']
                 )
             except Exception as e:
                 raise exceptions.resource.Unavailable(
@@ -572,6 +1648,7 @@ class Proxmox():
                 metadata=metadata,
                 specs=specs
             )
+            template._digest = lxc_config.get('digest')
 
             return template
         elif instance_type == models.proxmox.Type.VPS:
@@ -590,8 +1667,8 @@ class Proxmox():
             
             # decode description
             try:
-                metadata = models.proxmox.TemplateMetadata.parse_obj(
-                    yaml.safe_load(vm_config['description'])
+                metadata = models.proxmox.TemplateMetadata.from_description(
+                    vm_config['description']
                 )
             except Exception as e:
                 raise exceptions.resource.Unavailable(
@@ -622,6 +1699,7 @@ class Proxmox():
                 metadata=metadata,
                 specs=specs
             )
+            template._digest = vm_config.get('digest')
 
             return template
 
@@ -632,7 +1710,7 @@ class Proxmox():
         instance_type: models.proxmox.Type,
         fqdn: str
     ) -> models.proxmox.Template:
-        lxcs_qemus = self.prox.cluster.resources.get(type="vm") # also gets containers :shrug:
+        lxcs_qemus = self._read_cluster_resources() # also gets containers :shrug:
 
         for entry in lxcs_qemus:
             if 'name' in entry and entry['name'] == fqdn:
@@ -641,43 +1719,124 @@ class Proxmox():
 
         raise exceptions.resource.NotFound("The template does not exist")
 
+    def _get_template_catalogue(
+        self,
+        instance_type: models.proxmox.Type
+    ) -> Dict[str, models.proxmox.Template]:
+        """Templates of a type by hostname, read from Proxmox if they haven't been in the last ttl seconds"""
+        with self._templates_lock:
+            cached = self._templates.get(instance_type)
+
+        if cached is not None and time.monotonic() - cached[0] < config.proxmox.templates.ttl:
+            return cached[1]
+
+        return self.refresh_templates(instance_type)[instance_type]
+
+    def refresh_templates(
+        self,
+        instance_type: Optional[models.proxmox.Type] = None
+    ) -> Dict[models.proxmox.Type, Dict[str, models.proxmox.Template]]:
+        """Re-read the template catalogue (of every type if instance_type is None) from Proxmox"""
+        instance_types = [instance_type] if instance_type is not None else list(models.proxmox.Type)
+
+        ret = {}
+        for instance_type in instance_types:
+            loaded_at = time.monotonic()
+            templates = self._read_templates_from_cluster(instance_type, ignore_errors=True)
+
+            with self._templates_lock:
+                self._templates[instance_type] = (loaded_at, templates)
+
+            ret[instance_type] = templates
+
+        return ret
+
+    def _put_template(
+        self,
+        template: models.proxmox.Template
+    ):
+        with self._templates_lock:
+            cached = self._templates.get(template.type)
+
+            if cached is not None:
+                templates = dict(cached[1])
+                templates[template.hostname] = template
+                self._templates[template.type] = (cached[0], templates)
+
     def read_template(
         self,
         instance_type: models.proxmox.Type,
-        hostname: str
-    ):
-        return self._read_template_by_fqdn(instance_type, self._get_template_fqdn(instance_type, hostname))
+        hostname: str,
+        verify: bool = False
+    ) -> models.proxmox.Template:
+        """
+        Read a template from the catalogue
+
+        If verify is True the template's config is checked against Proxmox (one request) and re-read if its digest changed,
+        use this when the template is about to be used rather than just shown
+        """
+        template = self._get_template_catalogue(instance_type).get(hostname)
+
+        # might be new since the catalogue was read
+        if template is None:
+            template = self._read_template_by_fqdn(instance_type, self._get_template_fqdn(instance_type, hostname))
+            self._put_template(template)
+            return template
+
+        if verify:
+            try:
+                if instance_type == models.proxmox.Type.LXC:
+                    digest = self.prox.nodes(f"{template.node}/lxc/{template.id}/config").get().get('digest')
+                elif instance_type == models.proxmox.Type.VPS:
+                    digest = self.prox.nodes(f"{template.node}/qemu/{template.id}/config").get().get('digest')
+            except Exception:
+                # moved or deleted
+                digest = None
+
+            if digest is None or digest != template._digest:
+                template = self._read_template_by_fqdn(instance_type, self._get_template_fqdn(instance_type, hostname))
+                self._put_template(template)
+
+        return template
         
     def read_templates(
         self,
         instance_type: models.proxmox.Type,
         ignore_errors: bool = True
+    ) -> Dict[str, models.proxmox.Template]:
+        return dict(self._get_template_catalogue(instance_type))
+
+    def _read_templates_from_cluster(
+        self,
+        instance_type: models.proxmox.Type,
+        ignore_errors: bool = True
     ) -> Dict[str, models.proxmox.Template]:
         ret = { }
 
         # query multiple types
 
-        lxcs_qemus = self.prox.cluster.resources.get(type="vm")
-
-        def found_template(typ: models.proxmox.Type, entry: dict):
-            try:
-                template = self._read_template_on_node(typ, entry['node'], entry['vmid'])
-                ret[template.hostname] = template
-            except Exception as e:
-                if ignore_errors == False:
-                    raise e
-
-                logger.info("read_templates ignoring template with error", ignore_errors=ignore_errors, entry=entry, exc_info=True, e=e)
+        lxcs_qemus = self._read_cluster_resources()
 
+        entries = []
         for entry in lxcs_qemus:
             if instance_type == models.proxmox.Type.VPS:
                 if entry['type'] == 'qemu' and 'name' in entry and entry['name'].endswith(self._get_template_type_base_fqdn(models.proxmox.Type.VPS)):
-                    found_template(models.proxmox.Type.VPS, entry)
+                    entries.append(entry)
 
             
             if instance_type == models.proxmox.Type.LXC:
                 if entry['type'] == 'lxc' and 'name' in entry and entry['name'].endswith(self._get_template_type_base_fqdn(models.proxmox.Type.LXC)):
-                    found_template(models.proxmox.Type.LXC, entry)
+                    entries.append(entry)
+
+        def read_template(entry: dict):
+            return self._read_template_on_node(instance_type, entry['node'], entry['vmid'])
+
+        for result in self._fan_out_reads("template", read_template, entries, ignore_errors):
+            if result.error is not None:
+                logger.info("read_templates ignoring template with error", ignore_errors=ignore_errors, entry=result.item, exc_info=result.error, e=result.error)
+                continue
+
+            ret[result.value.hostname] = result.value
 
         return ret
 
@@ -698,18 +1857,66 @@ class Proxmox():
     #     return ret
         
 
+    def _read_status(
+        self,
+        instance_type: models.proxmox.Type,
+        node: str,
+        vmid: int,
+        resource: Optional[dict] = None
+    ) -> Tuple[models.proxmox.Status, Optional[models.proxmox.Usage]]:
+        """
+        Returns the status and usage of an instance, taken from its cluster/resources entry if we have one
+        (saves a status/current round trip per VM), otherwise asks the node
+        """
+
+        if resource is not None and 'status' in resource:
+            current_status = resource
+        elif instance_type == models.proxmox.Type.LXC:
+            current_status = self.prox.nodes(f"{node}/lxc/{vmid}/status/current").get()
+        elif instance_type == models.proxmox.Type.VPS:
+            current_status = self.prox.nodes(f"{node}/qemu/{vmid}/status/current").get()
+
+        if current_status['status'] == 'running':
+            status = models.proxmox.Status.Running
+        elif current_status['status'] == 'stopped':
+            status = models.proxmox.Status.Stopped
+        else:
+            status = models.proxmox.Status.NotApplicable
+
+        usage = models.proxmox.Usage(
+            cpu=current_status.get('cpu', 0),
+            memory=current_status.get('mem', 0),
+            max_memory=current_status.get('maxmem', 0),
+            disk=current_status.get('disk', 0),
+            max_disk=current_status.get('maxdisk', 0),
+            uptime=current_status.get('uptime', 0)
+        )
+
+        return status, usage
+
     def _read_instance_on_node(
         self,
         instance_type: models.proxmox.Type,
         node: str,
         vmid: int,
-        expected_fqdn: Optional[str] = None
+        expected_fqdn: Optional[str] = None,
+        resource: Optional[dict] = None,
+        validate_vhosts: bool = True,
+        vm_config: Optional[dict] = None
     ) -> models.proxmox.Instance:
-        """Read instance by reading the vm/container on proxmox and parsing the description metadata"""
+        """
+        Read instance by reading the vm/container on proxmox and parsing the description metadata
+
+        resource is the instance's entry from cluster/resources if the caller has it, status is taken from it
+
+        validate_vhosts can be turned off by callers reading many instances, they should batch validate with _add_vhost_remarks
+
+        vm_config is the vm/container's config if the caller already read it, with a resource that has a status nothing is read
+        """
 
         if instance_type == models.proxmox.Type.LXC:
             try:
-                lxc_config = self.prox.nodes(f"{node}/lxc/{vmid}/config").get()
+                lxc_config = vm_config if vm_config is not None else self.prox.nodes(f"{node}/lxc/{vmid}/config").get()
             except Exception as e:
                 raise exceptions.resource.NotFound("The instance does not exist")
 
@@ -720,8 +1927,8 @@ class Proxmox():
 
             # decode description
             try:
-                metadata = models.proxmox.Metadata.parse_obj(
-                    yaml.safe_load(lxc_config['description'])
+                metadata = models.proxmox.Metadata.from_description(
+                    lxc_config['description']
                 )
             except Exception as e:
                 raise exceptions.resource.Unavailable(
@@ -769,11 +1976,7 @@ class Proxmox():
                 disk_space=disk_space
             )
 
-            current_status = self.prox.nodes(f"{node}/lxc/{vmid}/status/current").get()
-            if current_status['status'] == 'running':
-                status = models.proxmox.Status.Running
-            elif current_status['status'] == 'stopped':
-                status = models.proxmox.Status.Stopped
+            status, usage = self._read_status(instance_type, node, vmid, resource)
 
             instance = models.proxmox.Instance(
                 type=instance_type,
@@ -787,20 +1990,21 @@ class Proxmox():
                 specs=specs,
                 remarks=[],
                 status=status,
+                usage=usage,
                 active=active
             )
+            instance._digest = lxc_config.get('digest')
+            instance._description = lxc_config['description']
 
             # Build remarks about the vhosts
-            for vhost in instance.metadata.network.vhosts:
-                valid, remarks = self.validate_domain(instance, vhost)
-
-                if valid is not True:
-                    instance.remarks += remarks
+            if validate_vhosts == True:
+                self._add_vhost_remarks([instance])
 
             return instance
         elif instance_type == models.proxmox.Type.VPS:
             try:
-                vm_config = self.prox.nodes(f"{node}/qemu/{vmid}/config").get()
+                if vm_config is None:
+                    vm_config = self.prox.nodes(f"{node}/qemu/{vmid}/config").get()
             except Exception as e:
                 raise exceptions.resource.NotFound("The instance does not exist")
 
@@ -811,8 +2015,8 @@ class Proxmox():
             
             # decode description
             try:
-                metadata = models.proxmox.Metadata.parse_obj(
-                    yaml.safe_load(vm_config['description'])
+                metadata = models.proxmox.Metadata.from_description(
+                    vm_config['description']
                 )
             except Exception as e:
                 raise exceptions.resource.Unavailable(
@@ -856,11 +2060,7 @@ class Proxmox():
                 disk_space=disk_space
             )
 
-            current_status = self.prox.nodes(f"{node}/qemu/{vmid}/status/current").get()
-            if current_status['status'] == 'running':
-                status = models.proxmox.Status.Running
-            elif current_status['status'] == 'stopped':
-                status = models.proxmox.Status.Stopped
+            status, usage = self._read_status(instance_type, node, vmid, resource)
 
             shutdown_date = metadata.inactivity.marked_active_at + datetime.timedelta(config.proxmox.vps.inactivity_shutdown_num_days)
             deletion_date = metadata.inactivity.marked_active_at + datetime.timedelta(config.proxmox.vps.inactivity_deletion_num_days)
@@ -877,30 +2077,91 @@ class Proxmox():
                 specs=specs,
                 remarks=[],
                 status=status,
+                usage=usage,
                 active=active
             )
+            instance._digest = vm_config.get('digest')
+            instance._description = vm_config['description']
 
             # Build remarks about the thing, problems, etc...
-            for vhost in instance.metadata.network.vhosts:
-                valid, remarks = self.validate_domain(instance, vhost)
-
-                if valid is not True:
-                    instance.remarks += remarks
+            if validate_vhosts == True:
+                self._add_vhost_remarks([instance])
 
             return instance
 
         raise exceptions.resource.NotFound("The instance does not exist")
 
+    async def _read_instance_on_node_async(
+        self,
+        instance_type: models.proxmox.Type,
+        node: str,
+        vmid: int,
+        expected_fqdn: Optional[str] = None,
+        resource: Optional[dict] = None
+    ) -> models.proxmox.Instance:
+        """Async version of _read_instance_on_node, vhosts are not validated"""
+
+        path = f"{node}/lxc/{vmid}" if instance_type == models.proxmox.Type.LXC else f"{node}/qemu/{vmid}"
+
+        try:
+            vm_config = await self.aprox.nodes(f"{path}/config").get()
+        except Exception as e:
+            raise exceptions.resource.NotFound("The instance does not exist")
+
+        if resource is None or 'status' not in resource:
+            resource = await self.aprox.nodes(f"{path}/status/current").get()
+
+        return self._read_instance_on_node(
+            instance_type,
+            node,
+            vmid,
+            expected_fqdn=expected_fqdn,
+            resource=resource,
+            validate_vhosts=False,
+            vm_config=vm_config
+        )
+
+    async def _add_vhost_remarks_async(
+        self,
+        instances: List[models.proxmox.Instance]
+    ):
+        """Validating vhosts blocks on DNS, so it runs on a thread"""
+        await asyncio.get_event_loop().run_in_executor(None, self._add_vhost_remarks, instances)
+
+    def _add_vhost_remarks(
+        self,
+        instances: List[models.proxmox.Instance]
+    ):
+        """Validate the vhosts of many instances in one batch, adding remarks to instances with problems"""
+
+        pairs = [(instance, vhost) for instance in instances for vhost in instance.metadata.network.vhosts]
+
+        for (instance, vhost), (valid, remarks) in zip(pairs, self.validate_domains(pairs)):
+            if valid is not True:
+                instance.remarks += remarks
+
     def _read_instance_by_fqdn(
         self,
         instance_type: models.proxmox.Type,
-        fqdn: str
+        fqdn: str,
+        fresh: bool = False
     ) -> models.proxmox.Instance:
-        lxcs_qemus = self.prox.cluster.resources.get(type="vm") # also gets containers :shrug:
+        """fresh makes sure an instance we just created/changed is seen, see _read_cluster_resources"""
+        location = self.locations.get(fqdn)
+
+        if location is not None and location.type == instance_type:
+            try:
+                return self._read_instance_on_node(instance_type, location.node, location.vmid, expected_fqdn=fqdn)
+            except exceptions.resource.NotFound:
+                # migrated/renamed/deleted since we last saw it, rescan
+                self.locations.remove(fqdn)
+
+        lxcs_qemus = self._read_cluster_resources(fresh) # also gets containers :shrug:
+        self.locations.replace(lxcs_qemus)
 
         for entry in lxcs_qemus:
             if 'name' in entry and entry['name'] == fqdn:
-                instance = self._read_instance_on_node(instance_type, entry['node'], entry['vmid'])
+                instance = self._read_instance_on_node(instance_type, entry['node'], entry['vmid'], resource=entry)
                 return instance
 
         raise exceptions.resource.NotFound("The instance does not exist")
@@ -916,74 +2177,307 @@ class Proxmox():
             self._get_instance_fqdn_for_account(instance_type, account, hostname)
         )
 
-    def read_instances_by_account(
-        self,
-        instance_type: models.proxmox.Type,
-        account: models.account.Account,
-        ignore_errors: bool = True
-    ) -> Dict[str, models.proxmox.Instance]:
-        
-        ret = { }
+    def read_instances_by_account(
+        self,
+        instance_type: models.proxmox.Type,
+        account: models.account.Account,
+        ignore_errors: bool = True,
+        max_age: float = 0
+    ) -> Dict[str, models.proxmox.Instance]:
+        """
+        Read all instances of a type owned by an account, dict indexed by hostname
+
+        If max_age is non-zero the instances may be served from the inventory snapshot if it is no older than max_age seconds
+        """
+        ret = { }
+
+        if max_age > 0 and ignore_errors == True:
+            suffix = self._get_instance_fqdn_for_account(instance_type, account, "")
+
+            for fqdn, instance in self._read_inventory(max_age).items():
+                if instance.type == instance_type and fqdn.endswith(suffix):
+                    ret[instance.hostname] = instance
+
+            return ret
+
+        lxcs_qemus = self._read_cluster_resources()
+
+        entries = list(filter(lambda entry: 'name' in entry and entry['name'].endswith(self._get_instance_fqdn_for_account(instance_type, account, "")), lxcs_qemus))
+
+        def read_instance(entry: dict):
+            return self._read_instance_on_node(instance_type, entry['node'], entry['vmid'], resource=entry, validate_vhosts=False)
+
+        for result in self._fan_out_reads("instance", read_instance, entries, ignore_errors):
+            if result.error is not None:
+                logger.info("read_instances_by_account ignoring instance with error", instance=result.item['name'], ignore_errors=ignore_errors, e=result.error, exc_info=result.error)
+                continue
+
+            ret[result.value.hostname] = result.value
+
+        self._add_vhost_remarks(list(ret.values()))
+
+        return ret
+
+    async def read_instances_by_account_async(
+        self,
+        instance_type: models.proxmox.Type,
+        account: models.account.Account,
+        ignore_errors: bool = True,
+        max_age: float = 0
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Async version of read_instances_by_account"""
+        ret = { }
+        suffix = self._get_instance_fqdn_for_account(instance_type, account, "")
+
+        if max_age > 0 and ignore_errors == True:
+            for fqdn, instance in (await self._read_inventory_async(max_age)).items():
+                if instance.type == instance_type and fqdn.endswith(suffix):
+                    ret[instance.hostname] = instance
+
+            return ret
+
+        lxcs_qemus = await self._read_cluster_resources_async()
+
+        entries = list(filter(lambda entry: 'name' in entry and entry['name'].endswith(suffix), lxcs_qemus))
+
+        async def read_instance(entry: dict):
+            return await self._read_instance_on_node_async(instance_type, entry['node'], entry['vmid'], resource=entry)
+
+        for result in await self._fan_out_reads_async("instance", read_instance, entries, ignore_errors):
+            if result.error is not None:
+                logger.info("read_instances_by_account ignoring instance with error", instance=result.item['name'], ignore_errors=ignore_errors, e=result.error, exc_info=result.error)
+                continue
+
+            ret[result.value.hostname] = result.value
+
+        await self._add_vhost_remarks_async(list(ret.values()))
+
+        return ret
+
+    def _read_instances_from_cluster(
+        self,
+        instance_type: models.proxmox.Type = None,
+        ignore_errors: bool = True
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Read all instances directly from the cluster, dict indexed by fqdn"""
+
+        # query multiple types
+        ret = {}
+
+        lxcs_qemus = self._read_cluster_resources()
+        self.locations.replace(lxcs_qemus)
+
+        def read_instance(entry: dict):
+            typ = models.proxmox.Type.VPS if entry['type'] == 'qemu' else models.proxmox.Type.LXC
+            return self._read_instance_on_node(typ, entry['node'], entry['vmid'], resource=entry, validate_vhosts=False)
+
+        for result in self._fan_out_reads("instance", read_instance, self._instance_entries(lxcs_qemus, instance_type), ignore_errors):
+            if result.error is not None:
+                logger.info("read_instances ignoring instance with error", ignore_errors=ignore_errors, entry=result.item, exc_info=result.error, e=result.error)
+                continue
+
+            ret[result.value.fqdn] = result.value
+
+        self._add_vhost_remarks(list(ret.values()))
+
+        return ret
+
+    async def _read_instances_from_cluster_async(
+        self,
+        instance_type: models.proxmox.Type = None,
+        ignore_errors: bool = True
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Async version of _read_instances_from_cluster"""
+
+        ret = {}
+
+        lxcs_qemus = await self._read_cluster_resources_async()
+        self.locations.replace(lxcs_qemus)
+
+        async def read_instance(entry: dict):
+            typ = models.proxmox.Type.VPS if entry['type'] == 'qemu' else models.proxmox.Type.LXC
+            return await self._read_instance_on_node_async(typ, entry['node'], entry['vmid'], resource=entry)
+
+        for result in await self._fan_out_reads_async("instance", read_instance, self._instance_entries(lxcs_qemus, instance_type), ignore_errors):
+            if result.error is not None:
+                logger.info("read_instances ignoring instance with error", ignore_errors=ignore_errors, entry=result.item, exc_info=result.error, e=result.error)
+                continue
+
+            ret[result.value.fqdn] = result.value
+
+        await self._add_vhost_remarks_async(list(ret.values()))
+
+        return ret
+
+    def _instance_entries(
+        self,
+        lxcs_qemus: List[dict],
+        instance_type: models.proxmox.Type = None
+    ) -> List[dict]:
+        """The entries of a cluster/resources listing that are instances (of a type)"""
+        entries = []
+
+        if instance_type == models.proxmox.Type.VPS or instance_type == None:
+            for entry in lxcs_qemus:
+                if entry['type'] == 'qemu' and 'name' in entry and entry['name'].endswith(self._get_instance_type_base_fqdn(models.proxmox.Type.VPS)):
+                    entries.append(entry)
+        
+        
+        if instance_type == models.proxmox.Type.LXC or instance_type == None:
+            for entry in lxcs_qemus:
+                if entry['type'] == 'lxc' and 'name' in entry and entry['name'].endswith(self._get_instance_type_base_fqdn(models.proxmox.Type.LXC)):
+                    entries.append(entry)
+
+        return entries
+
+    def reap_ssh_connections(self):
+        """Close pooled SSH connections to the cluster that have been idle for too long"""
+        ssh_pool.reap()
+
+    def refresh_inventory(
+        self
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Re-read every instance in the cluster into the inventory snapshot, concurrent refreshes share one read"""
+
+        def refresh():
+            taken_at = time.monotonic()
+            instances = self._read_instances_from_cluster(ignore_errors=True)
+
+            return self._store_inventory(instances, taken_at)
+
+        return self._flights.do("refresh_inventory", refresh)
+
+    async def refresh_inventory_async(
+        self
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Async version of refresh_inventory"""
+
+        async def refresh():
+            taken_at = time.monotonic()
+            instances = await self._read_instances_from_cluster_async(ignore_errors=True)
+
+            return self._store_inventory(instances, taken_at)
+
+        return await self._async_flights.do("refresh_inventory", refresh)
+
+    def _store_inventory(
+        self,
+        instances: Dict[str, models.proxmox.Instance],
+        taken_at: float
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Replace the inventory (and everything indexed from it) with a full read of the cluster that started at taken_at"""
+
+        self.inventory.replace(instances, taken_at)
+
+        if self._ip_index is not None:
+            self._ip_index.reset(self._used_ip_indexes(instances), taken_at)
+        if self._port_index is not None:
+            self._port_index.reset(self._used_port_indexes(instances), taken_at)
+        if self._vhost_index is not None:
+            self._vhost_index.rebuild(instances, taken_at)
+
+        return self.inventory.snapshot(float("inf"))[0]
+
+    def _read_inventory(
+        self,
+        max_age: float
+    ) -> Dict[str, models.proxmox.Instance]:
+        """Returns the inventory snapshot, refreshing it if it is older than max_age and re-reading any dirty instances"""
+
+        snapshot = self.inventory.snapshot(max_age)
+
+        if snapshot is None:
+            return self.refresh_inventory()
+
+        instances, dirty = snapshot
+
+        for fqdn in dirty:
+            stale = instances[fqdn]
+
+            try:
+                instance = self._read_instance_on_node(stale.type, stale.node, stale.id, expected_fqdn=fqdn)
+            except exceptions.resource.NotFound:
+                # the instance was deleted or moved to another node behind our back, we have to rescan
+                logger.info("inventory instance moved or missing, refreshing", fqdn=fqdn, node=stale.node, vmid=stale.id)
+                self.inventory.invalidate()
+                return self.refresh_inventory()
+            except Exception as e:
+                logger.info("inventory ignoring instance with error", fqdn=fqdn, exc_info=True, e=e)
+                self.inventory.remove(fqdn)
+                del instances[fqdn]
+                continue
+
+            self.inventory.put(instance)
+            instances[fqdn] = instance
 
-        lxcs_qemus = self.prox.cluster.resources.get(type="vm")
-        
-        for entry in lxcs_qemus:
-            if 'name' in entry and entry['name'].endswith(self._get_instance_fqdn_for_account(instance_type, account, "")):
-                if ignore_errors == True:
-                    try:
-                        instance = self._read_instance_on_node(instance_type, entry['node'], entry['vmid'])
-                        ret[instance.hostname] = instance
-                    except Exception as e:
-                        logger.info("read_instances_by_account ignoring instance with error", instance=entry['name'], ignore_errors=ignore_errors, e=e, exc_info=True)
-                else:
-                    instance = self._read_instance_on_node(instance_type, entry['node'], entry['vmid'])
-                    ret[instance.hostname] = instance
-                        
-        return ret
+        return instances
 
-    def read_instances(
+    async def _read_inventory_async(
         self,
-        instance_type: models.proxmox.Type = None,
-        ignore_errors: bool = True
+        max_age: float
     ) -> Dict[str, models.proxmox.Instance]:
-        """Read all instances in the cluster, dict indexed by fqdn, special flag to ignore instances that cause exceptions on reading"""
+        """Async version of _read_inventory"""
 
-        # query multiple types
-        ret = {}
+        snapshot = self.inventory.snapshot(max_age)
 
-        lxcs_qemus = self.prox.cluster.resources.get(type="vm")
+        if snapshot is None:
+            return await self.refresh_inventory_async()
 
-        def found_instance(typ: models.proxmox.Type, entry: dict):
-            try:
-                instance = self._read_instance_on_node(typ, entry['node'], entry['vmid'])
-                ret[instance.fqdn] = instance
+        instances, dirty = snapshot
+
+        for fqdn in dirty:
+            stale = instances[fqdn]
 
+            try:
+                instance = await self._read_instance_on_node_async(stale.type, stale.node, stale.id, expected_fqdn=fqdn)
+                await self._add_vhost_remarks_async([instance])
+            except exceptions.resource.NotFound:
+                # the instance was deleted or moved to another node behind our back, we have to rescan
+                logger.info("inventory instance moved or missing, refreshing", fqdn=fqdn, node=stale.node, vmid=stale.id)
+                self.inventory.invalidate()
+                return await self.refresh_inventory_async()
             except Exception as e:
-                if ignore_errors == False:
-                    raise e
+                logger.info("inventory ignoring instance with error", fqdn=fqdn, exc_info=True, e=e)
+                self.inventory.remove(fqdn)
+                del instances[fqdn]
+                continue
 
-                logger.info("read_instances ignoring template with error", ignore_errors=ignore_errors, entry=entry, exc_info=True, e=e)
+            self.inventory.put(instance)
+            instances[fqdn] = instance
 
+        return instances
 
-        if instance_type == models.proxmox.Type.VPS or instance_type == None:
-            for entry in lxcs_qemus:
-                if entry['type'] == 'qemu' and 'name' in entry and entry['name'].endswith(self._get_instance_type_base_fqdn(models.proxmox.Type.VPS)):
-                    found_instance(models.proxmox.Type.VPS, entry)
-        
-        
-        if instance_type == models.proxmox.Type.LXC or instance_type == None:
-            for entry in lxcs_qemus:
-                if entry['type'] == 'lxc' and 'name' in entry and entry['name'].endswith(self._get_instance_type_base_fqdn(models.proxmox.Type.LXC)):
-                    found_instance(models.proxmox.Type.LXC, entry)
+    def read_instances(
+        self,
+        instance_type: models.proxmox.Type = None,
+        ignore_errors: bool = True,
+        max_age: float = 0
+    ) -> Dict[str, models.proxmox.Instance]:
+        """
+        Read all instances in the cluster, dict indexed by fqdn, special flag to ignore instances that cause exceptions on reading
 
-        return ret
+        If max_age is non-zero the instances may be served from the inventory snapshot if it is no older than max_age seconds
+        """
+
+        if ignore_errors == False:
+            return self._read_instances_from_cluster(instance_type, ignore_errors)
+
+        if max_age > 0:
+            instances = self._read_inventory(max_age)
+        else:
+            instances = self.refresh_inventory()
+
+        if instance_type is None:
+            return instances
 
+        return { fqdn: instance for fqdn, instance in instances.items() if instance.type == instance_type }
 
     def read_all_instances(
         self,
-        ignore_errors: bool = True
+        ignore_errors: bool = True,
+        max_age: float = 0
     ) -> Dict[str, models.proxmox.Instance]:
-        return self.read_instances(ignore_errors=ignore_errors)
+        return self.read_instances(ignore_errors=ignore_errors, max_age=max_age)
 
 
     def _generate_instance_root_user(
@@ -1003,30 +2497,99 @@ class Proxmox():
     def _wait_for_qemu_guest_agent_ping(
         self,
         instance: models.proxmox.Instance,
-        timeout: int = 25,
-        poll_interval: int = 1
+        timeout: int = 25
     ):
         """Waits for the qemu-guest-agent process to start on a vm"""
 
         if instance.type != models.proxmox.Type.VPS:
             raise exceptions.resource.Unavailable("Can't wait on guest agent for non QEMU VM")
 
-        start = time.time()
-        while True:
-            now = time.time()
-
+        def pinged() -> bool:
             try:
                 self.prox.nodes(instance.node).qemu(f"{instance.id}/agent/ping").post()
                 # throws an error if ping fails, we ignore error in exception handler
-                # if ping is successful break out of the loop
-                break
+                return True
             except Exception as e:
-                pass
+                return False
+
+        if not utilities.backoff.poll(pinged, timeout, config.proxmox.tasks.poll_initial_interval, config.proxmox.tasks.poll_max_interval):
+            raise exceptions.resource.Unavailable(f"Timeout occured waiting for instance to start qemu-guest-agent")
+
+    def _run_node_steps(
+        self,
+        con: ClusterNodeSSH,
+        files: Dict[str, str],
+        steps: List[Tuple[str, str]]
+    ):
+        """
+        Upload files to a scratch directory on a node and run a list of (shell command, error message) steps
+        in one go, stopping at the first step that fails
 
-            if (now-start) > timeout:
-                raise exceptions.resource.Unavailable(f"Timeout occured waiting for instance to start qemu-guest-agent")
+        Commands can refer to the uploaded files as "$dir/<name>", the directory is removed afterwards
 
-            time.sleep(poll_interval)
+        Raises an exception with the failed step's error message followed by its exit status, stdout and stderr
+        """
+        workdir = f"/tmp/netsoc-cloud-{os.urandom(8).hex()}"
+
+        script = [
+            "#!/bin/sh",
+            f"dir='{workdir}'",
+            "export dir",
+            "trap 'rm -rf \"$dir\"' EXIT",
+            "step() {",
+            "    n=\"$1\"; shift",
+            "    sh -c \"$1\" > \"$dir/out\" 2> \"$dir/err\"",
+            "    status=$?",
+            "    echo \"@@step $n $status\"",
+            "    if [ $status -ne 0 ]; then cat \"$dir/out\"; cat \"$dir/err\" >&2; exit $status; fi",
+            "}"
+        ]
+
+        for i, (command, message) in enumerate(steps):
+            # single quoted so $dir is expanded by the step's own shell
+            script.append(f"step {i} '" + command.replace("'", "'\\''") + "'")
+
+        con.sftp.mkdir(workdir, 0o700)
+
+        try:
+            for name, content in files.items():
+                with con.sftp.open(f"{workdir}/{name}", "w") as f:
+                    f.write(content)
+
+            with con.sftp.open(f"{workdir}/run.sh", "w") as f:
+                f.write("\n".join(script) + "\n")
+        except Exception:
+            con.ssh.exec_command(f"rm -rf '{workdir}'")
+            raise
+
+        stdin, stdout, stderr = con.ssh.exec_command(f"sh '{workdir}/run.sh'")
+        status = stdout.channel.recv_exit_status()
+
+        if status == 0:
+            return
+
+        out = stdout.read()
+        err = stderr.read()
+
+        # find the step that failed, everything after its marker is that step's output
+        # if the script died without reporting a failure, blame the step after the last one that succeeded
+        failed = 0
+        lines = out.split(b"\n")
+        for line_number, line in enumerate(lines):
+            if line.startswith(b"@@step "):
+                _, n, step_status = line.decode("utf-8").split(" ")
+
+                if int(step_status) != 0:
+                    failed = int(n)
+                    status = int(step_status)
+                    out = b"\n".join(lines[line_number + 1:])
+                    break
+
+                failed = int(n) + 1
+                out = b""
+
+        message = steps[min(failed, len(steps) - 1)][1]
+        raise exceptions.resource.Unavailable(f"{message}{status}: {out} {err}")
 
     def reset_instance_root_user(
         self,
@@ -1045,69 +2608,45 @@ class Proxmox():
 
         if instance.type == models.proxmox.Type.LXC:
             with ClusterNodeSSH(instance.node) as con:
-                # Install root password
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"echo -e 'root:{root_user.password_hash}' | pct exec {instance.id} -- chpasswd -e"
-                )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: unable to set root password: {status}: {stdout.read()} {stderr.read()}"
-                    )
-
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"pct exec {instance.id} -- mkdir -p /root/.ssh"
-                )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: unable to create /root/.ssh: {status}: {stdout.read()} {stderr.read()}"
-                    )
-
-                # Install ssh keys
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"echo -e '# --- BEGIN PVE ---\\n{root_user.ssh_public_key}\\n# --- END PVE ---' | pct push { instance.id } /dev/stdin '/root/.ssh/authorized_keys' --perms 0600 --user 0 --group 0"
-                )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: unable to inject ssh keys {status}: {stdout.read()} {stderr.read()}"
-                    )
-                
-                # Install banner
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"echo -e \"{ templates.sshd.banner.render() }\" | pct push { instance.id } /dev/stdin '/etc/banner' --perms 0644 --user 0 --group 0"
-                )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: could not install banner {status}: {stdout.read()} {stderr.read()}"
-                    )
-
-                # Install sshd config
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"echo -e \"{ templates.sshd.config_allow_root_login.render(banner_path='/etc/banner') }\" | pct push { instance.id } /dev/stdin '/etc/ssh/sshd_config' --perms 0644 --user 0 --group 0"
-                )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: unable to reset ssh configuration {status}: {stdout.read()} {stderr.read()}"
-                    )
-
-                stdin, stdout, stderr = con.ssh.exec_command(
-                    f"pct exec {instance.id} -- service ssh restart"
+                self._run_node_steps(
+                    con,
+                    files={
+                        "password": f"root:{root_user.password_hash}\n",
+                        "authorized_keys": f"# --- BEGIN PVE ---\n{root_user.ssh_public_key}\n# --- END PVE ---\n",
+                        "banner": templates.sshd.banner.render(),
+                        "sshd_config": templates.sshd.config_allow_root_login.render(banner_path='/etc/banner')
+                    },
+                    steps=[
+                        # Install root password
+                        (
+                            f'pct exec {instance.id} -- chpasswd -e < "$dir/password"',
+                            "Could not start instance: unable to set root password: "
+                        ),
+                        (
+                            f"pct exec {instance.id} -- mkdir -p /root/.ssh",
+                            "Could not start instance: unable to create /root/.ssh: "
+                        ),
+                        # Install ssh keys
+                        (
+                            f'pct push {instance.id} "$dir/authorized_keys" /root/.ssh/authorized_keys --perms 0600 --user 0 --group 0',
+                            "Could not start instance: unable to inject ssh keys "
+                        ),
+                        # Install banner
+                        (
+                            f'pct push {instance.id} "$dir/banner" /etc/banner --perms 0644 --user 0 --group 0',
+                            "Could not start instance: could not install banner "
+                        ),
+                        # Install sshd config
+                        (
+                            f'pct push {instance.id} "$dir/sshd_config" /etc/ssh/sshd_config --perms 0644 --user 0 --group 0',
+                            "Could not start instance: unable to reset ssh configuration "
+                        ),
+                        (
+                            f"pct exec {instance.id} -- service ssh restart",
+                            "Could not start instance: unable to (re)start sshd server: "
+                        )
+                    ]
                 )
-                status = stdout.channel.recv_exit_status()
-
-                if status != 0:
-                    raise exceptions.resource.Unavailable(
-                        f"Could not start instance: unable to (re)start sshd server: {status}: {stdout.read()} {stderr.read()}"
-                    )
 
         elif instance.type == models.proxmox.Type.VPS:
             self._wait_for_qemu_guest_agent_ping(instance)
@@ -1145,8 +2684,10 @@ class Proxmox():
                 command="service ssh restart",
             )
 
-        instance.metadata.root_user = root_user
-        self.write_out_instance_metadata(instance)
+        def set_root_user(metadata: models.proxmox.Metadata):
+            metadata.root_user = root_user
+
+        self.write_out_instance_metadata(instance, set_root_user)
 
         return password, user_ssh_private_key, root_user
 
@@ -1318,6 +2859,7 @@ version: 2
 
             self.prox.nodes(instance.node).qemu(f"{instance.id}/status/start").post()
 
+        self.inventory.invalidate(instance.fqdn)
 
     def stop_instance(
         self,
@@ -1329,6 +2871,8 @@ version: 2
             elif instance.type == models.proxmox.Type.VPS:
                 self.prox.nodes(instance.node).qemu(f"{instance.id}/status/stop").post()
 
+            self.inventory.invalidate(instance.fqdn)
+
     def shutdown_instance(
         self,
         instance: models.proxmox.Instance
@@ -1339,15 +2883,19 @@ version: 2
             elif instance.type == models.proxmox.Type.VPS:
                 self.prox.nodes(instance.node).qemu(f"{instance.id}/status/shutdown").post()
 
+            self.inventory.invalidate(instance.fqdn)
+
     def mark_instance_active(
         self,
         instance: models.proxmox.Instance
     ): 
         # reset inactivity status
-        instance.metadata.inactivity = models.proxmox.Inactivity(
-            marked_active_at = datetime.date.today()
-        )
-        self.write_out_instance_metadata(instance)
+        def reset_inactivity(metadata: models.proxmox.Metadata):
+            metadata.inactivity = models.proxmox.Inactivity(
+                marked_active_at = datetime.date.today()
+            )
+
+        self.write_out_instance_metadata(instance, reset_inactivity)
 
     def add_instance_vhost(
         self,
@@ -1360,8 +2908,10 @@ version: 2
         if not self.is_domain_available(vhost):
             raise exceptions.resource.Unavailable(f"This domain/vhost is currently in use by another user or instance.")
 
-        instance.metadata.network.vhosts[vhost] = options
-        self.write_out_instance_metadata(instance)
+        def add_vhost(metadata: models.proxmox.Metadata):
+            metadata.network.vhosts[vhost] = options
+
+        self.write_out_instance_metadata(instance, add_vhost)
 
     def remove_instance_vhost(
         self,
@@ -1369,9 +2919,10 @@ version: 2
         vhost: str
     ):
         if vhost in instance.metadata.network.vhosts:
-            del instance.metadata.network.vhosts[vhost]
+            def remove_vhost(metadata: models.proxmox.Metadata):
+                metadata.network.vhosts.pop(vhost, None)
 
-            self.write_out_instance_metadata(instance)
+            self.write_out_instance_metadata(instance, remove_vhost)
         else:
             raise exceptions.resource.NotFound(f"Could not find {vhost} vhost on instance")
 
@@ -1387,7 +2938,7 @@ version: 2
         all_instances = None
 
         if instances == None:
-            all_instances = self.read_all_instances(ignore_errors=True)
+            all_instances = self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age)
         else:
             all_instances = instances
 
@@ -1410,38 +2961,114 @@ version: 2
         
         return port_map
 
-    def get_random_available_external_port(
+    def _port_to_index(
         self,
-        instances: Dict[str, models.proxmox.Instance] = None
+        external_port: int
+    ) -> Optional[int]:
+        """Index of an external port in the port forward range, None for ports outside it (i.e legacy ones)"""
+        start, end = config.proxmox.network.port_forward.range
+
+        if external_port < start or external_port > end:
+            return None
+
+        return external_port - start
+
+    def _used_port_indexes(
+        self,
+        instances: Dict[str, models.proxmox.Instance]
+    ) -> List[int]:
+        return [
+            self._port_to_index(external_port)
+            for instance in instances.values()
+            for external_port in instance.metadata.network.ports
+            if self._port_to_index(external_port) is not None
+        ]
+
+    def _get_port_index(self) -> utilities.allocator.BitmapAllocator:
+        """Get the allocation index over the port forward range, building it from the inventory the first time"""
+        with self._port_index_lock:
+            if self._port_index is None:
+                port_index = utilities.allocator.BitmapAllocator(
+                    config.proxmox.network.port_forward.range[1] - config.proxmox.network.port_forward.range[0] + 1
+                )
+
+                taken_at = time.monotonic()
+                instances = self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age)
+                port_index.reset(self._used_port_indexes(instances), taken_at)
+
+                self._port_index = port_index
+
+            return self._port_index
+
+    def get_random_available_external_port(
+        self
     ) -> Optional[int]:
-        port_map = self.get_port_forward_map(instances)
+        self._refresh_indexes()
+        port_index = self._get_port_index()
 
-        occupied_set = set(port_map.keys())
-        full_range_set = set(range(config.proxmox.network.port_forward.range[0],config.proxmox.network.port_forward.range[1]+1))
+        # ports other processes have just mapped may not be in our index yet
+        for port in self._get_reservations().held("port"):
+            index = self._port_to_index(int(port))
+            if index is not None:
+                port_index.commit(index)
 
-        remaining = full_range_set-occupied_set
+        index = port_index.random_free()
 
-        if len(remaining) > 0:
-            return random.choice(tuple(remaining))
+        if index is not None:
+            return config.proxmox.network.port_forward.range[0] + index
         
         raise exceptions.resource.Unavailable("out of suitable external ports")
 
+    def _get_vhost_index(self) -> VHostIndex:
+        """Get the vhost ownership index, building it from the inventory the first time"""
+        with self._vhost_index_lock:
+            if self._vhost_index is None:
+                vhost_index = VHostIndex()
+
+                taken_at = time.monotonic()
+                vhost_index.rebuild(self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age), taken_at)
+
+                self._vhost_index = vhost_index
+
+            return self._vhost_index
+
     def is_domain_available(
         self,
         domain: str
     ) -> bool:
         """Returns False if the domain is in use by another instance"""
 
-        for fqdn, instance in self.read_all_instances(ignore_errors=True).items():
-            # first do vhosts
-            for vhost, options in instance.metadata.network.vhosts.items():
-                valid, remarks = self.validate_domain(instance, vhost)
+        for fqdn, owner in self._get_vhost_index().claims(domain).items():
+            valid, remarks = self._validate_domain_for_owner(owner, domain)
 
-                if valid is True and domain == vhost:
-                    return False
+            if valid is True:
+                return False
                 
         return True
 
+    def get_vhost_conflicts(self) -> Dict[str, List[models.proxmox.VHostClaim]]:
+        """Every domain claimed as a vhost by more than one instance, with whether each claim validates"""
+
+        duplicates = self._get_vhost_index().duplicates()
+
+        pairs = [(domain, owner) for domain, claimants in duplicates.items() for owner in claimants.values()]
+        validations = self._validate_domains_for_owners(pairs)
+
+        conflicts = {}
+        for domain, claimants in duplicates.items():
+            conflicts[domain] = []
+
+            for fqdn, owner in claimants.items():
+                validation = validations.get((domain, owner))
+
+                conflicts[domain].append(models.proxmox.VHostClaim(
+                    fqdn=fqdn,
+                    owner=owner,
+                    valid=validation[0] if validation is not None else None
+                ))
+
+        return conflicts
+
     def validate_domain(
         self,
         instance: models.proxmox.Instance,
@@ -1450,9 +3077,146 @@ version: 2
         """
         Verifies a single domain, if the domain is valid, (True, None) is returned
         If the domain is invalid, (False, a list of remarks is returned)
+
+        Results for custom domains are cached per (domain, owner) for as long as the DNS records they were based on are valid
+        """
+        return self._validate_domain_for_owner(instance.metadata.owner, domain)
+
+    def validate_domains(
+        self,
+        domains: List[Tuple[models.proxmox.Instance, str]]
+    ) -> List[Tuple[bool, Optional[List[str]]]]:
+        """
+        Verifies many (instance, domain) pairs at once, looking up uncached domains concurrently
+
+        Returns a (valid, remarks) tuple per pair in the order given, like validate_domain.
+        Lookups still outstanding after the batch deadline are reported as invalid
+        """
+        validations = self._validate_domains_for_owners(list(map(lambda pair: (pair[1], pair[0].metadata.owner), domains)))
+
+        ret = []
+        for instance, domain in domains:
+            validation = validations[(domain, instance.metadata.owner)]
+
+            if validation is None:
+                validation = (False, [f"Could not verify custom domain {domain}: DNS lookups timed out, try again later"])
+
+            ret.append(validation)
+
+        return ret
+
+    def _validate_domain_for_owner(
+        self,
+        username: str,
+        domain: str
+    ) -> Tuple[bool, Optional[List[str]]]:
+        cached = self._domain_validations.get((domain, username))
+        if cached is not None:
+            return cached
+
+        return self._validate_domain_and_cache(username, domain)
+
+    def _validate_domain_and_cache(
+        self,
+        username: str,
+        domain: str
+    ) -> Tuple[bool, Optional[List[str]]]:
+        """Validate a domain without checking the cache first (the caller already missed it), caching the result"""
+        valid, remarks, ttl = self._validate_domain_uncached(username, domain)
+
+        if ttl is not None:
+            self._domain_validations.put((domain, username), (valid, remarks), ttl)
+
+        return (valid, remarks)
+
+    def _validate_domains_for_owners(
+        self,
+        keys: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Optional[Tuple[bool, Optional[List[str]]]]]:
+        """
+        Validate many (domain, owner) keys, cache misses are looked up concurrently
+
+        Keys whose lookups did not finish before the batch deadline map to None
+        """
+        ret = {}
+        misses = []
+
+        for key in keys:
+            if key in ret:
+                continue
+
+            cached = self._domain_validations.get(key)
+            ret[key] = cached
+
+            if cached is None:
+                misses.append(key)
+
+        def validate(key: Tuple[str, str]):
+            domain, username = key
+            return self._validate_domain_and_cache(username, domain)
+
+        for result in self._dns_fanout.map(validate, misses, timeout=config.proxmox.network.dns.batch_deadline):
+            if result.error is not None:
+                logger.info("could not validate domain", key=result.item, e=result.error)
+                continue
+
+            ret[result.item] = result.value
+
+        return ret
+
+    def _resolve_a_aaaa(
+        self,
+        domain: str
+    ) -> Tuple[Set[str], int]:
+        """
+        Returns the A and AAAA records of a domain and the lowest ttl among them
+
+        Lookups go through our own resolver so each one is bounded by its timeout. dnspython doesn't read /etc/hosts,
+        so when we're using the system resolvers a domain DNS has no addresses for falls back to getaddrinfo like before
         """
-        username = instance.metadata.owner
+        addresses = set()
+        ttl = config.proxmox.network.dns.max_ttl
+        not_found = None
 
+        try:
+            for rdtype in ['A', 'AAAA']:
+                try:
+                    answer = self._resolver.resolve(domain, rdtype)
+                    ttl = min(ttl, answer.rrset.ttl)
+                    addresses.update(map(lambda record: record.address, answer))
+                except dns.resolver.NoAnswer:
+                    pass
+        except dns.resolver.NXDOMAIN as e:
+            if config.proxmox.network.dns.nameservers is not None:
+                raise
+
+            not_found = e
+
+        if len(addresses) != 0 or config.proxmox.network.dns.nameservers is not None:
+            return addresses, ttl
+
+        try:
+            info_list = socket.getaddrinfo(domain, 80)
+        except socket.gaierror:
+            if not_found is not None:
+                raise not_found
+
+            return addresses, ttl
+
+        addresses = set(map(lambda info: info[4][0], filter(lambda x: x[0] in [socket.AddressFamily.AF_INET, socket.AddressFamily.AF_INET6], info_list)))
+
+        return addresses, ttl
+
+    def _validate_domain_uncached(
+        self,
+        username: str,
+        domain: str
+    ) -> Tuple[bool, Optional[List[str]], Optional[int]]:
+        """
+        Does the actual work of validate_domain, returns (valid, remarks, ttl)
+        
+        ttl is how long the result may be cached for or None if the result didn't depend on DNS
+        """
         txt_name = config.proxmox.network.vhosts.user_domain.verification_txt_name
         txt_content = username
 
@@ -1462,6 +3226,7 @@ version: 2
         split = domain.split(".")
 
         remarks = []
+        ttl = None
 
         # *.netsoc.cloud etc
         if domain.endswith(f".{base_domain}"):
@@ -1478,13 +3243,14 @@ version: 2
                 remarks.append(f"Invalid domain {domain}: the subdomain '{ split_prefix[-1] }'' is blacklisted")
 
         else: # custom domain
+            ttl = config.proxmox.network.dns.max_ttl
+
             try:
-                info_list = socket.getaddrinfo(domain, 80)
+                a_aaaa, a_aaaa_ttl = self._resolve_a_aaaa(domain)
+                ttl = min(ttl, a_aaaa_ttl)
             except Exception as e:
                 remarks.append(f"Could not verify custom domain: {e}, is the domain registered? (can take a 20-30 mins to update)")
-                return (False, remarks)
-
-            a_aaaa = set(map(lambda info: info[4][0], filter(lambda x: x[0] in [socket.AddressFamily.AF_INET, socket.AddressFamily.AF_INET6], info_list)))
+                return (False, remarks, config.proxmox.network.dns.negative_ttl)
             
             if len(a_aaaa) == 0:
                 remarks.append(f"Invalid domain {domain}: no A or AAAA records present")
@@ -1498,7 +3264,8 @@ version: 2
 
             # check for _netsoc.theirdomain.com 
             try:
-                q = dns.resolver.resolve(f"{txt_name}.{custom_base}", 'TXT')
+                q = self._resolver.resolve(f"{txt_name}.{custom_base}", 'TXT')
+                ttl = min(ttl, q.rrset.ttl)
 
                 # dnspython returns the TXT record value enclosed in quotation marks
                 # we will need to remove these
@@ -1513,10 +3280,16 @@ version: 2
             except Exception as e:
                 remarks.append(f"Invalid domain {domain}: error {e} (contact SysAdmins)")
 
+            # keep the record's ttl within our bounds, failures are retried sooner
+            ttl = min(max(ttl, config.proxmox.network.dns.min_ttl), config.proxmox.network.dns.max_ttl)
+
+            if len(remarks) != 0:
+                ttl = min(ttl, config.proxmox.network.dns.negative_ttl)
+
         if len(remarks) == 0:
-            return (True, None)
+            return (True, None, ttl)
         
-        return (False, remarks)
+        return (False, remarks, ttl)
 
     def add_instance_port(
         self,
@@ -1524,27 +3297,166 @@ version: 2
         external: int,
         internal: int
     ):
-        port_map = self.get_port_forward_map()
+        index = self._port_to_index(external)
+        if index is None:
+            start, end = config.proxmox.network.port_forward.range
+            raise exceptions.resource.Unavailable(f"Cannot map port {external} to {internal}, external ports must be between {start} and {end}")
 
-        if external in port_map:
-            raise exceptions.resource.Unavailable(f"Cannot map port {external} to {internal}, this port is currently taken by another user/another one of your instances")
-            
-        instance.metadata.network.ports[external] = internal
-        self.write_out_instance_metadata(instance)
+        taken = exceptions.resource.Unavailable(f"Cannot map port {external} to {internal}, this port is currently taken by another user/another one of your instances")
+
+        self._refresh_indexes()
+        port_index = self._get_port_index()
+
+        if not port_index.reserve(index):
+            raise taken
+
+        # other worker processes map ports from their own index, the shared reservation decides who gets it
+        if not self._get_reservations().reserve("port", str(external), config.proxmox.provisioning.reservation_ttl):
+            port_index.commit(index)
+            raise taken
+
+        def add_port(metadata: models.proxmox.Metadata):
+            metadata.network.ports[external] = internal
+
+        try:
+            self.write_out_instance_metadata(instance, add_port)
+        except Exception:
+            instance.metadata.network.ports.pop(external, None)
+            port_index.release(index)
+            self._get_reservations().release("port", str(external))
+            raise
+
+        port_index.commit(index)
+        self._settle("port", str(external))
 
     def remove_instance_port(
         self, 
         instance: models.proxmox.Instance,
         external: int
     ):
-        if external in instance.metadata.network.ports:
-            del instance.metadata.network.ports[external]
+        mapped = external in instance.metadata.network.ports
 
-        self.write_out_instance_metadata(instance)
+        def remove_port(metadata: models.proxmox.Metadata):
+            metadata.network.ports.pop(external, None)
 
-    def build_traefik_config(
+        self.write_out_instance_metadata(instance, remove_port)
+
+        # ports outside the range (mapped before it existed) were never in the index
+        index = self._port_to_index(external)
+        if mapped and index is not None:
+            self._get_port_index().release(index)
+            self._get_reservations().release("port", str(external))
+
+    def _get_traefik_vhost_fragment(
         self,
+        instance: models.proxmox.Instance,
         web_entrypoints: List[str]
+    ) -> Tuple[str, Optional[Tuple[dict, dict]]]:
+        """Returns the fingerprint of an instances vhost config and the cached (routers, services) for it if still fresh"""
+
+        fingerprint = hashlib.sha256(
+            f"{instance.metadata.owner}\n{web_entrypoints}\n{instance.metadata.network.json()}".encode("utf-8")
+        ).hexdigest()
+
+        with self._traefik_lock:
+            cached = self._traefik_fragments.get(instance.fqdn)
+
+        if cached is not None:
+            cached_fingerprint, built_at, routers, services = cached
+
+            if cached_fingerprint == fingerprint and (time.monotonic() - built_at) < config.proxmox.network.traefik.revalidate_interval:
+                return fingerprint, (routers, services)
+
+        return fingerprint, None
+
+    def _build_traefik_vhost_fragment(
+        self,
+        instance: models.proxmox.Instance,
+        web_entrypoints: List[str],
+        validations: Optional[Dict[Tuple[str, str], Optional[Tuple[bool, Optional[List[str]]]]]] = None
+    ) -> Tuple[dict, dict]:
+        """
+        Returns the (routers, services) traefik needs for an instances vhosts
+
+        Fragments are cached against the instances network metadata, they are only rebuilt (and the vhosts re-validated)
+        when that changes or the fragment is older than the revalidation interval
+
+        validations can hold already looked up (domain, owner) validations, None meaning the lookup timed out
+        """
+        fingerprint, cached = self._get_traefik_vhost_fragment(instance, web_entrypoints)
+
+        if cached is not None:
+            return cached
+
+        if validations is None:
+            validations = {}
+
+        built_at = time.monotonic()
+        fqdn_prefix = instance.fqdn.replace('.', '-')
+
+        routers = {}
+        services = {}
+
+        # don't hold on to a fragment that's missing vhosts because DNS was slow
+        cacheable = True
+
+        for vhost, options in instance.metadata.network.vhosts.items():
+            if (vhost, instance.metadata.owner) in validations:
+                validation = validations[(vhost, instance.metadata.owner)]
+
+                if validation is None:
+                    cacheable = False
+                    continue
+
+                valid, remarks = validation
+            else:
+                valid, remarks = self.validate_domain(instance, vhost)
+            
+            vhost_suffix = vhost.replace('.', '-')
+
+            if valid is True:
+                if vhost.endswith(config.proxmox.network.vhosts.service_subdomain.base_domain):
+                    routers[f"{fqdn_prefix}-{vhost_suffix}"] = {
+                        "entrypoints": web_entrypoints,
+                        "rule": f"Host(`{vhost}`)",
+                        "service": f"{fqdn_prefix}-{vhost_suffix}",
+                        "tls": {
+                            "certResolver": f"{ config.proxmox.network.traefik.service_subdomain_cert_resolver }",
+                        }
+                    }
+                else:
+                    routers[f"{fqdn_prefix}-{vhost_suffix}"] = {
+                        "entrypoints": web_entrypoints,
+                        "rule": f"Host(`{vhost}`)",
+                        "service": f"{fqdn_prefix}-{vhost_suffix}",
+                        "tls": {
+                            "certResolver": f"{ config.proxmox.network.traefik.user_domain_cert_resolver }",
+                        }
+                    }
+
+                proto = "http"
+
+                if options.https is True:
+                    proto = "https"
+
+                services[f"{fqdn_prefix}-{vhost_suffix}"] = {
+                    "loadBalancer": {
+                        "servers": [{ 
+                            "url": f"{ proto }://{instance.metadata.network.nic_allocation.addresses[0].ip}:{ options.port }"
+                        }]
+                    }
+                }
+
+        if cacheable == True:
+            with self._traefik_lock:
+                self._traefik_fragments[instance.fqdn] = (fingerprint, built_at, routers, services)
+
+        return routers, services
+
+    def build_traefik_config(
+        self,
+        web_entrypoints: List[str],
+        instances: Dict[str, models.proxmox.Instance] = None
     ) -> dict:
         """
         Return a traefik config that will add rules for doing port mappings and
@@ -1554,59 +3466,38 @@ version: 2
         # so we gotta omit them by checking if the base key is already in the dict everywhere
         c = {}
 
-        services = {}
-        routers = {}
+        if instances == None:
+            instances = self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age)
 
-        instances = self.read_all_instances(ignore_errors=True)
+        # forget fragments of instances that no longer exist
+        with self._traefik_lock:
+            for fqdn in list(self._traefik_fragments.keys()):
+                if fqdn not in instances:
+                    del self._traefik_fragments[fqdn]
 
+        # validate the vhosts of every instance whose fragment needs rebuilding in one go
+        stale = []
         for fqdn, instance in instances.items():
-            fqdn_prefix = instance.fqdn.replace('.', '-')
-
-            # first do vhosts
-            for vhost, options in instance.metadata.network.vhosts.items():
-                valid, remarks = self.validate_domain(instance, vhost)
-                
-                vhost_suffix = vhost.replace('.', '-')
+            fingerprint, cached = self._get_traefik_vhost_fragment(instance, web_entrypoints)
 
-                if valid is True:
-                    if 'http' not in c:
-                        c['http'] = {
-                            'routers': {},
-                            'services': {}
-                        }
-                    
-                    if vhost.endswith(config.proxmox.network.vhosts.service_subdomain.base_domain):
-                        c['http']['routers'][f"{fqdn_prefix}-{vhost_suffix}"] = {
-                            "entrypoints": web_entrypoints,
-                            "rule": f"Host(`{vhost}`)",
-                            "service": f"{fqdn_prefix}-{vhost_suffix}",
-                            "tls": {
-                                "certResolver": f"{ config.proxmox.network.traefik.service_subdomain_cert_resolver }",
-                            }
-                        }
-                    else:
-                        c['http']['routers'][f"{fqdn_prefix}-{vhost_suffix}"] = {
-                            "entrypoints": web_entrypoints,
-                            "rule": f"Host(`{vhost}`)",
-                            "service": f"{fqdn_prefix}-{vhost_suffix}",
-                            "tls": {
-                                "certResolver": f"{ config.proxmox.network.traefik.user_domain_cert_resolver }",
-                            }
-                        }
+            if cached is None:
+                stale += [(vhost, instance.metadata.owner) for vhost in instance.metadata.network.vhosts]
 
-                    proto = "http"
+        validations = self._validate_domains_for_owners(stale)
 
-                    if options.https is True:
-                        proto = "https"
+        # first do vhosts
+        for fqdn, instance in instances.items():
+            routers, services = self._build_traefik_vhost_fragment(instance, web_entrypoints, validations)
 
-                    c['http']['services'][f"{fqdn_prefix}-{vhost_suffix}"] = {
-                        "loadBalancer": {
-                            "servers": [{ 
-                                "url": f"{ proto }://{instance.metadata.network.nic_allocation.addresses[0].ip}:{ options.port }"
-                            }]
-                        }
+            if len(routers) > 0:
+                if 'http' not in c:
+                    c['http'] = {
+                        'routers': {},
+                        'services': {}
                     }
 
+                c['http']['routers'].update(routers)
+                c['http']['services'].update(services)
 
         # then do tcp/udp port mappings
         for external_port, internal_tuple in self.get_port_forward_map(instances).items():
@@ -1653,3 +3544,38 @@ version: 2
             
 
         return c
+
+    def build_serialized_traefik_config(
+        self,
+        web_entrypoints: List[str]
+    ) -> Tuple[str, str]:
+        """
+        Returns the traefik config serialized as JSON along with an ETag of its contents
+
+        The config is only rebuilt when the instance inventory changes or the revalidation interval passes,
+        so repeated polls are served without touching the cluster or DNS
+        """
+        # read the version before the instances so a change that races with the read causes a rebuild next time
+        version = self.inventory.version
+
+        with self._traefik_lock:
+            if self._traefik_serialized is not None:
+                built_version, built_entrypoints, built_at, serialized, etag = self._traefik_serialized
+
+                if built_version == version and built_entrypoints == web_entrypoints and (time.monotonic() - built_at) < config.proxmox.network.traefik.revalidate_interval:
+                    return serialized, etag
+
+        def build() -> Tuple[str, str]:
+            built_at = time.monotonic()
+            instances = self.read_all_instances(ignore_errors=True, max_age=config.proxmox.inventory.max_age)
+
+            serialized = json.dumps(self.build_traefik_config(web_entrypoints, instances), sort_keys=True, separators=(',', ':'))
+            etag = f'"{hashlib.sha256(serialized.encode("utf-8")).hexdigest()}"'
+
+            with self._traefik_lock:
+                self._traefik_serialized = (version, web_entrypoints, built_at, serialized, etag)
+
+            return serialized, etag
+
+        # polls that see the same inventory version share a build, a poll after a change builds again
+        return self._flights.do(("traefik", json.dumps(web_entrypoints), version), build)
@@ -1,3 +1,4 @@
 from . import signups
 from . import accounts
-from . import proxmox
\ No newline at end of file
+from . import proxmox
+from . import jobs
\ No newline at end of file
@@ -0,0 +1,32 @@
+import structlog as logging
+
+from fastapi import APIRouter, Depends
+
+from v1 import providers, models, exceptions, utilities
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get(
+    '/{job_id}',
+    status_code=200,
+    response_model=models.job.Job,
+    responses={400: {"model": models.rest.Error}}
+)
+def get_job(
+    job_id: str,
+    bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
+):
+    """Status/progress of a background job started by an earlier request"""
+    try:
+        job = providers.jobs.read(job_id)
+    except exceptions.resource.NotFound:
+        raise exceptions.rest.Error(status_code=404, detail=models.rest.Detail(
+            msg="No such job"
+        ))
+
+    if job.owner != bearer_account.username:
+        utilities.auth.ensure_sysadmin(bearer_account)
+
+    return job
@@ -1,10 +1,12 @@
 import os
 import time
+import threading
 import structlog as logging
 
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Path, Query, Response, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, Path, Query, Request, Response, UploadFile, File
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from pydantic import BaseModel, Field
 
@@ -49,6 +51,7 @@ def ensure_not_tos_suspended(instance: models.proxmox.Instance):
     responses={400: {"model": models.rest.Error}}
 )
 def get_traefik_config(
+    request: Request,
     key: str = ""
 ):
     if key != config.proxmox.network.traefik.config_key:
@@ -56,8 +59,64 @@ def get_traefik_config(
             msg=f"invalid config key"
         ))
 
+    serialized, etag = providers.proxmox.build_serialized_traefik_config("web-secure")
 
-    return providers.proxmox.build_traefik_config("web-secure")
+    # Traefik polls this constantly, let it know when nothing has changed
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*" or etag in map(lambda tag: tag.strip().replace("W/", "", 1), if_none_match.split(",")):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    return Response(content=serialized, media_type="application/json", headers={"ETag": etag})
+
+@router.get(
+    '/vhost-conflicts',
+    status_code=200,
+    response_model=Dict[str, List[models.proxmox.VHostClaim]],
+    responses={400: {"model": models.rest.Error}}
+)
+def get_vhost_conflicts(
+    bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
+):
+    """Domains claimed as a vhost by more than one instance"""
+    utilities.auth.ensure_sysadmin(bearer_account)
+
+    return providers.proxmox.get_vhost_conflicts()
+
+@router.post(
+    '/placement-dry-run',
+    status_code=200,
+    response_model=models.proxmox.Placement,
+    responses={400: {"model": models.rest.Error}}
+)
+def get_placement_dry_run(
+    specs: models.proxmox.Specs,
+    bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
+):
+    """Which node an instance with these specs would be created on right now, and how every node scored"""
+    utilities.auth.ensure_sysadmin(bearer_account)
+
+    return providers.proxmox.plan_placement(specs)
+
+@router.post(
+    '/template-refresh',
+    status_code=200,
+    response_model=models.rest.Info,
+    responses={400: {"model": models.rest.Error}}
+)
+def refresh_templates(
+    bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
+):
+    """Re-read the template catalogue from Proxmox straight away, e.g. after adding or changing a template"""
+    utilities.auth.ensure_sysadmin(bearer_account)
+
+    catalogue = providers.proxmox.refresh_templates()
+
+    return models.rest.Info(
+        detail=models.rest.Detail(
+            msg=f"Refreshed {sum(map(len, catalogue.values()))} templates"
+        )
+    )
 
 @router.get(
     '/{email_or_username}/{instance_type}-templates',
@@ -191,16 +250,68 @@ def get_instance_request(
     
     return request
 
+@providers.jobs.handler("create-instance")
+def create_instance_job(
+    job_id: str,
+    payload: dict
+):
+    instance_type = models.proxmox.Type(payload["instance_type"])
+    resource_account = providers.accounts.find_verified_account(payload["username"])
+    hostname = payload["hostname"]
+
+    try:
+        providers.jobs.set_progress(job_id, "Creating instance")
+
+        providers.proxmox.create_instance(
+            instance_type,
+            resource_account,
+            hostname,
+            models.proxmox.InstanceRequestDetail(**payload["detail"])
+        )
+
+        providers.jobs.set_progress(job_id, "Sending email")
+
+        providers.email.send(
+            [resource_account.email],
+            f"{fancy_name(instance_type)} request '{hostname}' accepted!",
+            templates.email.netsoc.render(
+                heading=f"{fancy_name(instance_type)} request '{hostname}' accepted",
+                paragraph=
+                f"""Hi {resource_account.username}!<br/><br/>
+                    We received your request for a {fancy_name(instance_type)} named '{hostname}'<br/>
+                    We're delighted to inform you that your instance request has been granted!<br/>
+                    For guides on how to SSH into your instance, please consult the <a style="color: white" href='https://tutorial.netsoc.co'>tutorial</a>
+                    <br/>
+                """
+            ),
+            "text/html"
+        )
+
+        utilities.webhook.info(
+            f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` was emailed about installation!**"""
+        )
+
+    except Exception as e:
+        utilities.webhook.info(
+            f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` install task failed: ```{e}```!**"""
+        )
+        raise e
+
+    utilities.webhook.info(
+        f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` was installed!**"""
+    )
+
 @router.post(
     '/{email_or_username}/{instance_type}-request/{hostname}/approval',
     status_code=201,
+    response_model=models.job.Job,
     responses={400: {"model": models.rest.Error}}
 )
 def approve_instance_request(
     email_or_username: str,
     instance_type: models.proxmox.Type,
     token: str,
-    background_tasks: BackgroundTasks,
+    response: Response,
     hostname: str = Path(**models.proxmox.Hostname),
     bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account),
 ):
@@ -235,50 +346,104 @@ def approve_instance_request(
             msg=f"Token is for a hostname other than {hostname}"
         ))
 
-    def creation_task():
-        try:
-            providers.proxmox.create_instance(
-                instance_type,
-                resource_account,
-                hostname,
-                request.detail
-            )
-
-            providers.email.send(
-                [resource_account.email],
-                f"{fancy_name(instance_type)} request '{hostname}' accepted!",
-                templates.email.netsoc.render(
-                    heading=f"{fancy_name(instance_type)} request '{hostname}' accepted",
-                    paragraph=
-                    f"""Hi {resource_account.username}!<br/><br/>
-                        We received your request for a {fancy_name(instance_type)} named '{hostname}'<br/>
-                        We're delighted to inform you that your instance request has been granted!<br/>
-                        For guides on how to SSH into your instance, please consult the <a style="color: white" href='https://tutorial.netsoc.co'>tutorial</a>
-                        <br/>
-                    """
-                ),
-                "text/html"
-            )
-
-            utilities.webhook.info(
-                f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` was emailed about installation!**"""
-            )
+    template = providers.proxmox.read_template(instance_type, request.detail.template_id)
+
+    job = providers.jobs.enqueue(
+        "create-instance",
+        resource_account.username,
+        {
+            "instance_type": instance_type.value,
+            "username": resource_account.username,
+            "hostname": hostname,
+            "detail": request.detail.dict()
+        },
+        # the template is cloned on its own node first
+        node=template.node
+    )
+
+    utilities.webhook.info(
+        f"""**{resource_account.username} ({resource_account.email}) request for an instance named `{hostname}` was granted! Install job started...**"""
+    )
 
+    response.headers["Location"] = f"/v1/jobs/{job.id}"
+    return job
+    
+
+@providers.jobs.handler("bulk-create-instances")
+def bulk_create_instances_job(
+    job_id: str,
+    payload: dict
+):
+    instance_requests = [models.proxmox.BulkInstanceRequest(**request) for request in payload["requests"]]
+    keys = [f"{request.username}/{request.type.value}/{request.hostname}" for request in instance_requests]
+
+    stages = { key: "queued" for key in keys }
+    lock = threading.Lock()
+
+    def on_progress(key: str, stage: str):
+        with lock:
+            stages[key] = stage
+            finished = len([stage for stage in stages.values() if stage == "created" or stage.startswith("failed")])
+
+            providers.jobs.set_progress(job_id, f"{finished}/{len(keys)} instances finished", stages)
+
+    creations = []
+    creation_keys = []
+    for key, request in zip(keys, instance_requests):
+        try:
+            account = providers.accounts.find_verified_account(request.username)
         except Exception as e:
-            utilities.webhook.info(
-                f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` install task failed: ```{e}```!**"""
-            )
-            raise e
+            on_progress(key, f"failed: {e}")
+            continue
 
-        utilities.webhook.info(
-            f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` was installed!**"""
-        )
+        creations.append((request.type, account, request.hostname, request.detail))
+        creation_keys.append(key)
+
+    providers.proxmox.create_instances(creations, lambda index, stage: on_progress(creation_keys[index], stage))
+
+    failed = [key for key, stage in stages.items() if stage != "created"]
 
     utilities.webhook.info(
-        f"""**{resource_account.username} ({resource_account.email}) request for an instance named `{hostname}` was granted! Install job started...**"""
+        f"""**Bulk creation of {len(keys)} instances finished, {len(failed)} failed{': ' + ', '.join(failed) if len(failed) > 0 else ''}**"""
     )
-    background_tasks.add_task(creation_task)
-    
+
+    if len(failed) > 0:
+        raise exceptions.resource.Unavailable(f"{len(failed)} of {len(keys)} instances could not be created")
+
+@router.post(
+    '/bulk-instances',
+    status_code=201,
+    response_model=models.job.Job,
+    responses={400: {"model": models.rest.Error}}
+)
+def bulk_create_instances(
+    instance_requests: List[models.proxmox.BulkInstanceRequest],
+    response: Response,
+    bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
+):
+    """Create many instances at once (e.g. for workshops) without going through the request/approval process"""
+    utilities.auth.ensure_sysadmin(bearer_account)
+
+    # progress is tracked per username/type/hostname, the same instance twice would be one entry
+    keys = [f"{request.username}/{request.type.value}/{request.hostname}" for request in instance_requests]
+    duplicates = sorted(set(key for key in keys if keys.count(key) > 1))
+    if len(duplicates) > 0:
+        raise exceptions.rest.Error(status_code=400, detail=models.rest.Detail(
+            msg=f"Instances requested more than once: {', '.join(duplicates)}"
+        ))
+
+    job = providers.jobs.enqueue(
+        "bulk-create-instances",
+        bearer_account.username,
+        { "requests": [request.dict() for request in instance_requests] }
+    )
+
+    utilities.webhook.info(
+        f"""**{bearer_account.username} ({bearer_account.email}) started bulk creation of {len(instance_requests)} instances...**"""
+    )
+
+    response.headers["Location"] = f"/v1/jobs/{job.id}"
+    return job
 
 @router.post(
     '/{email_or_username}/{instance_type}-request/{hostname}/denial',
@@ -353,15 +518,16 @@ def deny_instance_request(
     '/{email_or_username}/{instance_type}',
     status_code=200,
 )
-def get_instances(
+async def get_instances(
     email_or_username: str,
     instance_type: models.proxmox.Type,
     bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
 ):
-    resource_account = providers.accounts.find_verified_account(email_or_username)
+    # FreeIPA is only reachable synchronously, keep it off the event loop
+    resource_account = await run_in_threadpool(providers.accounts.find_verified_account, email_or_username)
     utilities.auth.ensure_sysadmin_or_acting_on_self(bearer_account, resource_account)
 
-    return providers.proxmox.read_instances_by_account(instance_type, resource_account)
+    return await providers.proxmox.read_instances_by_account_async(instance_type, resource_account, max_age=config.proxmox.inventory.max_age)
 
 @router.post(
     '/{email_or_username}/{instance_type}/{hostname}/start',
@@ -613,6 +779,50 @@ def remove_instance_vhost(
     )
 
 
+# resetting again after a partial failure just generates a fresh root user
+@providers.jobs.handler("reset-root-user", max_attempts=3)
+def reset_root_user_job(
+    job_id: str,
+    payload: dict
+):
+    instance_type = models.proxmox.Type(payload["instance_type"])
+    resource_account = providers.accounts.find_verified_account(payload["username"])
+    hostname = payload["hostname"]
+
+    try:
+        instance = providers.proxmox.read_instance_by_account(instance_type, resource_account, hostname)
+
+        providers.jobs.set_progress(job_id, "Resetting root user")
+        password, private_key, root_user = providers.proxmox.reset_instance_root_user(instance)
+    
+        providers.jobs.set_progress(job_id, "Sending email")
+        providers.email.send(
+            [resource_account.email],
+            f"{fancy_name(instance_type)} '{hostname}' root user information",
+            templates.email.netsoc.render(
+                heading=f"{fancy_name(instance_type)} '{hostname}' root user information",
+                paragraph=f"""Hi {resource_account.username}!<br/><br/>
+                    We successfully set the password and SSH identity for the root user on your {fancy_name(instance_type)} named '{hostname}'<br/><br/>
+                    You will find the password followed by the SSH private key for the user <code>root</code> below:<br/>
+                """,
+                embeds=[
+                    { "text": f"<code>{password}</code>" },
+                    { "text": f"<pre>{private_key}</pre>" }
+                ]
+            ),
+            "text/html"
+        )
+
+    except Exception as e:
+        utilities.webhook.info(
+            f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` reset password task failed: ```{e}```!**"""
+        )
+        raise e
+
+    utilities.webhook.info(
+        f"""**{resource_account.username} ({resource_account.email}) reset instance `{hostname}` root user**"""
+    )
+
 @router.post(
     '/{email_or_username}/{instance_type}/{hostname}/reset-root-user',
     status_code=200,
@@ -621,7 +831,7 @@ def remove_instance_vhost(
 def reset_instance_root_user(
     email_or_username: str,
     instance_type: models.proxmox.Type,
-    background_tasks: BackgroundTasks,
+    response: Response,
     hostname: str = Path(**models.proxmox.Hostname),
     bearer_account: models.account.Account = Depends(utilities.auth.get_bearer_account)
 ) -> models.rest.Info:
@@ -631,41 +841,22 @@ def reset_instance_root_user(
     instance = providers.proxmox.read_instance_by_account(instance_type, resource_account, hostname)
     ensure_active(instance)
 
-    def reset_password_task():
-        try:
-            password, private_key, root_user = providers.proxmox.reset_instance_root_user(instance)
-        
-            providers.email.send(
-                [resource_account.email],
-                f"{fancy_name(instance_type)} '{hostname}' root user information",
-                templates.email.netsoc.render(
-                    heading=f"{fancy_name(instance_type)} '{hostname}' root user information",
-                    paragraph=f"""Hi {resource_account.username}!<br/><br/>
-                        We successfully set the password and SSH identity for the root user on your {fancy_name(instance_type)} named '{hostname}'<br/><br/>
-                        You will find the password followed by the SSH private key for the user <code>root</code> below:<br/>
-                    """,
-                    embeds=[
-                        { "text": f"<code>{password}</code>" },
-                        { "text": f"<pre>{private_key}</pre>" }
-                    ]
-                ),
-                "text/html"
-            )
-
-        except Exception as e:
-            utilities.webhook.info(
-                f"""**{resource_account.username} ({resource_account.email})'s instance `{hostname}` reset password task failed: ```{e}```!**"""
-            )
-            raise e
-
-        utilities.webhook.info(
-            f"""**{resource_account.username} ({resource_account.email}) reset instance `{instance.hostname}` root user**"""
-        )
+    job = providers.jobs.enqueue(
+        "reset-root-user",
+        resource_account.username,
+        {
+            "instance_type": instance_type.value,
+            "username": resource_account.username,
+            "hostname": hostname
+        },
+        node=instance.node
+    )
 
     utilities.webhook.info(
         f"""**{resource_account.username} ({resource_account.email}) reset instance `{instance.hostname}` root user task started...**"""
     )
-    background_tasks.add_task(reset_password_task)
+
+    response.headers["Location"] = f"/v1/jobs/{job.id}"
 
     return models.rest.Info(
         detail=models.rest.Detail(
@@ -5,4 +5,12 @@ from . import captcha
 from . import yaml
 from . import password
 from . import shell
-from . import ssh
\ No newline at end of file
+from . import ssh
+from . import fanout
+from . import allocator
+from . import backoff
+from . import scheduler
+from . import async_proxmox
+from . import http
+from . import singleflight
+from . import reservations
\ No newline at end of file
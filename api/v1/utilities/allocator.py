@@ -0,0 +1,141 @@
+import time
+import random
+import threading
+
+from typing import Dict, Iterable, Optional
+
+class BitmapAllocator:
+    """
+        Hands out indexes in [0, size) using bitmaps of used, reserved and blocked indexes
+
+        An index is reserved while whatever it was handed out for is being created, then committed once it exists
+        or released if creation failed, so two callers can never be given the same index
+
+        The used set can be replaced with one read from somewhere else (see reset), commits and releases made
+        after that read started are kept so a slow read can't undo them
+    """
+
+    def __init__(self, size: int, blocked: Iterable[int] = (), start: int = 0):
+        """start is where reserve_any starts looking, allocators in different processes can each start somewhere else"""
+        self.size = size
+        self._lock = threading.Lock()
+        self._full = (1 << size) - 1
+        self._blocked = self._bits(blocked)
+        self._used = 0
+        self._reserved = 0
+        self._changed_at: Dict[int, float] = {}
+        self._cursor = start % size if size > 0 else 0
+
+    def _bits(
+        self,
+        indexes: Iterable[int]
+    ) -> int:
+        bits = 0
+        for index in indexes:
+            if 0 <= index < self.size:
+                bits |= 1 << index
+        return bits
+
+    def _free(self) -> int:
+        return self._full & ~(self._blocked | self._used | self._reserved)
+
+    def _find_free(
+        self,
+        start: int
+    ) -> Optional[int]:
+        """Lowest free index at or after start, wrapping around to the beginning"""
+        free = self._free()
+        if free == 0:
+            return None
+
+        after = (free >> start) << start
+        if after == 0:
+            after = free
+
+        # isolate the lowest set bit
+        return (after & -after).bit_length() - 1
+
+    def reserve_any(self) -> Optional[int]:
+        """Reserve the next free index after the last one handed out, None if everything is taken"""
+        with self._lock:
+            index = self._find_free(self._cursor)
+            if index is not None:
+                self._reserved |= 1 << index
+                self._cursor = (index + 1) % self.size
+            return index
+
+    def reserve(
+        self,
+        index: int
+    ) -> bool:
+        """Reserve a specific index, False if it is out of range or already taken"""
+        with self._lock:
+            if not 0 <= index < self.size or not (self._free() >> index) & 1:
+                return False
+            self._reserved |= 1 << index
+            return True
+
+    def commit(
+        self,
+        index: int
+    ):
+        """Mark an index as used, whether or not it was reserved first, indexes out of range are ignored"""
+        with self._lock:
+            if not 0 <= index < self.size:
+                return
+
+            self._reserved &= ~(1 << index)
+            self._used |= 1 << index
+            self._changed_at[index] = time.monotonic()
+
+    def release(
+        self,
+        index: int
+    ):
+        """Free an index that was reserved or used, indexes out of range are ignored"""
+        with self._lock:
+            if not 0 <= index < self.size:
+                return
+
+            self._reserved &= ~(1 << index)
+            self._used &= ~(1 << index)
+            self._changed_at[index] = time.monotonic()
+
+    def is_free(
+        self,
+        index: int
+    ) -> bool:
+        with self._lock:
+            return 0 <= index < self.size and bool((self._free() >> index) & 1)
+
+    def random_free(self) -> Optional[int]:
+        """A free index picked at random (without reserving it), None if everything is taken"""
+        with self._lock:
+            return self._find_free(random.randrange(self.size))
+
+    def free_count(self) -> int:
+        with self._lock:
+            return bin(self._free()).count("1")
+
+    def reset(
+        self,
+        used: Iterable[int],
+        taken_at: float
+    ):
+        """
+        Replace the used set with one that was read starting at taken_at (time.monotonic())
+
+        Reservations are left alone, and commits/releases made at or after taken_at win over the read
+        """
+        used = self._bits(used)
+
+        with self._lock:
+            for index, changed_at in list(self._changed_at.items()):
+                if changed_at < taken_at:
+                    del self._changed_at[index]
+                elif (self._used >> index) & 1:
+                    used |= 1 << index
+                else:
+                    used &= ~(1 << index)
+
+            self._used = used
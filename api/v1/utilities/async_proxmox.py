@@ -0,0 +1,174 @@
+import time
+import asyncio
+import httpx
+
+from typing import Any, Dict, Optional
+
+# Proxmox tickets are valid for 2 hours, renew well before that
+TICKET_LIFETIME = 60 * 60
+
+class ResourceException(Exception):
+    """An error response from the Proxmox API, the message is formatted the same as proxmoxer's"""
+
+    def __init__(self, status_code: int, reason: str, content: str):
+        self.status_code = status_code
+        super().__init__(f"{status_code} {reason}: {content}")
+
+class AsyncResource:
+    """A path in the Proxmox API, built up the same way as with proxmoxer e.g api.nodes(node).lxc(f"{vmid}/config")"""
+
+    def __init__(self, api: "AsyncProxmoxAPI", path: str):
+        self._api = api
+        self._path = path
+
+    def __getattr__(self, name: str) -> "AsyncResource":
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return self(name)
+
+    def __call__(self, *parts) -> "AsyncResource":
+        return AsyncResource(self._api, "/".join([self._path] + [str(part).strip("/") for part in parts]).strip("/"))
+
+    async def get(self, **params):
+        return await self._api.request("GET", self._path, params)
+
+    async def post(self, **params):
+        return await self._api.request("POST", self._path, params)
+
+    async def put(self, **params):
+        return await self._api.request("PUT", self._path, params)
+
+    async def delete(self, **params):
+        return await self._api.request("DELETE", self._path, params)
+
+class AsyncProxmoxAPI:
+    """
+        asyncio Proxmox API client, exposes the same resource paths as proxmoxer's ProxmoxAPI but every call is awaited
+
+        Every request goes through one shared connection pool with keep-alive. The pool is created on first use
+        and belongs to the event loop that used it, so the client must only be used from one event loop
+
+        base_url overrides where the API is, i.e to point the client at a fake Proxmox API served locally
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        port: int = 8006,
+        password: Optional[str] = None,
+        token_name: Optional[str] = None,
+        token_value: Optional[str] = None,
+        verify_ssl: bool = True,
+        max_connections: int = 32,
+        timeout: float = 30,
+        connect_timeout: float = 5,
+        base_url: Optional[str] = None
+    ):
+        # paths are joined onto the base url, which needs a trailing slash to keep its own path
+        self._base_url = (base_url if base_url is not None else f"https://{host}:{port}/api2/json").rstrip("/") + "/"
+        self._user = user
+        self._password = password
+        self._token_name = token_name
+        self._token_value = token_value
+        self._verify_ssl = verify_ssl
+        self._max_connections = max_connections
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._login_lock: Optional[asyncio.Lock] = None
+        self._ticket: Optional[str] = None
+        self._csrf_token: Optional[str] = None
+        self._ticket_at = 0.0
+
+    def __getattr__(self, name: str) -> AsyncResource:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        return AsyncResource(self, name)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url,
+                verify=self._verify_ssl,
+                timeout=self._timeout,
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections
+                )
+            )
+            self._login_lock = asyncio.Lock()
+
+        return self._client
+
+    async def _login(
+        self,
+        rejected_ticket: Optional[str] = None
+    ):
+        """Get a ticket with our password if we don't have a fresh one that works, only one login happens at once"""
+        async with self._login_lock:
+            if self._ticket is not None and self._ticket != rejected_ticket and time.monotonic() - self._ticket_at < TICKET_LIFETIME:
+                return
+
+            response = await self._get_client().post(
+                "access/ticket",
+                data={ "username": self._user, "password": self._password }
+            )
+            if response.status_code >= 400:
+                raise ResourceException(response.status_code, response.reason_phrase, response.text)
+
+            data = response.json()["data"]
+            self._ticket = data["ticket"]
+            self._csrf_token = data["CSRFPreventionToken"]
+            self._ticket_at = time.monotonic()
+
+    async def _auth_headers(
+        self,
+        method: str
+    ) -> Dict[str, str]:
+        if self._password is None:
+            return { "Authorization": f"PVEAPIToken={self._user}!{self._token_name}={self._token_value}" }
+
+        await self._login()
+
+        headers = { "Cookie": f"PVEAuthCookie={self._ticket}" }
+        if method != "GET":
+            headers["CSRFPreventionToken"] = self._csrf_token
+
+        return headers
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        """Make a request to the API, returns the data of the response or raises ResourceException"""
+        client = self._get_client()
+
+        if method in ("GET", "DELETE"):
+            kwargs = { "params": params }
+        else:
+            kwargs = { "data": params }
+
+        headers = await self._auth_headers(method)
+        ticket = self._ticket
+        response = await client.request(method, path, headers=headers, **kwargs)
+
+        # our ticket stopped working early, i.e the cluster restarted
+        if response.status_code == 401 and self._password is not None:
+            await self._login(rejected_ticket=ticket)
+            response = await client.request(method, path, headers=await self._auth_headers(method), **kwargs)
+
+        if response.status_code >= 400:
+            raise ResourceException(response.status_code, response.reason_phrase, response.text)
+
+        return response.json().get("data")
+
+    async def aclose(self):
+        """Close every pooled connection"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
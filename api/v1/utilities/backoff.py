@@ -0,0 +1,29 @@
+import time
+
+from typing import Callable
+
+def poll(
+    check: Callable[[], bool],
+    timeout: float,
+    initial_interval: float,
+    max_interval: float,
+    factor: float = 2
+) -> bool:
+    """
+    Call check until it returns True, sleeping exponentially longer between calls (up to max_interval)
+
+    Returns False if check still hasn't returned True after timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    interval = initial_interval
+
+    while True:
+        if check():
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * factor, max_interval)
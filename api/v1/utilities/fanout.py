@@ -0,0 +1,70 @@
+import time
+import concurrent.futures
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
+
+class Result(NamedTuple):
+    item: Any
+    value: Any
+    error: Optional[Exception]
+    seconds: float
+
+class FanOut:
+    """
+        Runs a blocking function over many items on a shared, bounded thread pool
+
+        The pool is shared by every caller so max_workers bounds the total number of calls in flight
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def map(
+        self,
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        ignore_errors: bool = True,
+        timeout: Optional[float] = None
+    ) -> List[Result]:
+        """
+        Call fn on every item concurrently, returns a Result per item in the order the items were given
+
+        If ignore_errors is False, the first error (in item order) is raised and any calls not yet started are cancelled
+
+        If timeout is given, items that have not finished after that many seconds get a TimeoutError result
+        (calls already running are left to finish in the background)
+        """
+
+        def timed(item):
+            start = time.monotonic()
+            try:
+                return Result(item, fn(item), None, time.monotonic() - start)
+            except Exception as e:
+                return Result(item, None, e, time.monotonic() - start)
+
+        items = list(items)
+        futures = [self._executor.submit(timed, item) for item in items]
+
+        if timeout is not None:
+            done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+
+            for pending in not_done:
+                pending.cancel()
+
+        results = []
+        for i, future in enumerate(futures):
+            if timeout is None or (future.done() and not future.cancelled()):
+                result = future.result()
+            else:
+                result = Result(items[i], None, TimeoutError(f"timed out after {timeout} seconds"), timeout)
+
+            if result.error is not None and ignore_errors == False:
+                for pending in futures[i+1:]:
+                    pending.cancel()
+
+                raise result.error
+
+            results.append(result)
+
+        return results
@@ -0,0 +1,80 @@
+import time
+import random
+import requests.adapters
+
+from typing import Callable, Optional, Tuple
+from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with full jitter, so clients that failed together don't all retry together"""
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+def get_retries(
+    total: int,
+    backoff_factor: float
+) -> Retry:
+    """Retry idempotent GETs that failed to connect, timed out or hit a proxy error, everything else fails straight away"""
+    return JitteredRetry(
+        total=total,
+        connect=total,
+        read=total,
+        status=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        # hand the last response back to the caller instead of raising, so it fails the same way it would have without retries
+        raise_on_status=False
+    )
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+        HTTPAdapter with a default timeout for requests that don't set one, which reports how long requests
+        waited for a free connection from its pool (with pool_block the pool never grows past pool_maxsize)
+    """
+
+    def __init__(
+        self,
+        timeout: Tuple[float, float],
+        on_pool_wait: Optional[Callable[[float], None]] = None,
+        **kwargs
+    ):
+        self._timeout = timeout
+        self._on_pool_wait = on_pool_wait
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        on_pool_wait = self._on_pool_wait
+        if on_pool_wait is None:
+            return
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            def _get_conn(self, timeout=None):
+                start = time.monotonic()
+                try:
+                    return super()._get_conn(timeout)
+                finally:
+                    on_pool_wait(time.monotonic() - start)
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            def _get_conn(self, timeout=None):
+                start = time.monotonic()
+                try:
+                    return super()._get_conn(timeout)
+                finally:
+                    on_pool_wait(time.monotonic() - start)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self._timeout
+
+        return super().send(request, timeout=timeout, **kwargs)
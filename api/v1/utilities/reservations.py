@@ -0,0 +1,147 @@
+import time
+import contextlib
+
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import create_engine, Column, Float, String, Text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+class ReservationRecord(Base):
+    __tablename__ = "reservations"
+
+    # what is reserved (i.e "ip") and which one, a key can only be held once
+    kind = Column(String(32), primary_key=True)
+    key = Column(String(64), primary_key=True)
+
+    value = Column(Text, nullable=True)
+
+    # unix time the reservation lapses at if it isn't released (i.e the process holding it died)
+    expires = Column(Float, nullable=False, index=True)
+
+class Reservations:
+    """
+        Keys held by one API worker process at a time, kept in a database shared by every process
+
+        Each process hands things out (IPs, ports, nodes) from its own view of what's in use, which only catches up
+        with what other processes did on its next read of the cluster. Holding a key here until then is what stops
+        two processes handing out the same thing in the meantime
+
+        Reservations lapse after their ttl, so ones left behind by a process that died don't leak
+    """
+
+    def __init__(self, database_url: str):
+        self._engine = create_engine(
+            database_url,
+            connect_args={"check_same_thread": False, "timeout": 30} if database_url.startswith("sqlite") else {}
+        )
+        Base.metadata.create_all(self._engine)
+        self._sessionmaker = sessionmaker(bind=self._engine)
+
+    @contextlib.contextmanager
+    def _session(self):
+        """A session committed when the block exits, holding the database's write lock (on SQLite) from the start"""
+        session = self._sessionmaker()
+        try:
+            if self._engine.dialect.name == "sqlite":
+                session.execute("BEGIN IMMEDIATE")
+
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _held(
+        self,
+        session,
+        kind: str,
+        now: float
+    ) -> Dict[str, Optional[str]]:
+        session.query(ReservationRecord).filter(
+            ReservationRecord.kind == kind,
+            ReservationRecord.expires <= now
+        ).delete(synchronize_session=False)
+
+        return dict(session.query(ReservationRecord.key, ReservationRecord.value).filter(ReservationRecord.kind == kind).all())
+
+    def reserve(
+        self,
+        kind: str,
+        key: str,
+        ttl: float,
+        value: Optional[str] = None
+    ) -> bool:
+        """Hold a key for ttl seconds, False if it is already held"""
+        now = time.time()
+
+        try:
+            with self._session() as session:
+                if key in self._held(session, kind, now):
+                    return False
+
+                session.add(ReservationRecord(kind=kind, key=key, value=value, expires=now + ttl))
+        except IntegrityError:
+            # databases without an up front write lock find out here
+            return False
+
+        return True
+
+    def reserve_with(
+        self,
+        kind: str,
+        key: str,
+        ttl: float,
+        choose: Callable[[Dict[str, Optional[str]]], str]
+    ) -> str:
+        """
+        Hold a key for ttl seconds with a value chosen by choose, which is called with the values of every held key
+        of the kind and can raise to hold nothing. Nobody else can reserve a key of the kind in between
+
+        Returns the chosen value
+        """
+        with self._session() as session:
+            value = choose(self._held(session, kind, time.time()))
+
+            session.merge(ReservationRecord(kind=kind, key=key, value=value, expires=time.time() + ttl))
+
+        return value
+
+    def renew(
+        self,
+        kind: str,
+        key: str,
+        ttl: float
+    ):
+        """Hold a key for ttl seconds from now, whether or not it is still held"""
+        with self._session() as session:
+            record = session.query(ReservationRecord).get((kind, key))
+
+            if record is None:
+                session.add(ReservationRecord(kind=kind, key=key, expires=time.time() + ttl))
+            else:
+                record.expires = time.time() + ttl
+
+    def release(
+        self,
+        kind: str,
+        key: str
+    ):
+        with self._session() as session:
+            session.query(ReservationRecord).filter(
+                ReservationRecord.kind == kind,
+                ReservationRecord.key == key
+            ).delete(synchronize_session=False)
+
+    def held(
+        self,
+        kind: str
+    ) -> Dict[str, Optional[str]]:
+        """Values of every key of a kind that is currently held"""
+        with self._session() as session:
+            return self._held(session, kind, time.time())
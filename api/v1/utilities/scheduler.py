@@ -0,0 +1,128 @@
+from typing import Callable, Dict, List, NamedTuple
+
+from v1 import models
+
+# specs are in Proxmox's units, memory in MiB and disk in GiB (size=NG), node usage is in bytes
+MiB = 1024 ** 2
+GiB = 1024 ** 3
+
+class NodeState(NamedTuple):
+    name: str
+
+    # bytes, disk is the storage instances are put on, maxdisk is 0 if the node doesn't have it
+    mem: float
+    maxmem: float
+    disk: float
+    maxdisk: float
+
+    # cpu is the load (0-1) across maxcpu cores
+    cpu: float
+    maxcpu: int
+
+    instances: int
+
+    # specs of instances that are still being created on the node
+    pending: List[models.proxmox.Specs]
+
+class Weights(NamedTuple):
+    memory: float
+    cpu: float
+    disk: float
+    instances: float
+
+class Limits(NamedTuple):
+    # most of a node's memory/disk that may be in use once the new instance is placed
+    max_memory_ratio: float
+    max_disk_ratio: float
+
+# strategy(load of each fitting node) -> name of the chosen node
+Strategy = Callable[[Dict[str, float]], str]
+
+strategies: Dict[str, Strategy] = {}
+
+def strategy(name: str):
+    """Decorator registering a placement strategy by name"""
+    def register(fn: Strategy):
+        strategies[name] = fn
+        return fn
+
+    return register
+
+@strategy("least-loaded")
+def least_loaded(loads: Dict[str, float]) -> str:
+    """Spread instances out, pick the node that will be least loaded"""
+    return min(sorted(loads), key=loads.get)
+
+@strategy("bin-packing")
+def bin_packing(loads: Dict[str, float]) -> str:
+    """Fill nodes up one at a time, pick the most loaded node the instance still fits on"""
+    return max(sorted(loads), key=loads.get)
+
+def score(
+    nodes: List[NodeState],
+    specs: models.proxmox.Specs,
+    weights: Weights,
+    limits: Limits
+) -> List[models.proxmox.NodeScore]:
+    """Work out whether specs fit on each node and how loaded each node would be (0-1ish) with it placed there"""
+    most_instances = max([node.instances + len(node.pending) for node in nodes] + [1])
+
+    scores = []
+    for node in nodes:
+        pending_mem = sum(pending.memory for pending in node.pending) * MiB
+        pending_disk = sum(pending.disk_space for pending in node.pending) * GiB
+
+        memory = (node.mem + pending_mem + specs.memory * MiB) / node.maxmem
+        disk = (node.disk + pending_disk + specs.disk_space * GiB) / node.maxdisk if node.maxdisk > 0 else 1
+        instances = (node.instances + len(node.pending) + 1) / (most_instances + 1)
+
+        remarks = []
+        if memory > limits.max_memory_ratio:
+            remarks.append("not enough memory")
+        if node.maxdisk <= 0:
+            remarks.append("no instance storage")
+        elif disk > limits.max_disk_ratio:
+            remarks.append("not enough disk")
+        if specs.cores > node.maxcpu:
+            remarks.append("not enough cores")
+
+        load = (
+            weights.memory * memory +
+            weights.cpu * node.cpu +
+            weights.disk * disk +
+            weights.instances * instances
+        ) / (weights.memory + weights.cpu + weights.disk + weights.instances)
+
+        scores.append(models.proxmox.NodeScore(
+            node=node.name,
+            fits=len(remarks) == 0,
+            load=load,
+            memory=memory,
+            cpu=node.cpu,
+            disk=disk,
+            instances=node.instances,
+            pending=len(node.pending),
+            remarks=remarks
+        ))
+
+    return scores
+
+def place(
+    strategy_name: str,
+    nodes: List[NodeState],
+    specs: models.proxmox.Specs,
+    weights: Weights,
+    limits: Limits
+) -> models.proxmox.Placement:
+    """Choose a node for specs with the named strategy, node is None if it doesn't fit anywhere"""
+    if strategy_name not in strategies:
+        raise ValueError(f"Unknown placement strategy {strategy_name}")
+
+    scores = score(nodes, specs, weights, limits)
+    loads = { node_score.node: node_score.load for node_score in scores if node_score.fits }
+
+    return models.proxmox.Placement(
+        strategy=strategy_name,
+        node=strategies[strategy_name](loads) if len(loads) > 0 else None,
+        scores=scores
+    )
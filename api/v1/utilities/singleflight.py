@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+        Coalesces concurrent calls with the same key, only one of them runs and the rest wait for it and share its
+        result (or exception)
+
+        Only calls already in flight are shared, a call made after one finishes always runs again. A caller that
+        joins a call part way through gets a result that may have been read before the caller itself started, so
+        callers that must see their own earlier writes shouldn't go through it
+
+        on_shared is called with the key every time a caller is handed another caller's result
+    """
+
+    def __init__(
+        self,
+        on_shared: Optional[Callable[[Hashable], None]] = None
+    ):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._on_shared = on_shared
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Any]
+    ) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            if self._on_shared is not None:
+                self._on_shared(key)
+
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+class AsyncSingleFlight:
+    """
+        SingleFlight for coroutines, the shared call runs as its own task so a caller giving up (being cancelled)
+        doesn't cancel it for everyone else
+
+        Must only be used from one event loop
+    """
+
+    def __init__(
+        self,
+        on_shared: Optional[Callable[[Hashable], None]] = None
+    ):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._on_shared = on_shared
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        future = self._calls.get(key)
+
+        if future is not None:
+            if self._on_shared is not None:
+                self._on_shared(key)
+        else:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+
+            def forget(done: asyncio.Future):
+                if self._calls.get(key) is done:
+                    del self._calls[key]
+
+                # nobody may be left waiting on it, don't warn about an exception that was never retrieved
+                if not done.cancelled():
+                    done.exception()
+
+            future.add_done_callback(forget)
+
+        return await asyncio.shield(future)